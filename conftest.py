@@ -0,0 +1,41 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_transformation import cube_measures
+
+def combined_reports(rows=300, shelters=20, states=('GA', 'TX', 'AL'), years=(2020, 2021, 2022), months=None,
+                     measures=cube_measures, high=20, seed=0):
+    """
+    Builds a cleaned combined dataframe of random reports: shelters spread over
+    the states and years, about a quarter of the reports annotated as duplicates
+    ('R'), and counts below high for each measure. With months, every shelter
+    instead reports each month from January 2020, in one state.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(['SHELTER %02d' % i for i in range(shelters)], dtype=object)
+    if months is not None:
+        rows = shelters * months
+        starts = pd.date_range('2020-01-01', periods=months, freq='MS')
+        df = pd.DataFrame({
+            'State': states[0],
+            'Shelter Name': np.repeat(names, months),
+            'Data Year': np.tile(starts.year, shelters),
+            'Shelter Name Annotation': np.nan,
+            'Report Period Start': np.tile(starts, shelters),
+        })
+    else:
+        df = pd.DataFrame({
+            'State': rng.choice(np.array(states, dtype=object), rows),
+            'Shelter Name': rng.choice(names, rows),
+            'Data Year': rng.choice(np.array(years, dtype=object), rows),
+            'Shelter Name Annotation': np.where(rng.random(rows) < 0.25, 'R', None),
+            'Report Period Start': pd.to_datetime('2020-01-01') + pd.to_timedelta(rng.integers(0, 900, rows), unit='D'),
+        })
+    df = df.infer_objects()
+    for column in measures:
+        df[column] = rng.integers(0, high, rows)
+    return df
+
+@pytest.fixture
+def make_combined():
+    return combined_reports
@@ -0,0 +1,261 @@
+## Source Adapters
+#
+# Each source of shelter reports is read by an adapter that fetches its
+# workbook through dataset_source.load_data, finds the header row, maps its
+# columns to the common schema of its kind and validates them before typing: 'georgia' for monthly shelter
+# exports, 'annotations' and 'best_friends' for the other two sources.
+# dataset_ingest.py loads the adapters of all sources concurrently.
+#
+# A regional export in the Georgia layout with its own column names is added
+# as another source:
+#
+#   SOURCES['alabama'] = GeorgiaExportAdapter('alabama', 'https://.../alabama.xlsx',
+#                                             columns={'Facility': 'Shelter Name'})
+
+import concurrent.futures
+import os
+
+import pandas as pd
+
+from dataset_cache import close_connections, local_path
+from dataset_validation import validate_source
+
+# Rows searched for the header of a workbook
+HEADER_SEARCH_ROWS = 20
+
+# Sources are mostly waiting on the network, so threads overlap well
+MAX_WORKERS = int(os.environ.get('SHELTER_SOURCE_WORKERS', 8))
+
+
+class SourceAdapter:
+    """
+    Reads one source workbook into a DataFrame with the columns of its kind.
+
+    Parameters:
+        name (str): The source name.
+        location (str): The URL or path of the workbook.
+        columns (dict): Source column name -> common column name.
+    """
+
+    kind = None
+    # A row holding all of these (after mapping) is the header row
+    required_columns = ['Shelter Name']
+
+    def __init__(self, name, location, columns=None):
+        self.name = name
+        self.location = location
+        self.columns = dict(columns or {})
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name!r}, {self.location!r}, columns={self.columns!r})"
+
+    def signature(self):
+        """
+        Describes how the source is parsed; a change means its ingested copy is rebuilt.
+        """
+        return f"{type(self).__name__}:{self.kind}:{sorted(self.columns.items())}"
+
+    def fetch(self, cache_dir=None, offline=False, validated=None):
+        """
+        Reads the raw workbook; remote workbooks go through the on-disk cache.
+
+        Parameters:
+            validated (tuple): The validator and downloaded bytes of a remote
+                workbook already checked for changes, which are used instead of
+                requesting it again (see dataset_cache.load_cached).
+
+        Returns:
+            pd.DataFrame: The sheet as pd.read_excel returns it, or None if it could not be loaded.
+        """
+        from dataset_source import load_data
+
+        if local_path(self.location) is None:
+            return load_data(self.location, cache_dir=cache_dir, offline=offline, validated=validated)
+        return pd.read_excel(local_path(self.location))
+
+    def detect_header(self, raw):
+        """
+        Finds the header row: the first row naming every required column.
+
+        Returns:
+            int: Position of the header among the rows of raw, or -1 if the
+            column labels of raw already are the header.
+
+        Raises:
+            ValueError: If no header is found in the first HEADER_SEARCH_ROWS rows.
+        """
+        def is_header(labels):
+            names = {self.columns.get(label, label) for label in labels if isinstance(label, str)}
+            return all(column in names for column in self.required_columns)
+
+        if is_header(raw.columns):
+            return -1
+        for position in range(min(HEADER_SEARCH_ROWS, len(raw))):
+            if is_header(raw.iloc[position].tolist()):
+                return position
+        raise ValueError(f"No header row naming {', '.join(self.required_columns)} in the first "
+                         f"{HEADER_SEARCH_ROWS} rows of {self.location}")
+
+    def parse(self, raw, header_row):
+        """
+        Applies the header row and drops the unnamed empty columns around the data.
+        """
+        if header_row >= 0:
+            raw = pd.DataFrame(raw.values[header_row + 1:], columns=raw.iloc[header_row].tolist())
+        unnamed = [column for column in raw.columns
+                   if not isinstance(column, str) or column.startswith('Unnamed:') or column == '']
+        empty = [column for column in unnamed if raw[column].isna().all()]
+        return raw.drop(columns=empty)
+
+    def map_columns(self, df):
+        """
+        Renames the source columns to the common schema.
+        """
+        return df.rename(columns=self.columns)
+
+    def validate(self, df):
+        """
+        Checks the mapped columns and their values (see dataset_validation.py).
+
+        Raises:
+            SchemaError: If the source does not match the schema of its kind.
+        """
+        return validate_source(self.kind, df, name=self.name)
+
+    def convert(self, df):
+        """
+        Converts the validated columns to their types.
+        """
+        return df
+
+    def load(self, cache_dir=None, offline=False, validated=None):
+        """
+        Fetches, parses, maps, validates and types the source. validated is passed to fetch.
+
+        Returns:
+            pd.DataFrame: The source in the common schema, or None if it could not be loaded.
+
+        Raises:
+            SchemaError: If the source does not match the schema of its kind.
+        """
+        raw = self.fetch(cache_dir=cache_dir, offline=offline, validated=validated)
+        if raw is None:
+            return None
+        df = self.validate(self.map_columns(self.parse(raw, self.detect_header(raw))))
+        return self.convert(df).reset_index(drop=True)
+
+
+class GeorgiaExportAdapter(SourceAdapter):
+    """
+    A monthly shelter export in the layout of the Georgia Department of
+    Agriculture: descriptive columns, the report period, then integer counts.
+    """
+
+    kind = 'georgia'
+    required_columns = ['Shelter Name', 'Report Period Start']
+
+    def parse(self, raw, header_row):
+        from dataset_transformation import parse_georgia_headers
+
+        if header_row >= 0 and not isinstance(raw.iloc[header_row, 0], str):
+            # The state's own layout, with an empty first column
+            return parse_georgia_headers(raw, header_row=header_row)
+        return super().parse(raw, header_row).dropna(axis=1, how='all')
+
+    def convert(self, df):
+        from dataset_transformation import coerce_georgia_types
+
+        return coerce_georgia_types(df)
+
+
+class AnnotationsAdapter(SourceAdapter):
+    """
+    The Shelter Name Annotations workbook. Its empty first column is part of
+    the stored layout, so it is kept.
+    """
+
+    kind = 'annotations'
+
+    def parse(self, raw, header_row):
+        if header_row >= 0:
+            return super().parse(raw, header_row)
+        return raw
+
+
+class BestFriendsAdapter(SourceAdapter):
+    """
+    The Best Friends Animal Society data request workbook.
+    """
+
+    kind = 'best_friends'
+
+
+# Adapter of each default source
+ADAPTERS = {
+    'georgia': GeorgiaExportAdapter,
+    'annotations': AnnotationsAdapter,
+    'best_friends': BestFriendsAdapter,
+}
+
+
+def make_adapter(name, source):
+    """
+    Returns the adapter of a source given as an adapter or as a URL or path.
+
+    Raises:
+        ValueError: If a URL or path is given for a source without a default adapter.
+    """
+    if isinstance(source, SourceAdapter):
+        return source
+    if name not in ADAPTERS:
+        raise ValueError(f"No adapter for source {name!r}; give a SourceAdapter instead of a location")
+    return ADAPTERS[name](name, source)
+
+
+def run_concurrently(func, names, workers=None):
+    """
+    Calls func(name) for each name in a thread pool.
+
+    Parameters:
+        func (callable): Loads one source.
+        names (list): The source names.
+        workers (int): Number of threads. Defaults to one per source, at most MAX_WORKERS.
+
+    Returns:
+        dict: Name -> result, in the order of names.
+    """
+    names = list(names)
+    if not names:
+        return {}
+    workers = min(workers or MAX_WORKERS, len(names))
+    if workers == 1:
+        return {name: func(name) for name in names}
+
+    def task(name):
+        try:
+            return func(name)
+        finally:
+            # Worker threads end with the pool; do not leave their connections open
+            close_connections()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='source') as executor:
+        futures = {name: executor.submit(task, name) for name in names}
+        return {name: futures[name].result() for name in names}
+
+
+def load_sources(sources, cache_dir=None, offline=False, workers=None):
+    """
+    Loads several sources concurrently without converting them to Arrow.
+
+    Parameters:
+        sources (dict): Source name -> SourceAdapter, URL or path.
+        cache_dir (str): Cache directory used for remote workbooks.
+        offline (bool): Only use the local cache for remote workbooks.
+        workers (int): Number of threads.
+
+    Returns:
+        dict: Source name -> DataFrame (None for sources that failed to load).
+    """
+    adapters = {name: make_adapter(name, source) for name, source in sources.items()}
+    return run_concurrently(lambda name: adapters[name].load(cache_dir=cache_dir, offline=offline), adapters,
+                            workers=workers)
@@ -0,0 +1,118 @@
+## Shared Aggregation Engine
+#
+# Builds one State x Shelter Name x Data Year x Duplicate cube of summed
+# measures in a single grouped pass over the combined dataframe. Every report
+# is then answered as a slice of the cube instead of re-filtering and
+# re-grouping the full frame. The cube is saved as Parquet for reuse.
+
+import os
+
+import pandas as pd
+
+CUBE_PATH = os.environ.get('SHELTER_CUBE_PATH', os.path.join('aggregates', 'shelter_cube.parquet'))
+
+# Dimensions of the cube; Duplicate marks rows annotated 'R'
+CUBE_KEYS = ['State', 'Shelter Name', 'Data Year', 'Duplicate']
+
+
+def build_cube(combined_df, measures):
+    """
+    Sums the measure columns by state, shelter, year and duplicate flag in one pass.
+
+    Parameters:
+        combined_df (pd.DataFrame): The cleaned combined dataframe.
+        measures (list): The count columns to sum.
+
+    Returns:
+        pd.DataFrame: One row per State, Shelter Name, Data Year and Duplicate
+        combination with a column per measure. Rows without a numeric year are
+        kept with a missing Data Year.
+    """
+    keys = [
+        combined_df['State'],
+        combined_df['Shelter Name'],
+        pd.to_numeric(combined_df['Data Year'], errors='coerce'),
+        (combined_df['Shelter Name Annotation'] == 'R').rename('Duplicate'),
+    ]
+    cube = combined_df[measures].groupby(keys, dropna=False, observed=True).sum().reset_index()
+
+    # The cube is small, so keep plain dimension values and float sums that
+    # cannot overflow the compact count types of the input
+    for key in ['State', 'Shelter Name']:
+        cube[key] = cube[key].astype(object)
+    cube[measures] = cube[measures].astype('float64')
+    return cube
+
+
+def combine_cubes(cubes, measures):
+    """
+    Adds up cubes built from separate chunks of rows.
+
+    Parameters:
+        cubes (list): Cubes returned by build_cube over the same measures.
+        measures (list): The measure columns.
+
+    Returns:
+        pd.DataFrame: The cube of all the rows, as build_cube would return it.
+    """
+    combined = pd.concat(cubes, ignore_index=True)
+    cube = combined.groupby(CUBE_KEYS, dropna=False)[measures].sum().reset_index()
+    for key in ['State', 'Shelter Name']:
+        cube[key] = cube[key].astype(object)
+    return cube
+
+
+def slice_cube(cube, years=None, states=None, include_duplicates=False):
+    """
+    Selects the cube rows for a year range and set of states.
+
+    Parameters:
+        cube (pd.DataFrame): The cube returned by build_cube.
+        years (tuple): Inclusive (first, last) year range, or None for all rows.
+        states (list): States to keep, or None for all states.
+        include_duplicates (bool): Keep rows annotated as duplicates ('R').
+
+    Returns:
+        pd.DataFrame: The selected cube rows.
+    """
+    mask = pd.Series(True, index=cube.index)
+    if years is not None:
+        mask &= cube['Data Year'].between(*years)
+    if states is not None:
+        mask &= cube['State'].isin(states)
+    if not include_duplicates:
+        mask &= ~cube['Duplicate']
+    return cube[mask]
+
+
+def totals_by(cube, by, columns):
+    """
+    Sums the given measures over the groups of a cube slice.
+
+    Parameters:
+        cube (pd.DataFrame): A cube or cube slice.
+        by (str or list): The dimension(s) to group by.
+        columns (list): The measures to add together.
+
+    Returns:
+        pd.Series: The total of the measures for each group.
+    """
+    return cube.groupby(by, observed=True)[columns].sum().sum(axis=1)
+
+
+def save_cube(cube, path=CUBE_PATH):
+    """
+    Writes the cube to Parquet.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    cube.to_parquet(path, index=False)
+    return path
+
+
+def load_cube(path=CUBE_PATH):
+    """
+    Reads a cube written by save_cube.
+    """
+    return pd.read_parquet(path)
@@ -0,0 +1,442 @@
+## Benchmark Suite
+#
+# Generates synthetic Georgia, annotation and Best Friends data with the real
+# column layouts at configurable sizes and times each phase of the pipeline
+# run by dataset_transformation.main(): load, header parse, coercion, merge,
+# cleaning, compaction, outlier fix, aggregation and render. Each run is
+# appended to a JSON history and compared with the previous run of the same
+# size, so slowdowns between versions show up as regressions. The import time
+# of the modules and the sample size grid of statistical_power_analysis.py can
+# be benchmarked the same way.
+#
+# Usage:
+#   python dataset_benchmark.py                       # 12k Georgia rows
+#   python dataset_benchmark.py --rows 12000 120000 1200000 --no-render
+#   python dataset_benchmark.py --imports             # module import time
+#   python dataset_benchmark.py --power               # sample size grid against statsmodels
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import BEST_FRIENDS_INTAKE_COLUMNS, GEORGIA_INTAKE_COLUMNS, GEORGIA_OUTCOME_COLUMNS
+
+BENCHMARK_HISTORY = os.environ.get('SHELTER_BENCHMARK_HISTORY', os.path.join('benchmarks', 'history.json'))
+
+# Georgia rows of the October 2024 export
+DEFAULT_ROWS = [12000]
+
+# Larger workbooks take minutes to write, so the load phase is skipped above this size
+WORKBOOK_ROWS = 100000
+
+# A phase slower than this multiple of the previous run is a regression
+REGRESSION_THRESHOLD = 1.25
+
+# Import sets timed by --imports: the data-only path with and without the plotting libraries
+IMPORT_SETS = {
+    'dataset_transformation': ['dataset_transformation'],
+    'dataset_pipeline': ['dataset_pipeline'],
+    'dataset_transformation+plotting': ['dataset_transformation', 'matplotlib.pyplot', 'seaborn'],
+}
+
+# Monthly reports per Georgia shelter (2020 to 2023)
+REPORTS_PER_SHELTER = 48
+
+GEORGIA_COLUMNS = (['Shelter Name', 'License Number', 'Report Period Start', 'Report Period End']
+                   + GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS + ['Total beginning animal count'])
+
+BEST_FRIENDS_COLUMNS = (['Shelter Name', 'EIN', 'Organization Type', 'City', 'State', 'Zip Code', 'County', 'Data Year']
+                        + BEST_FRIENDS_INTAKE_COLUMNS)
+
+STATES = ['AL', 'AZ', 'AR', 'CA', 'CO', 'CT', 'DE', 'FL', 'GA', 'ID', 'IL', 'IN', 'IA', 'KS', 'KY', 'LA', 'ME', 'MD',
+          'MA', 'MI', 'MN', 'MS', 'MO', 'MT', 'NE', 'NV', 'NH', 'NJ', 'NM', 'NY', 'NC', 'ND', 'OH', 'OK', 'OR', 'PA',
+          'RI', 'SC', 'SD', 'TN', 'TX', 'UT', 'VT', 'VA', 'WA', 'WV', 'WI', 'WY']
+
+
+def synthetic_shelter_names(count, prefix='SYNTHETIC SHELTER'):
+    names = np.array([f'{prefix} {i:06d}' for i in range(count)], dtype=object)
+    if count:
+        # Exercise the September 2022 outlier fix
+        names[0] = 'DEKALB COUNTY ANIMAL SERVICES'
+    return names
+
+
+def synthetic_georgia(rows, seed=0):
+    """
+    Generates a Georgia Animal Shelter Database export as pd.read_excel returns it:
+    three title rows, the header row, then one monthly report per row.
+
+    Parameters:
+        rows (int): Number of report rows.
+        seed (int): Random seed for the counts.
+
+    Returns:
+        pd.DataFrame: The raw sheet, with a blank first column.
+    """
+    rng = np.random.default_rng(seed)
+    position = np.arange(rows)
+    report = position % REPORTS_PER_SHELTER
+    names = synthetic_shelter_names(-(-rows // REPORTS_PER_SHELTER))[position // REPORTS_PER_SHELTER]
+
+    start = pd.to_datetime(pd.DataFrame({'year': 2020 + report // 12, 'month': report % 12 + 1, 'day': 1}))
+    data = {
+        'Shelter Name': names,
+        'License Number': np.char.add('L-', (position // REPORTS_PER_SHELTER).astype(str)).astype(object),
+        'Report Period Start': start,
+        'Report Period End': start + pd.offsets.MonthEnd(0),
+    }
+    counts = rng.integers(0, 50, (rows, len(GEORGIA_COLUMNS) - 4))
+    for i, column in enumerate(GEORGIA_COLUMNS[4:]):
+        data[column] = counts[:, i]
+    body = pd.DataFrame(data)
+    body.columns = range(1, len(GEORGIA_COLUMNS) + 1)
+
+    titles = pd.DataFrame([['October 2024'], ['All'], GEORGIA_COLUMNS], dtype=object)
+    titles.columns = range(1, len(titles.columns) + 1)
+    sheet = pd.concat([titles, body], ignore_index=True)
+    sheet.insert(0, 0, None)
+    sheet.columns = ['Unnamed: 0', 'Shelter Report Data Export'] + [f'Unnamed: {i}' for i in range(2, len(sheet.columns))]
+    return sheet
+
+
+def synthetic_annotations(georgia_sheet, seed=0):
+    """
+    Generates the Shelter Name Annotations for a synthetic Georgia sheet, marking
+    about 3% of the reports as duplicates ('R').
+    """
+    rng = np.random.default_rng(seed)
+    names = georgia_sheet.iloc[3:, 1].to_numpy()
+    annotation = np.where(rng.random(len(names)) < 0.03, 'R', None).astype(object)
+    annotation[annotation == None] = np.nan  # noqa: E711
+    return pd.DataFrame({'Unnamed: 0': np.nan, 'Shelter Name': names, 'Shelter Name Annotation': annotation})
+
+
+def synthetic_best_friends(rows, georgia_rows, seed=0):
+    """
+    Generates Best Friends Animal Society data: one row per shelter and year,
+    with one in ten Georgia shelters also reporting to Best Friends.
+
+    Parameters:
+        rows (int): Number of rows.
+        georgia_rows (int): Rows of the matching synthetic Georgia data.
+        seed (int): Random seed.
+
+    Returns:
+        pd.DataFrame: The Best Friends data.
+    """
+    rng = np.random.default_rng(seed)
+    georgia_names = synthetic_shelter_names(-(-georgia_rows // REPORTS_PER_SHELTER))[::10]
+    shared = georgia_names[:rows]
+    names = np.concatenate([shared, synthetic_shelter_names(rows - len(shared), prefix='Best Friends Shelter')])
+    if len(shared) < rows and len(shared):
+        # Keep one DeKalb shelter only
+        names[len(shared)] = 'Best Friends Shelter DeKalb'
+
+    data_year = rng.choice([2021, 2022, 2023], rows).astype(object)
+    data_year[rng.random(rows) < 0.02] = 'No Data from 2023, 2022, or 2021'
+    data = {
+        'Shelter Name': names,
+        'EIN': [f'{i % 100:02d}-{i:07d}' for i in range(rows)],
+        'Organization Type': rng.choice(['Shelter', 'Rescue', 'Animal Control'], rows).astype(object),
+        'City': 'Springfield',
+        'State': rng.choice(STATES, rows).astype(object),
+        'Zip Code': rng.integers(10000, 99999, rows),
+        'County': 'Synthetic County',
+        'Data Year': data_year,
+    }
+    counts = rng.integers(0, 2000, (rows, len(BEST_FRIENDS_INTAKE_COLUMNS))).astype('float64')
+    counts[rng.random(counts.shape) < 0.1] = np.nan
+    for i, column in enumerate(BEST_FRIENDS_INTAKE_COLUMNS):
+        data[column] = counts[:, i]
+    return pd.DataFrame(data, columns=BEST_FRIENDS_COLUMNS)
+
+
+def write_georgia_workbook(georgia_sheet, path):
+    """
+    Writes a synthetic Georgia sheet as an .xlsx workbook laid out like the export.
+    """
+    georgia_sheet.to_excel(path, index=False)
+    return path
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(rows, workbook_rows=WORKBOOK_ROWS, render=True, workers=None, seed=0):
+    """
+    Times each pipeline phase on synthetic data of the given size.
+
+    Parameters:
+        rows (int): Number of Georgia rows. The Best Friends data has about half as many.
+        workbook_rows (int): Largest size for which the load phase writes and reads a workbook.
+        render (bool): Time rendering the figures.
+        workers (int): Number of render processes.
+        seed (int): Random seed.
+
+    Returns:
+        dict: The benchmark run: sizes, versions, seconds per phase and peak RSS.
+    """
+    from dataset_aggregation import build_cube
+    from dataset_identity import join_annotations, join_best_friends, update_shelter_index
+    from dataset_render import peak_rss_mb, render_figures
+    from dataset_schema import compact_frame
+    from dataset_transformation import (aggregate_reports, clean_combined, coerce_georgia_types, cube_measures,
+                                        fix_data_entry_mistakes, parse_georgia_headers)
+
+    phases = {}
+
+    def timed(name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        phases[name] = time.perf_counter() - start
+        return result
+
+    georgia_sheet = synthetic_georgia(rows, seed=seed)
+    annotations = synthetic_annotations(georgia_sheet, seed=seed)
+    best_friends = synthetic_best_friends(max(rows * 52 // 100, 1), rows, seed=seed)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        if rows <= workbook_rows:
+            path = write_georgia_workbook(georgia_sheet, os.path.join(output_dir, 'georgia.xlsx'))
+            georgia_sheet = timed('load', pd.read_excel, path)
+        else:
+            phases['load'] = None
+
+        georgia = timed('header_parse', parse_georgia_headers, georgia_sheet)
+        georgia = timed('coercion', coerce_georgia_types, georgia)
+
+        def merge(georgia):
+            index = {}
+            for frame in [georgia, annotations, best_friends]:
+                update_shelter_index(index, frame['Shelter Name'])
+            georgia, _ = join_annotations(georgia, annotations, index)
+            combined, _ = join_best_friends(georgia, best_friends, index)
+            return combined
+
+        combined = timed('merge', merge, georgia)
+        combined = timed('cleaning', clean_combined, combined)
+        combined = timed('compact', compact_frame, combined)
+        combined = timed('outliers', fix_data_entry_mistakes, combined, os.path.join(output_dir, 'outlier_audit.csv'))
+
+        def aggregate(combined):
+            return aggregate_reports(build_cube(combined, cube_measures))
+
+        reports = timed('aggregation', aggregate, combined)
+        if render:
+            timed('render', render_figures, reports, output_dir=output_dir, workers=workers)
+
+    return {
+        'benchmark': 'pipeline',
+        'timestamp': time.time(),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'rows': rows,
+        'best_friends_rows': len(best_friends),
+        'combined_rows': len(combined),
+        'phases': phases,
+        'total_seconds': sum(seconds for seconds in phases.values() if seconds is not None),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def import_seconds(modules, repeat=5):
+    """
+    Times importing modules in a fresh interpreter.
+
+    Parameters:
+        modules (list): Modules imported together, in order.
+        repeat (int): Number of interpreters started; the median is reported.
+
+    Returns:
+        tuple: The median import time in seconds and whether matplotlib was loaded.
+    """
+    code = ("import sys, time; start = time.perf_counter(); "
+            + '; '.join(f'import {module}' for module in modules)
+            + "; print(time.perf_counter() - start, 'matplotlib' in sys.modules)")
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.split()
+        times.append(float(output[0]))
+    return float(np.median(times)), output[1] == 'True'
+
+
+def run_import_benchmark(repeat=5):
+    """
+    Times the startup imports of the data-only path against the same imports
+    plus the plotting libraries, which the module used to load at import.
+
+    Returns:
+        dict: The benchmark run, with one phase per import set.
+    """
+    phases = {}
+    plotting = {}
+    for name, modules in IMPORT_SETS.items():
+        phases[name], plotting[name] = import_seconds(modules, repeat=repeat)
+    return {
+        'benchmark': 'imports',
+        'timestamp': time.time(),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'rows': 0,
+        'phases': phases,
+        'loads_matplotlib': plotting,
+        'total_seconds': sum(phases.values()),
+    }
+
+
+def run_power_benchmark():
+    """
+    Times solving the sample size grid of statistical_power_analysis.py with
+    its vectorized solver, from its memo, and with one statsmodels call per scenario.
+
+    Returns:
+        dict: The benchmark run, with one phase per solver.
+    """
+    from statistical_power_analysis import BENCHMARK_GRID, benchmark_grid
+
+    result = benchmark_grid(BENCHMARK_GRID)
+    return {
+        'benchmark': 'power',
+        'timestamp': time.time(),
+        'version': git_version(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'rows': result['scenarios'],
+        'phases': result['seconds'],
+        'max_relative_difference': result['max_relative_difference'],
+        'statsmodels_misses': result['statsmodels_misses'],
+        'total_seconds': sum(result['seconds'].values()),
+    }
+
+
+def read_history(path=BENCHMARK_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def append_history(run, path=BENCHMARK_HISTORY):
+    history = read_history(path)
+    history.append(run)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return history
+
+
+def find_regressions(run, history, threshold=REGRESSION_THRESHOLD):
+    """
+    Compares a run with the latest earlier run of the same benchmark and size.
+
+    Parameters:
+        run (dict): The new benchmark run.
+        history (list): Earlier runs.
+        threshold (float): Slowdown ratio above which a phase is reported.
+
+    Returns:
+        list: (phase, previous seconds, new seconds) for each slower phase.
+    """
+    kind = run.get('benchmark', 'pipeline')
+    previous = [earlier for earlier in history
+                if earlier.get('benchmark', 'pipeline') == kind and earlier['rows'] == run['rows'] and earlier is not run]
+    if not previous:
+        return []
+    baseline = previous[-1]['phases']
+
+    regressions = []
+    for phase, seconds in run['phases'].items():
+        before = baseline.get(phase)
+        if seconds is not None and before and seconds > before * threshold:
+            regressions.append((phase, before, seconds))
+    return regressions
+
+
+def format_run(run):
+    """
+    Formats a benchmark run as a table of phase timings.
+    """
+    if run.get('benchmark') == 'imports':
+        lines = ['Import time (median of fresh interpreters)']
+        for name, seconds in run['phases'].items():
+            plotting = 'loads matplotlib' if run['loads_matplotlib'][name] else 'no matplotlib'
+            lines.append(f"  {name:<34} {seconds:8.3f}s  ({plotting})")
+        return '\n'.join(lines)
+
+    if run.get('benchmark') == 'power':
+        lines = [f"Sample sizes of {run['rows']:,} scenarios (max relative difference from statsmodels "
+                 f"{run['max_relative_difference']:.1e}; statsmodels misses the target power in {run['statsmodels_misses']})"]
+        for solver, seconds in run['phases'].items():
+            lines.append(f"  {solver:<14} {seconds:8.3f}s")
+        return '\n'.join(lines)
+
+    peak = run['peak_rss_mb']
+    lines = [f"{run['rows']:,} Georgia rows, {run['best_friends_rows']:,} Best Friends rows -> "
+             f"{run['combined_rows']:,} combined rows (peak RSS {f'{peak:,.0f} MB' if peak is not None else 'n/a'})"]
+    for phase, seconds in run['phases'].items():
+        lines.append(f"  {phase:<14} {'skipped' if seconds is None else f'{seconds:8.3f}s'}")
+    lines.append(f"  {'total':<14} {run['total_seconds']:8.3f}s")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline phases on synthetic shelter data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS, help='Georgia row counts to benchmark')
+    parser.add_argument('--workbook-rows', type=int, default=WORKBOOK_ROWS,
+                        help='Largest size for which the load phase reads a workbook')
+    parser.add_argument('--no-render', action='store_true', help='Skip rendering the figures')
+    parser.add_argument('--workers', type=int, help='Number of processes used to render figures')
+    parser.add_argument('--history', default=BENCHMARK_HISTORY, help='JSON file the runs are appended to')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help='Slowdown ratio reported as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='Exit with status 1 on a regression')
+    parser.add_argument('--imports', action='store_true', help='Time the module imports instead of the pipeline')
+    parser.add_argument('--power', action='store_true', help='Time the sample size grid instead of the pipeline')
+    args = parser.parse_args()
+
+    import warnings
+    warnings.filterwarnings('ignore')
+
+    if args.imports:
+        runs = [run_import_benchmark]
+    elif args.power:
+        runs = [run_power_benchmark]
+    else:
+        runs = [lambda rows=rows: run_benchmark(rows, workbook_rows=args.workbook_rows, render=not args.no_render,
+                                                workers=args.workers)
+                for rows in args.rows]
+
+    regressed = False
+    for benchmark in runs:
+        run = benchmark()
+        history = append_history(run, args.history)
+        print(format_run(run))
+        for phase, before, seconds in find_regressions(run, history, args.threshold):
+            regressed = True
+            print(f"  REGRESSION {phase}: {before:.3f}s -> {seconds:.3f}s ({seconds / before:.2f}x)")
+
+    if regressed and args.fail_on_regression:
+        raise SystemExit(1)
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,465 @@
+## Local On-Disk Cache for Remote Workbooks
+#
+# Workbooks are cached under a content-addressed key built from the URL and a
+# validator (ETag, Last-Modified or a SHA-256 of the file). Parsed frames are
+# stored as Parquet, falling back to pickle for raw sheets whose mixed-type
+# columns cannot be represented in Arrow; workbooks streamed from disk are kept
+# as downloaded. Requests go through one requests session per thread.
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+import numpy as np
+import pandas as pd
+import requests
+
+INDEX_FILE = 'index.json'
+
+# Serializes updates to the index file when several sources load at once
+_index_lock = threading.Lock()
+
+# requests session of each thread
+_sessions = threading.local()
+
+# Sent with every request; some servers reject clients without one
+USER_AGENT = os.environ.get('SHELTER_USER_AGENT', 'Mozilla/5.0 (compatible; shelter-data-pipeline)')
+
+
+def read_index(cache_dir):
+    """
+    Reads the cache index for the given directory.
+
+    Parameters:
+        cache_dir (str): The cache directory.
+
+    Returns:
+        dict: Cache entries keyed by URL.
+    """
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def write_index(cache_dir, index):
+    """
+    Atomically writes the cache index for the given directory.
+
+    Parameters:
+        cache_dir (str): The cache directory.
+        index (dict): Cache entries keyed by URL.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    tmp_path = index_path + '.tmp.%d.%d' % (os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def cache_key(url, validator):
+    """
+    Builds the content-addressed cache key for a URL and validator.
+
+    Parameters:
+        url (str): The source URL.
+        validator (str): The ETag, Last-Modified or content hash of the source.
+
+    Returns:
+        str: A hex digest identifying this version of the source.
+    """
+    return hashlib.sha256(f"{url}\n{validator}".encode('utf-8')).hexdigest()
+
+
+def local_path(url):
+    """
+    Returns the filesystem path for a file:// URL or plain path, or None for remote URLs.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return url2pathname(parsed.path)
+    if len(parsed.scheme) <= 1:
+        # Plain paths, including Windows drive letters
+        return url
+    return None
+
+
+def hash_bytes(content):
+    return 'sha256:' + hashlib.sha256(content).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
+
+
+def http_session():
+    """
+    Returns this thread's requests session. The session keeps connections to each
+    host alive, follows redirects, takes its proxies from HTTP_PROXY, HTTPS_PROXY
+    and NO_PROXY, and sends USER_AGENT.
+    """
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+    return session
+
+
+def close_connections():
+    """
+    Closes the session, and its kept-alive connections, of the current thread.
+    """
+    session = getattr(_sessions, 'session', None)
+    if session is not None:
+        session.close()
+        _sessions.session = None
+
+
+def http_request(url, method='GET', timeout=60):
+    """
+    Sends a request through this thread's session, so a HEAD check and the
+    download that follows it, or several files on the same host, share one
+    connection.
+
+    Parameters:
+        url (str): An http or https URL.
+        method (str): 'GET' or 'HEAD'.
+        timeout (int): Timeout in seconds for connecting and reading.
+
+    Returns:
+        tuple: The response headers and body (empty for HEAD requests).
+
+    Raises:
+        OSError: If the server answers with an error status or the connection fails.
+    """
+    response = http_session().request(method, url, timeout=timeout, allow_redirects=True)
+    response.raise_for_status()
+    return response.headers, response.content
+
+
+def download_file(url, path, timeout=60, chunk_size=1 << 20):
+    """
+    Streams a remote file to path without holding it in memory.
+
+    Returns:
+        str: The SHA-256 validator of the downloaded content.
+    """
+    digest = hashlib.sha256()
+    with http_session().get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in response.iter_content(chunk_size):
+                digest.update(chunk)
+                f.write(chunk)
+    os.replace(path + '.tmp', path)
+    return 'sha256:' + digest.hexdigest()
+
+
+def get_validator(url, timeout=30):
+    """
+    Returns a cheap validator for the current version of the source.
+
+    Local files are hashed. Remote files are checked with a HEAD request for
+    an ETag or Last-Modified header; None means the content has to be
+    downloaded and hashed instead.
+
+    Parameters:
+        url (str): The source URL or path.
+        timeout (int): Timeout in seconds for the HEAD request.
+
+    Returns:
+        str or None: The validator string.
+    """
+    path = local_path(url)
+    if path is not None:
+        return hash_file(path)
+
+    headers, _ = http_request(url, method='HEAD', timeout=timeout)
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if etag:
+        return 'etag:' + etag
+    if last_modified:
+        return 'last-modified:' + last_modified
+    return None
+
+
+def content_validator(url):
+    """
+    Returns the validator of a source, downloading and hashing it when the
+    server sends no ETag or Last-Modified header or rejects HEAD requests.
+
+    Returns:
+        tuple: The validator and the downloaded bytes (None if not downloaded).
+
+    Raises:
+        OSError: If the source cannot be downloaded either.
+    """
+    try:
+        validator = get_validator(url)
+    except Exception:
+        validator = None
+    if validator is not None:
+        return validator, None
+    content = fetch_bytes(url)
+    return hash_bytes(content), content
+
+
+def fetch_bytes(url, timeout=60):
+    """
+    Reads the raw bytes of a local or remote source.
+    """
+    path = local_path(url)
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+    _, body = http_request(url, timeout=timeout)
+    return body
+
+
+def write_frame(df, path_base):
+    """
+    Writes a frame to Parquet, or to pickle when Arrow cannot hold its columns.
+
+    Parameters:
+        df (pd.DataFrame): The frame to store.
+        path_base (str): The target path without extension.
+
+    Returns:
+        str: The path of the written file.
+    """
+    parquet_path = path_base + '.parquet'
+    try:
+        df.to_parquet(parquet_path)
+        return parquet_path
+    except Exception:
+        if os.path.exists(parquet_path):
+            os.remove(parquet_path)
+    pickle_path = path_base + '.pkl'
+    df.to_pickle(pickle_path)
+    return pickle_path
+
+
+def read_frame(path):
+    """
+    Reads a frame written by write_frame.
+    """
+    if path.endswith('.pkl'):
+        return pd.read_pickle(path)
+    return nulls_to_nan(pd.read_parquet(path))
+
+
+def nulls_to_nan(df):
+    """
+    Replaces the None values Arrow returns for nulls in object columns with NaN.
+    """
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].mask(df[column].isna(), np.nan)
+    return df
+
+
+def evict_cache(cache_dir, max_bytes=None, max_age=None):
+    """
+    Removes cache entries older than max_age and least recently used entries beyond max_bytes.
+
+    Parameters:
+        cache_dir (str): The cache directory.
+        max_bytes (int): Maximum total size of cached frames, or None for no limit.
+        max_age (float): Maximum age in seconds since an entry was written, or None.
+
+    Returns:
+        list: The URLs that were evicted.
+    """
+    with _index_lock:
+        index = read_index(cache_dir)
+        now = time.time()
+        evicted = []
+
+        if max_age is not None:
+            for url, entry in list(index.items()):
+                if now - entry['created'] > max_age:
+                    evicted.append(url)
+
+        if max_bytes is not None:
+            remaining = sorted((entry['last_access'], url) for url, entry in index.items() if url not in evicted)
+            total = sum(index[url]['size'] for _, url in remaining)
+            for _, url in remaining:
+                if total <= max_bytes:
+                    break
+                total -= index[url]['size']
+                evicted.append(url)
+
+        for url in evicted:
+            path = os.path.join(cache_dir, index[url]['file'])
+            if os.path.exists(path):
+                os.remove(path)
+            del index[url]
+
+        if evicted:
+            write_index(cache_dir, index)
+
+    return evicted
+
+
+def touch_entry(cache_dir, url, revalidated=False):
+    """
+    Records an access to a cache entry; a revalidated entry also counts as new for the ttl.
+    """
+    now = time.time()
+    with _index_lock:
+        index = read_index(cache_dir)
+        if url in index:
+            index[url]['last_access'] = now
+            if revalidated:
+                index[url]['created'] = now
+            write_index(cache_dir, index)
+
+
+def store_entry(cache_dir, url, key, validator, path):
+    """
+    Records the file of a new version of a source, removing the file of the previous one.
+    """
+    now = time.time()
+    with _index_lock:
+        index = read_index(cache_dir)
+        previous = index.get(url)
+        if previous is not None and previous['file'] != os.path.basename(path):
+            previous_path = os.path.join(cache_dir, previous['file'])
+            if os.path.exists(previous_path):
+                os.remove(previous_path)
+        index[url] = {
+            'key': key,
+            'validator': validator,
+            'file': os.path.basename(path),
+            'size': os.path.getsize(path),
+            'created': now,
+            'last_access': now,
+        }
+        write_index(cache_dir, index)
+
+
+def load_cached(url, cache_dir, ttl=None, offline=False, max_bytes=None, max_age=None, reader=None, validated=None):
+    """
+    Loads a workbook through the on-disk cache.
+
+    Entries written less than ttl seconds ago are served without touching the
+    network. Older entries are revalidated and reused when the source has not
+    changed, or when the source cannot be reached.
+
+    Parameters:
+        url (str): The URL or path of the workbook.
+        cache_dir (str): The cache directory.
+        ttl (float): Seconds during which an entry is served without revalidation.
+        offline (bool): Serve only from the cache and never touch the network.
+        max_bytes (int): Size limit applied after writing a new entry.
+        max_age (float): Age limit applied after writing a new entry.
+        reader (callable): Parses a file-like object into a DataFrame. Defaults to pd.read_excel.
+        validated (tuple): The (validator, content) content_validator just returned for the
+            source; used instead of revalidating it, so the bytes are not downloaded twice.
+
+    Returns:
+        pd.DataFrame: The loaded DataFrame, or None if it is unavailable offline.
+    """
+    reader = reader or pd.read_excel
+    entry = read_index(cache_dir).get(url)
+
+    def serve(entry, revalidated=False):
+        touch_entry(cache_dir, url, revalidated)
+        return read_frame(os.path.join(cache_dir, entry['file']))
+
+    if offline:
+        if entry is None:
+            print(f"No cached copy of {url} is available offline.")
+            return None
+        return serve(entry)
+
+    if entry is not None and ttl is not None and time.time() - entry['created'] < ttl:
+        return serve(entry)
+
+    try:
+        validator, content = validated or content_validator(url)
+    except Exception as e:
+        if entry is not None:
+            print(f"Could not revalidate {url} ({e}); using cached copy.")
+            return serve(entry)
+        raise
+
+    key = cache_key(url, validator)
+    if entry is not None and entry['key'] == key and os.path.exists(os.path.join(cache_dir, entry['file'])):
+        return serve(entry, revalidated=True)
+
+    if content is None:
+        content = fetch_bytes(url)
+    df = reader(io.BytesIO(content))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    store_entry(cache_dir, url, key, validator, write_frame(df, os.path.join(cache_dir, key)))
+
+    if max_bytes is not None or max_age is not None:
+        evict_cache(cache_dir, max_bytes=max_bytes, max_age=max_age)
+
+    return df
+
+
+def download_cached(url, cache_dir, offline=False):
+    """
+    Returns the path of a cached copy of a remote file, downloading it when its
+    validator changed. Unlike load_cached, the file is kept as downloaded, so a
+    large workbook can be read from disk in chunks. Sources without an ETag or
+    Last-Modified header are downloaded each time and keyed by their hash.
+
+    Parameters:
+        url (str): The URL of the file.
+        cache_dir (str): The cache directory.
+        offline (bool): Only use an existing copy.
+
+    Returns:
+        str: The path of the copy, or None if it is unavailable offline.
+    """
+    entry = read_index(cache_dir).get(url)
+    if entry is not None and not os.path.exists(os.path.join(cache_dir, entry['file'])):
+        entry = None
+
+    def serve(entry, revalidated=False):
+        touch_entry(cache_dir, url, revalidated)
+        return os.path.join(cache_dir, entry['file'])
+
+    if offline:
+        if entry is None:
+            print(f"No downloaded copy of {url} is available offline.")
+            return None
+        return serve(entry)
+
+    try:
+        validator = get_validator(url)
+    except Exception:
+        validator = None
+    if entry is not None and validator is not None and entry['key'] == cache_key(url, validator):
+        return serve(entry, revalidated=True)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    download = os.path.join(cache_dir, 'download.%d.%d' % (os.getpid(), threading.get_ident()))
+    try:
+        content_hash = download_file(url, download)
+    except Exception as e:
+        if entry is not None:
+            print(f"Could not revalidate {url} ({e}); using cached copy.")
+            return serve(entry)
+        raise
+    validator = validator or content_hash
+    key = cache_key(url, validator)
+    path = os.path.join(cache_dir, key + os.path.splitext(urlparse(url).path)[1])
+    os.replace(download, path)
+    store_entry(cache_dir, url, key, validator, path)
+    return path
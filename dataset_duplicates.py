@@ -0,0 +1,369 @@
+## Duplicate Report Detection
+#
+# Finds Georgia reports that repeat another report of the same period, so they
+# can be annotated as duplicates ('R') without the manual annotations workbook.
+# Reports are only compared within a block of the same state (when the data
+# has one) and report period. Within a block, a report duplicates an earlier one
+# when it has:
+#   - the same name fingerprint: the normalized name with common abbreviations
+#     spelled out, filler words dropped and the words sorted, so near-duplicate
+#     spellings such as 'ATHENS CLARKE CO ANIMAL CONTROL' and
+#     'Athens-Clarke County Animal Control' match
+#   - the same License Number
+#   - the same counts under another name, for reports with a few nonzero counts
+# Each rule is a hash join on the block and a key, so the reports are never
+# compared pairwise. The first report of a group is kept and the later ones are
+# annotated 'R', as in the manual workbook. The detected annotations can be
+# written as a workbook with the layout of the manual one, used by the pipeline
+# with SHELTER_DUPLICATES=auto, or combined with the manual ones
+# (SHELTER_DUPLICATES=both). The batch, refreshed and streamed runs all detect
+# the duplicates of the whole export and apply them by the same mode.
+#
+# Usage:
+#   python dataset_duplicates.py                       # compare with the manual annotations
+#   python dataset_duplicates.py --output annotations_detected.xlsx
+#   python dataset_duplicates.py --georgia export.xlsx --report duplicates.csv
+
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_identity import normalize_name
+from dataset_schema import count_columns
+
+# How the pipeline annotates duplicates: 'manual' (the annotations workbook),
+# 'auto' (detected) or 'both' (a report is a duplicate if either says so)
+DUPLICATE_MODE = os.environ.get('SHELTER_DUPLICATES', 'manual')
+DUPLICATE_MODES = ['manual', 'auto', 'both']
+
+# Reports are only compared within a block of these columns
+BLOCK_COLUMNS = ['State', 'Report Period Start', 'Report Period End']
+
+ABBREVIATIONS = {
+    'CO': 'COUNTY', 'CNTY': 'COUNTY', 'DEPT': 'DEPARTMENT', 'DEP': 'DEPARTMENT', 'SVC': 'SERVICES',
+    'SVCS': 'SERVICES', 'SERVICE': 'SERVICES', 'SOC': 'SOCIETY', 'CTR': 'CENTER', 'CENTRE': 'CENTER',
+    'MT': 'MOUNT', 'ST': 'SAINT', 'INTL': 'INTERNATIONAL', 'ASSN': 'ASSOCIATION', '&': 'AND',
+}
+FILLER_WORDS = {'THE', 'OF', 'AND', 'INC', 'LLC', 'CORP'}
+
+# What duplicate_keys adds to the block columns of each report
+KEY_COLUMNS = ['Name Key', 'License Key', 'Count Hash', 'Nonzero Counts']
+
+# Reports of different names only match on counts with at least this many nonzero
+# counts; small shelters often report the same one or two animals in a month
+MIN_MATCHED_COUNTS = 3
+
+
+def name_fingerprint(name):
+    """
+    Reduces a shelter name to a key shared by its near-duplicate spellings.
+
+    Parameters:
+        name (str): The raw shelter name.
+
+    Returns:
+        str: The sorted distinct words of the normalized name, abbreviations
+        spelled out and filler words dropped; None for missing names.
+    """
+    normalized = normalize_name(name)
+    if normalized is None:
+        return None
+    words = {ABBREVIATIONS.get(word, word) for word in normalized.split()} - FILLER_WORDS
+    return ' '.join(sorted(words)) or normalized
+
+
+def name_fingerprints(names):
+    """
+    Fingerprints a column of shelter names, each distinct name once.
+    """
+    uniques = pd.unique(names.dropna())
+    return names.map({name: name_fingerprint(name) for name in uniques})
+
+
+def license_keys(numbers):
+    """
+    Normalizes a column of license numbers, each distinct number once;
+    placeholders such as 'N/A' or '0' identify nobody and become missing.
+    """
+    uniques = pd.unique(numbers.dropna())
+    keys = {number: str(number).strip().upper() for number in uniques}
+    return numbers.map({number: key for number, key in keys.items() if re.search('[1-9]', key)})
+
+
+def group_codes(keys):
+    """
+    Codes the rows by their key columns; rows with a missing key get -1.
+    """
+    return keys.groupby(list(keys.columns), sort=False).ngroup().fillna(-1).to_numpy(dtype='int64')
+
+
+def first_rows(codes):
+    """
+    Returns, for each row, the position of the first row with the same code
+    (-1 for rows with code -1).
+    """
+    valid = codes >= 0
+    first = np.empty(codes.max() + 1 if valid.any() else 0, dtype='int64')
+    positions = np.flatnonzero(valid)
+    # np.unique returns the position of each code's first occurrence
+    unique, index = np.unique(codes[positions], return_index=True)
+    first[unique] = positions[index]
+    return np.where(valid, first[np.maximum(codes, 0)] if len(first) else -1, -1)
+
+
+def count_hashes(frame, columns):
+    """
+    Hashes the counts of each row into one 64-bit value.
+    """
+    counts = frame[columns].apply(pd.to_numeric, errors='coerce').astype('float64')
+    return pd.util.hash_pandas_object(counts, index=False).to_numpy()
+
+
+def duplicate_keys(frame, block_columns=BLOCK_COLUMNS, counts=None):
+    """
+    Computes what the rules compare of each report: its block, name fingerprint,
+    license key, count hash and number of nonzero counts. The keys of the chunks
+    of an export can be concatenated and matched at once.
+
+    Parameters:
+        frame (pd.DataFrame): Georgia reports with 'Shelter Name' and the report period.
+        block_columns (list): Columns the reports are blocked on; those missing from
+            the frame are left out.
+        counts (list): Count columns compared by the counts rule. Defaults to every
+            count column of the frame.
+
+    Returns:
+        pd.DataFrame: One row per report: the block columns, then KEY_COLUMNS.
+    """
+    block_columns = [column for column in block_columns if column in frame.columns]
+    counts = count_columns(frame.columns) if counts is None else counts
+    keys = frame[block_columns].reset_index(drop=True)
+    keys['Name Key'] = name_fingerprints(frame['Shelter Name']).to_numpy()
+    keys['License Key'] = (license_keys(frame['License Number']).to_numpy() if 'License Number' in frame.columns
+                           else np.nan)
+    keys['Count Hash'] = count_hashes(frame, counts) if counts else np.uint64(0)
+    nonzero = frame[counts].apply(pd.to_numeric, errors='coerce').fillna(0) != 0
+    keys['Nonzero Counts'] = nonzero.sum(axis=1).to_numpy(dtype='int64')
+    return keys
+
+
+def match_duplicates(keys):
+    """
+    Finds the reports that repeat an earlier report of the same block, from
+    the keys of duplicate_keys.
+
+    Returns:
+        pd.DataFrame: As detect_duplicates.
+    """
+    blocks = keys.drop(columns=KEY_COLUMNS)
+    fingerprints = keys['Name Key']
+    # Each rule: the key of the rows and which rows it applies to
+    rules = {
+        'name': (fingerprints, np.ones(len(keys), dtype=bool)),
+        'license': (keys['License Key'], keys['License Key'].notna().to_numpy()),
+        'counts': (keys['Count Hash'], keys['Nonzero Counts'].to_numpy() >= MIN_MATCHED_COUNTS),
+    }
+
+    rows = np.arange(len(keys))
+    duplicate_of = np.full(len(keys), -1)
+    reason = np.full(len(keys), None, dtype=object)
+    for rule, (key, applies) in rules.items():
+        codes = group_codes(blocks.assign(_key=key))
+        first = first_rows(np.where(applies, codes, -1))
+        matched = (first >= 0) & (first != rows) & (duplicate_of < 0)
+        if rule == 'counts':
+            # Reports of the same shelter with the same counts are already caught by name
+            matched &= fingerprints.to_numpy() != fingerprints.to_numpy()[np.maximum(first, 0)]
+        duplicate_of[matched] = first[matched]
+        reason[matched] = rule
+
+    found = duplicate_of >= 0
+    return pd.DataFrame({'Row': rows[found], 'Duplicate Of': duplicate_of[found], 'Reason': reason[found]})
+
+
+def detect_duplicates(frame, block_columns=BLOCK_COLUMNS, counts=None):
+    """
+    Finds the reports that repeat an earlier report of the same block.
+
+    Parameters:
+        frame (pd.DataFrame): Georgia reports with 'Shelter Name' and the report period.
+        block_columns (list): Columns the reports are blocked on; those missing from
+            the frame are left out. Reports with a missing block value are never duplicates.
+        counts (list): Count columns compared by the counts rule. Defaults to every
+            count column of the frame. Only reports with MIN_MATCHED_COUNTS nonzero
+            counts are compared on counts.
+
+    Returns:
+        pd.DataFrame: One row per duplicate report with its position ('Row'), the
+        position of the report it repeats ('Duplicate Of') and the rule that
+        matched ('Reason': 'name', 'license' or 'counts').
+    """
+    return match_duplicates(duplicate_keys(frame, block_columns, counts))
+
+
+def duplicate_annotations(frame, report):
+    """
+    Lays out a duplicate report as Shelter Name Annotations: 'R' for the
+    duplicates and missing for the other reports, aligned with the frame.
+    """
+    annotations = np.full(len(frame), np.nan, dtype=object)
+    annotations[report['Row'].to_numpy()] = 'R'
+    return pd.Series(annotations, index=frame.index, name='Shelter Name Annotation')
+
+
+def check_mode(mode):
+    """
+    Raises ValueError for an unknown duplicate mode.
+    """
+    if mode not in DUPLICATE_MODES:
+        raise ValueError(f"Unknown duplicate mode {mode!r}; choose one of {', '.join(DUPLICATE_MODES)}")
+
+
+def apply_duplicates(georgia, detected, mode=DUPLICATE_MODE):
+    """
+    Sets the Shelter Name Annotation of Georgia reports from detected
+    annotations by the duplicate mode. Refreshed and streamed runs detect the
+    duplicates of the whole export and apply them to the reports they process.
+
+    Parameters:
+        georgia (pd.DataFrame): Georgia reports, with the manual annotations
+            joined unless the mode is 'auto'.
+        detected (array-like): The detected annotation of each report, in order
+            (see duplicate_annotations).
+        mode (str): One of DUPLICATE_MODES.
+
+    Returns:
+        pd.DataFrame: The annotated reports.
+    """
+    check_mode(mode)
+    if mode == 'manual':
+        return georgia
+    detected = pd.Series(np.asarray(detected, dtype=object), index=georgia.index, name='Shelter Name Annotation')
+    georgia = georgia.copy()
+    if mode == 'both' and 'Shelter Name Annotation' in georgia.columns:
+        manual = georgia['Shelter Name Annotation'].astype(object)
+        detected = detected.where(manual.astype(str) != 'R', 'R')
+    georgia['Shelter Name Annotation'] = detected
+    return georgia
+
+
+def annotate_duplicates(georgia, mode=DUPLICATE_MODE):
+    """
+    Sets the Shelter Name Annotation of the Georgia reports by the duplicate mode.
+
+    Parameters:
+        georgia (pd.DataFrame): Georgia reports, with the manual annotations
+            joined unless the mode is 'auto'.
+        mode (str): One of DUPLICATE_MODES.
+
+    Returns:
+        tuple: The annotated reports and the duplicate report (None in 'manual' mode).
+    """
+    check_mode(mode)
+    if mode == 'manual':
+        return georgia, None
+    report = detect_duplicates(georgia)
+    return apply_duplicates(georgia, duplicate_annotations(georgia, report), mode), report
+
+
+def annotations_workbook(georgia, report):
+    """
+    Builds an annotations table with the layout of the manual workbook: one row
+    per Georgia report in order, with its name and annotation.
+    """
+    return pd.DataFrame({
+        'Unnamed: 0': np.nan,
+        'Shelter Name': georgia['Shelter Name'].to_numpy(),
+        'Shelter Name Annotation': duplicate_annotations(georgia, report).to_numpy(),
+    })
+
+
+def compare_annotations(detected, manual):
+    """
+    Compares detected annotations with manual ones, row by row.
+
+    Returns:
+        dict: Reports annotated 'R' by both, by the detector only and manually only,
+        and the share of manual duplicates found.
+    """
+    detected = detected.astype(str).to_numpy() == 'R'
+    manual = manual.astype(str).to_numpy() == 'R'
+    both = int((detected & manual).sum())
+    return {
+        'both': both,
+        'detected_only': int((detected & ~manual).sum()),
+        'manual_only': int((manual & ~detected).sum()),
+        'recall': both / manual.sum() if manual.any() else float('nan'),
+    }
+
+
+def format_detection(report, rows, seconds):
+    """
+    Formats a duplicate report as one summary line.
+    """
+    reasons = ', '.join(f"{count} by {reason}" for reason, count in report['Reason'].value_counts().items())
+    return f"{len(report)} duplicate reports of {rows} found in {seconds:.2f}s" + (f" ({reasons})" if reasons else '')
+
+
+def main():
+    from dataset_adapters import make_adapter
+    from dataset_identity import join_annotations, update_shelter_index
+    from dataset_ingest import ANNOTATIONS_PATH, GEORGIA_URL
+    from dataset_transformation import CACHE_DIR
+
+    parser = argparse.ArgumentParser(description="Detect duplicate Georgia reports and annotate them 'R'.")
+    parser.add_argument('--georgia', default=GEORGIA_URL, help='Path or URL of the Georgia export')
+    parser.add_argument('--annotations', default=ANNOTATIONS_PATH, help='Manual annotations workbook to compare with')
+    parser.add_argument('--output', help='Write the detected annotations as a workbook (.xlsx) or CSV')
+    parser.add_argument('--report', help='Write the duplicate reports and what they repeat to this CSV file')
+    args = parser.parse_args()
+
+    sources = {'georgia': args.georgia}
+    if args.annotations and os.path.exists(args.annotations):
+        sources['annotations'] = args.annotations
+    # Read through the adapters, so the pipeline's ingested files and manifest are left as they are
+    offline = os.environ.get('SHELTER_OFFLINE') == '1'
+    frames = {name: make_adapter(name, source).load(cache_dir=CACHE_DIR, offline=offline)
+              for name, source in sources.items()}
+    georgia = frames['georgia']
+    if georgia is None:
+        raise RuntimeError(f"Failed to load {args.georgia}")
+
+    start = time.perf_counter()
+    report = detect_duplicates(georgia)
+    print(format_detection(report, len(georgia), time.perf_counter() - start))
+
+    if frames.get('annotations') is not None:
+        index = {}
+        for frame in [georgia, frames['annotations']]:
+            update_shelter_index(index, frame['Shelter Name'])
+        manual, _ = join_annotations(georgia, frames['annotations'], index)
+        comparison = compare_annotations(duplicate_annotations(georgia, report), manual['Shelter Name Annotation'])
+        print(f"Compared with {args.annotations}: {comparison['both']} annotated by both, "
+              f"{comparison['detected_only']} detected only, {comparison['manual_only']} manual only "
+              f"({comparison['recall']:.1%} of the manual duplicates found)")
+
+    if args.report:
+        rows = georgia.reset_index(drop=True)
+        detail = report.assign(**{'Shelter Name': rows['Shelter Name'].to_numpy()[report['Row']],
+                                  'Duplicate Of Name': rows['Shelter Name'].to_numpy()[report['Duplicate Of']]})
+        for column in ['Report Period Start', 'Report Period End']:
+            if column in rows.columns:
+                detail[column] = rows[column].to_numpy()[report['Row']]
+        detail.to_csv(args.report, index=False)
+        print(f"Duplicate reports saved to {args.report}")
+    if args.output:
+        workbook = annotations_workbook(georgia, report)
+        if args.output.endswith('.csv'):
+            workbook.to_csv(args.output, index=False)
+        else:
+            workbook.to_excel(args.output, index=False)
+        print(f"Annotations saved to {args.output}")
+
+if __name__=='__main__':
+
+    main()
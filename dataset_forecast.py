@@ -0,0 +1,363 @@
+## Intake Forecasting
+#
+# Forecasts the monthly intake of every shelter, for dogs and cats separately.
+# The series are built from the Georgia reports of the combined dataset: the
+# intake columns of each species are summed by shelter and month of Report
+# Period Start, without the duplicates annotated 'R'. Each series is fitted
+# with a lightweight model:
+#   - 'seasonal_naive' repeats the last twelve months
+#   - 'ets' is a damped additive Holt-Winters model, seasonal from two years of data
+#   - 'arima' is an AR(1) model, with a seasonal (0,1,1,12) part from two years of data
+# Series too short for a model use the seasonal naive forecast. Series are
+# fitted in batches across a pool of worker processes, and every forecast is
+# cached under a hash of its series, model and horizon, so a rerun only fits
+# the series that gained or changed months.
+#
+# Usage:
+#   python dataset_forecast.py                        # forecast 12 months with ETS
+#   python dataset_forecast.py --model arima --horizon 6 --workers 4
+#   python dataset_forecast.py --shelter "SHELTER NAME"
+
+import argparse
+import hashlib
+import os
+import pickle
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dataset_partitions import COMBINED_PATH, read_combined
+from dataset_schema import GEORGIA_INTAKE_COLUMNS
+
+FORECAST_DIR = os.environ.get('SHELTER_FORECAST_DIR', 'aggregates')
+FORECAST_PATH = os.path.join(FORECAST_DIR, 'intake_forecast.csv')
+FORECAST_CACHE_PATH = os.path.join(FORECAST_DIR, 'forecast_models.pkl')
+
+# Months forecast after the last report of each series
+HORIZON = 12
+
+# Months in a season
+SEASON = 12
+
+# Series sent to a worker process at a time
+BATCH_SIZE = int(os.environ.get('SHELTER_FORECAST_BATCH_SIZE', 200))
+
+MODELS = ['seasonal_naive', 'ets', 'arima']
+
+# Bump when fitting changes so cached forecasts are refitted
+FORECAST_VERSION = 1
+
+SPECIES = {
+    'Canine': [column for column in GEORGIA_INTAKE_COLUMNS if column.startswith('Canine')],
+    'Feline': [column for column in GEORGIA_INTAKE_COLUMNS if column.startswith('Feline')],
+}
+
+FORECAST_COLUMNS = ['Shelter Name', 'Species', 'Month', 'Forecast', 'Model']
+
+
+def build_series(combined_df, date='Report Period Start'):
+    """
+    Sums the intake of each species by shelter and month.
+
+    Parameters:
+        combined_df (pd.DataFrame): The combined dataset.
+        date (str): The column the month of a report is taken from.
+
+    Returns:
+        pd.DataFrame: One row per shelter, species and month with a report
+        ('Shelter Name', 'Species', 'Month', 'Intake'), sorted.
+    """
+    reports = combined_df[combined_df[date].notna()]
+    if 'Shelter Name Annotation' in reports.columns:
+        reports = reports[reports['Shelter Name Annotation'].astype(str) != 'R']
+
+    intake = pd.DataFrame({species: reports[columns].astype('float64').sum(axis=1)
+                           for species, columns in SPECIES.items()})
+    intake['Shelter Name'] = reports['Shelter Name'].astype(str).to_numpy()
+    intake['Month'] = pd.to_datetime(reports[date]).dt.to_period('M').dt.to_timestamp().to_numpy()
+
+    monthly = intake.groupby(['Shelter Name', 'Month'], sort=False)[list(SPECIES)].sum()
+    series = monthly.rename_axis(columns='Species').stack().rename('Intake').reset_index()
+    return series[['Shelter Name', 'Species', 'Month', 'Intake']].sort_values(
+        ['Shelter Name', 'Species', 'Month'], ignore_index=True)
+
+
+def month_numbers(months):
+    """
+    Numbers months consecutively (year * 12 + month - 1).
+    """
+    months = pd.DatetimeIndex(months)
+    return (months.year * 12 + months.month - 1).to_numpy(dtype='int64')
+
+
+def fill_months(numbers, values):
+    """
+    Spreads a series over every month from its first to its last report,
+    interpolating the months without a report.
+
+    Returns:
+        np.ndarray: The monthly values.
+    """
+    every = np.arange(numbers[0], numbers[-1] + 1)
+    return np.interp(every, numbers, values)
+
+
+def series_hash(numbers, values, model, horizon):
+    """
+    Hashes a series with the settings it is fitted with.
+    """
+    digest = hashlib.sha256(f"{model}:{horizon}:{SEASON}:{FORECAST_VERSION}".encode('utf-8'))
+    digest.update(np.ascontiguousarray(numbers, dtype='int64').tobytes())
+    digest.update(np.ascontiguousarray(values, dtype='float64').tobytes())
+    return digest.hexdigest()
+
+
+def seasonal_naive(y, horizon):
+    """
+    Repeats the last season, or the last value of a series shorter than a season.
+    """
+    if len(y) >= SEASON:
+        return np.resize(y[-SEASON:], horizon)
+    return np.full(horizon, y[-1])
+
+
+def fit_ets(y, horizon):
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    seasonal = 'add' if len(y) >= 2 * SEASON else None
+    model = ExponentialSmoothing(y, trend='add', damped_trend=True, seasonal=seasonal,
+                                 seasonal_periods=SEASON if seasonal else None, initialization_method='estimated')
+    # The brute-force search for starting values triples the fitting time for the same forecasts
+    return model.fit(use_brute=False).forecast(horizon)
+
+
+def fit_arima(y, horizon):
+    from statsmodels.tsa.arima.model import ARIMA
+
+    if len(y) >= 2 * SEASON:
+        model = ARIMA(y, order=(1, 0, 0), seasonal_order=(0, 1, 1, SEASON))
+    else:
+        model = ARIMA(y, order=(1, 0, 0), trend='c')
+    return model.fit().forecast(horizon)
+
+
+# Model name -> (fitting function, fewest months it is fitted on)
+FITTERS = {
+    'ets': (fit_ets, 6),
+    'arima': (fit_arima, 8),
+}
+
+
+def fit_series(numbers, values, model='ets', horizon=HORIZON):
+    """
+    Forecasts one series.
+
+    Parameters:
+        numbers (np.ndarray): The month_numbers of the reported months, increasing.
+        values (np.ndarray): The intake of each reported month.
+        model (str): One of MODELS.
+        horizon (int): Number of months forecast.
+
+    Returns:
+        dict: The model used ('model'), the first forecast month number ('start')
+        and the forecasts ('forecast'), which are never negative.
+    """
+    y = fill_months(numbers, values)
+    used, forecast = 'seasonal_naive', None
+    if model in FITTERS and len(y) >= FITTERS[model][1] and np.ptp(y) > 0:
+        try:
+            forecast = np.asarray(FITTERS[model][0](y, horizon), dtype='float64')
+            used = model
+        except (ValueError, np.linalg.LinAlgError):
+            forecast = None
+        if forecast is not None and not np.isfinite(forecast).all():
+            used, forecast = 'seasonal_naive', None
+    if forecast is None:
+        forecast = seasonal_naive(y, horizon)
+    return {'model': used, 'start': int(numbers[-1]) + 1, 'forecast': np.clip(forecast, 0, None)}
+
+
+def fit_batch(batch, model, horizon):
+    """
+    Forecasts a batch of series. Runs inside a worker process.
+
+    Parameters:
+        batch (list): (key, month numbers, values) of each series.
+
+    Returns:
+        list: (key, fit_series result) of each series.
+    """
+    with warnings.catch_warnings():
+        # Short and flat series make statsmodels warn about convergence
+        warnings.simplefilter('ignore')
+        return [(key, fit_series(numbers, values, model=model, horizon=horizon)) for key, numbers, values in batch]
+
+
+def load_forecast_cache(path=FORECAST_CACHE_PATH):
+    """
+    Reads the cached forecasts, or returns an empty cache if there are none.
+
+    Returns:
+        dict: (Shelter Name, Species) -> (series hash, fit_series result).
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_forecast_cache(cache, path=FORECAST_CACHE_PATH):
+    """
+    Pickles the cached forecasts for later runs.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def forecast_series(series, model='ets', horizon=HORIZON, cache=None, workers=None, batch_size=BATCH_SIZE):
+    """
+    Forecasts every shelter and species, fitting only the series not in the cache.
+
+    Parameters:
+        series (pd.DataFrame): The monthly series returned by build_series.
+        model (str): One of MODELS.
+        horizon (int): Number of months forecast.
+        cache (dict): Forecasts of an earlier run (see load_forecast_cache).
+        workers (int): Number of worker processes. 1 fits in this process.
+        batch_size (int): Series sent to a worker at a time.
+
+    Returns:
+        tuple: The forecasts (FORECAST_COLUMNS, one row per series and month),
+        the cache of the current series, and a summary of the run.
+    """
+    if model not in MODELS:
+        raise ValueError(f"Unknown model {model!r}; choose one of {', '.join(MODELS)}")
+    cache = cache or {}
+    start = time.perf_counter()
+
+    keys = series[['Shelter Name', 'Species']]
+    bounds = np.flatnonzero(keys.ne(keys.shift()).any(axis=1).to_numpy())
+    ends = np.append(bounds[1:], len(series))
+    numbers = month_numbers(series['Month'])
+    values = series['Intake'].to_numpy(dtype='float64')
+
+    results, stale = {}, []
+    for first, end in zip(bounds, ends):
+        key = (keys['Shelter Name'].iat[first], keys['Species'].iat[first])
+        digest = series_hash(numbers[first:end], values[first:end], model, horizon)
+        if key in cache and cache[key][0] == digest:
+            results[key] = cache[key]
+        else:
+            stale.append((key, digest, numbers[first:end], values[first:end]))
+
+    batches = [[(key, n, v) for key, _, n, v in stale[i:i + batch_size]] for i in range(0, len(stale), batch_size)]
+    workers = workers or min(len(batches), os.cpu_count() or 1)
+    if workers <= 1 or len(batches) <= 1:
+        fitted = [fit_batch(batch, model, horizon) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fitted = list(pool.map(fit_batch, batches, [model] * len(batches), [horizon] * len(batches)))
+    digests = {key: digest for key, digest, _, _ in stale}
+    for batch in fitted:
+        for key, result in batch:
+            results[key] = (digests[key], result)
+
+    forecasts = forecast_frame({key: result for key, (_, result) in results.items()}, horizon)
+    summary = {
+        'series': len(results),
+        'fitted': len(stale),
+        'cached': len(results) - len(stale),
+        'workers': max(workers, 1),
+        'seconds': time.perf_counter() - start,
+        'models': forecasts.drop_duplicates(['Shelter Name', 'Species'])['Model'].value_counts().to_dict(),
+    }
+    return forecasts, results, summary
+
+
+def forecast_frame(results, horizon):
+    """
+    Lays out fit_series results as one row per series and forecast month.
+    """
+    if not results:
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+    keys = list(results)
+    steps = np.tile(np.arange(horizon), len(keys))
+    starts = np.repeat([results[key]['start'] for key in keys], horizon)
+    months = starts + steps
+    return pd.DataFrame({
+        'Shelter Name': np.repeat([key[0] for key in keys], horizon),
+        'Species': np.repeat([key[1] for key in keys], horizon),
+        'Month': pd.to_datetime({'year': months // 12, 'month': months % 12 + 1, 'day': 1}),
+        'Forecast': np.concatenate([results[key]['forecast'] for key in keys]),
+        'Model': np.repeat([results[key]['model'] for key in keys], horizon),
+    })
+
+
+def run_forecast(source=COMBINED_PATH, model='ets', horizon=HORIZON, workers=None, full=False,
+                 output=FORECAST_PATH, cache_path=FORECAST_CACHE_PATH):
+    """
+    Forecasts the intake of every shelter from the saved combined dataset.
+
+    Parameters:
+        source (str): The partitioned combined dataset (see dataset_partitions.py).
+        model (str): One of MODELS.
+        horizon (int): Number of months forecast.
+        workers (int): Number of worker processes.
+        full (bool): Refit every series instead of reusing cached forecasts.
+        output (str): CSV file the forecasts are written to.
+        cache_path (str): Pickle file of the cached forecasts.
+
+    Returns:
+        tuple: The forecasts and the summary of the run.
+    """
+    columns = ['Shelter Name', 'Shelter Name Annotation', 'Report Period Start'] + sum(SPECIES.values(), [])
+    series = build_series(read_combined(source, columns=columns))
+    cache = {} if full else load_forecast_cache(cache_path)
+    forecasts, cache, summary = forecast_series(series, model=model, horizon=horizon, cache=cache, workers=workers)
+    save_forecast_cache(cache, cache_path)
+    directory = os.path.dirname(output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    forecasts.to_csv(output, index=False)
+    summary['output'] = output
+    return forecasts, summary
+
+
+def format_summary(summary):
+    """
+    Formats a forecast summary as one line.
+    """
+    models = ', '.join(f"{count} {name}" for name, count in summary['models'].items())
+    return (f"Forecast {summary['series']} series ({summary['fitted']} fitted, {summary['cached']} cached; "
+            f"{models}) with {summary['workers']} worker(s) in {summary['seconds']:.2f}s; "
+            f"saved to {summary['output']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Forecast the monthly intake of every shelter by species.')
+    parser.add_argument('--model', choices=MODELS, default='ets', help='Forecasting model')
+    parser.add_argument('--horizon', type=int, default=HORIZON, help='Number of months to forecast')
+    parser.add_argument('--workers', type=int, help='Number of worker processes')
+    parser.add_argument('--full', action='store_true', help='Refit every series instead of using cached forecasts')
+    parser.add_argument('--source', default=COMBINED_PATH, help='Partitioned combined dataset')
+    parser.add_argument('--output', default=FORECAST_PATH, help='CSV file for the forecasts')
+    parser.add_argument('--shelter', help='Print the forecasts of this shelter')
+    args = parser.parse_args()
+
+    forecasts, summary = run_forecast(source=args.source, model=args.model, horizon=args.horizon,
+                                      workers=args.workers, full=args.full, output=args.output)
+    print(format_summary(summary))
+    if args.shelter:
+        print(forecasts[forecasts['Shelter Name'] == args.shelter].to_string(index=False))
+
+if __name__=='__main__':
+
+    main()
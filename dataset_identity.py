@@ -0,0 +1,260 @@
+## Shelter Identity Index
+#
+# Maps normalized shelter names to stable integer IDs. The index is persisted
+# as JSON and only ever grows, so a shelter keeps its ID across runs and new
+# exports. The annotations and the Best Friends data are joined to the Georgia
+# data on these IDs instead of by row position or on raw name strings, and
+# every join reports its cardinality and the names that did not match.
+
+import json
+import os
+import re
+import unicodedata
+
+import pandas as pd
+
+SHELTER_INDEX_PATH = os.environ.get('SHELTER_INDEX_PATH', os.path.join('ingested', 'shelter_index.json'))
+JOIN_REPORT_PATH = os.environ.get('SHELTER_JOIN_REPORT_PATH', os.path.join('ingested', 'join_report.json'))
+
+# ID of rows without a shelter name; they join with each other as missing names do in pd.merge
+MISSING_ID = -1
+
+
+def normalize_name(name):
+    """
+    Normalizes a shelter name: Unicode compatibility form, upper case, and
+    punctuation and runs of whitespace replaced by a single space.
+
+    Parameters:
+        name (str): The raw shelter name.
+
+    Returns:
+        str: The normalized name, or None for missing or blank names.
+    """
+    if not isinstance(name, str):
+        return None
+    normalized = re.sub(r'[\W_]+', ' ', unicodedata.normalize('NFKC', name).upper()).strip()
+    return normalized or None
+
+
+def normalize_names(names):
+    """
+    Normalizes a column of shelter names, normalizing each distinct name once.
+    """
+    uniques = pd.unique(names.dropna())
+    return names.map({name: normalize_name(name) for name in uniques})
+
+
+def load_shelter_index(path=SHELTER_INDEX_PATH):
+    """
+    Reads the shelter index.
+
+    Returns:
+        dict: Normalized name to shelter ID. Empty if the index does not exist yet.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)['shelters']
+
+
+def save_shelter_index(index, path=SHELTER_INDEX_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'shelters': index}, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def update_shelter_index(index, names):
+    """
+    Adds the shelters that are not in the index yet, in name order.
+
+    Parameters:
+        index (dict): The index to update in place.
+        names (pd.Series): Raw shelter names.
+
+    Returns:
+        int: The number of shelters added.
+    """
+    new_names = sorted(set(normalize_names(names).dropna()) - set(index))
+    next_id = max(index.values(), default=MISSING_ID) + 1
+    for shelter_id, name in enumerate(new_names, start=next_id):
+        index[name] = shelter_id
+    return len(new_names)
+
+
+def shelter_ids(names, index):
+    """
+    Looks up the shelter ID of each name.
+
+    Parameters:
+        names (pd.Series): Raw shelter names.
+        index (dict): The shelter index.
+
+    Returns:
+        pd.Series: int64 IDs; MISSING_ID for missing names.
+
+    Raises:
+        KeyError: If a name is not in the index.
+    """
+    normalized = normalize_names(names)
+    unknown = set(normalized.dropna()) - set(index)
+    if unknown:
+        raise KeyError(f"Shelters missing from the shelter index: {', '.join(sorted(unknown)[:5])}")
+    return normalized.map(index).fillna(MISSING_ID).astype('int64')
+
+
+def occurrences(ids):
+    """
+    Numbers the rows of each shelter 0, 1, 2, ... in order of appearance.
+    """
+    return ids.groupby(ids).cumcount()
+
+
+def join_report(left_ids, right_ids, left_names, right_names, output_rows):
+    """
+    Describes the cardinality of a join on shelter IDs.
+
+    Parameters:
+        left_ids, right_ids (pd.Series): The join keys of both sides.
+        left_names, right_names (pd.Series): The raw names of both sides, aligned with the keys.
+        output_rows (int): Number of rows the join produced.
+
+    Returns:
+        dict: Row and key counts, the number of keys repeated on both sides
+        (which multiply rows) and the names found on one side only.
+    """
+    left_counts = left_ids.value_counts()
+    right_counts = right_ids.value_counts()
+    matched = left_counts.index.intersection(right_counts.index)
+    many_to_many = matched[(left_counts[matched] > 1) & (right_counts[matched] > 1)]
+
+    def unmatched(ids, names, other_counts):
+        return sorted(set(names[~ids.isin(other_counts.index)].dropna()))
+
+    return {
+        'left_rows': len(left_ids),
+        'right_rows': len(right_ids),
+        'left_shelters': len(left_counts),
+        'right_shelters': len(right_counts),
+        'matched_shelters': len(matched),
+        'many_to_many_shelters': len(many_to_many),
+        'output_rows': output_rows,
+        'unmatched_left': unmatched(left_ids, left_names, right_counts),
+        'unmatched_right': unmatched(right_ids, right_names, left_counts),
+    }
+
+
+def format_join_report(name, report):
+    """
+    Formats a join report as one summary line.
+    """
+    return (f"Join {name}: {report['left_rows']} x {report['right_rows']} rows -> {report['output_rows']} rows; "
+            f"{report['matched_shelters']} of {report['left_shelters']} | {report['right_shelters']} shelters matched "
+            f"({report['many_to_many_shelters']} many-to-many), "
+            f"{len(report['unmatched_left'])} | {len(report['unmatched_right'])} unmatched names")
+
+
+def save_join_report(name, report, path=JOIN_REPORT_PATH):
+    """
+    Records a join report under its name in the join report file.
+    """
+    reports = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            reports = json.load(f)
+    reports[name] = report
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(reports, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def annotation_lookup(annotations, index):
+    """
+    Keys the Shelter Name Annotations by shelter ID and occurrence.
+
+    Returns:
+        pd.Series: The annotation of the n-th row of each shelter.
+    """
+    ids = shelter_ids(annotations['Shelter Name'], index)
+    keys = pd.MultiIndex.from_arrays([ids, occurrences(ids)], names=['Shelter ID', 'Occurrence'])
+    return pd.Series(annotations['Shelter Name Annotation'].to_numpy(), index=keys, name='Shelter Name Annotation')
+
+
+def join_annotations(georgia, annotations, index, offsets=None):
+    """
+    Adds the Shelter Name Annotation of each Georgia row, matching the n-th
+    report of a shelter to the n-th annotation of the same shelter.
+
+    Parameters:
+        georgia (pd.DataFrame): The Georgia data.
+        annotations (pd.DataFrame or pd.Series): The annotations workbook, or its annotation_lookup.
+        index (dict): The shelter index.
+        offsets (dict): Rows of each shelter seen in earlier chunks; updated in place.
+
+    Returns:
+        tuple: The annotated Georgia data and the join report.
+    """
+    lookup = annotations if isinstance(annotations, pd.Series) else annotation_lookup(annotations, index)
+    ids = shelter_ids(georgia['Shelter Name'], index)
+    occurrence = occurrences(ids)
+    if offsets is not None:
+        occurrence = occurrence + ids.map(offsets).fillna(0).astype('int64')
+        for shelter_id, count in ids.value_counts().items():
+            offsets[shelter_id] = offsets.get(shelter_id, 0) + int(count)
+
+    keys = pd.MultiIndex.from_arrays([ids, occurrence], names=lookup.index.names)
+    georgia = georgia.copy()
+    georgia['Shelter Name Annotation'] = lookup.reindex(keys).to_numpy()
+
+    matched = keys.isin(lookup.index)
+    report = {
+        'left_rows': len(georgia),
+        'right_rows': len(lookup),
+        'matched_rows': int(matched.sum()),
+        'unmatched_left': sorted(set(georgia['Shelter Name'][~matched].dropna())),
+    }
+    return georgia, report
+
+
+def join_best_friends(georgia, best_friends, index, how='outer'):
+    """
+    Joins the Best Friends data to the annotated Georgia data on shelter ID.
+
+    The result has the columns of pd.merge(georgia, best_friends, on='Shelter Name'):
+    the Georgia columns followed by the Best Friends columns other than the name.
+    Rows found only in the Best Friends data keep their Best Friends name.
+
+    Parameters:
+        georgia (pd.DataFrame): The annotated Georgia data.
+        best_friends (pd.DataFrame): The Best Friends Animal Society data.
+        index (dict): The shelter index.
+        how (str): The pd.merge join type.
+
+    Returns:
+        tuple: The joined DataFrame and the join report.
+    """
+    left_ids = shelter_ids(georgia['Shelter Name'], index)
+    right_ids = shelter_ids(best_friends['Shelter Name'], index)
+
+    left = georgia.assign(**{'Shelter ID': left_ids.to_numpy()})
+    right = best_friends.drop(columns='Shelter Name')
+    right.insert(0, 'Shelter ID', right_ids.to_numpy())
+    combined = pd.merge(left, right, on='Shelter ID', how=how)
+
+    # Name the rows that only exist in the Best Friends data
+    right_names = pd.Series(best_friends['Shelter Name'].to_numpy(), index=right_ids.to_numpy())
+    right_names = right_names[~right_names.index.duplicated()]
+    missing_name = combined['Shelter Name'].isna() & (combined['Shelter ID'] != MISSING_ID)
+    combined.loc[missing_name, 'Shelter Name'] = combined.loc[missing_name, 'Shelter ID'].map(right_names)
+    combined = combined.drop(columns='Shelter ID')
+
+    report = join_report(left_ids, right_ids, georgia['Shelter Name'], best_friends['Shelter Name'], len(combined))
+    return combined, report
@@ -0,0 +1,292 @@
+## Convert-Once Columnar Ingest
+#
+# Each source workbook is parsed once, typed with an explicit schema and written
+# as an uncompressed Arrow (Feather v2) file. A manifest records the hash of the
+# source each file was built from, so later runs read the Arrow files instead of
+# parsing the workbooks and only re-convert a workbook when it changes. Sources are read by the adapters
+# of dataset_adapters.py and loaded concurrently.
+#
+# To convert the inputs ahead of a run: python dataset_ingest.py [--force]
+
+import argparse
+import json
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from dataset_adapters import make_adapter, run_concurrently
+from dataset_cache import content_validator, hash_file, local_path, nulls_to_nan
+from dataset_schema import count_columns
+
+INGEST_DIR = os.environ.get('SHELTER_INGEST_DIR', 'ingested')
+MANIFEST_FILE = 'manifest.json'
+
+# Bump when the parsing or schema below changes so existing files are rebuilt
+SCHEMA_VERSION = 1
+
+GEORGIA_URL = "https://agr.georgia.gov/sites/default/files/documents/pets-and-livestock/shelter-report-data-export-october-2024.xlsx.xlsx"
+ANNOTATIONS_PATH = 'shelter-report-data-export-october-2024_annotations_master.xlsx'
+BEST_FRIENDS_PATH = 'Data Request-Ganesan.xlsx'
+
+SOURCES = {
+    'georgia': GEORGIA_URL,
+    'annotations': ANNOTATIONS_PATH,
+    'best_friends': BEST_FRIENDS_PATH,
+}
+
+# Explicit column types for the sources with a fixed layout
+ANNOTATIONS_SCHEMA = {
+    'Unnamed: 0': pa.float64(),
+    'Shelter Name': pa.string(),
+    'Shelter Name Annotation': pa.string(),
+}
+
+BEST_FRIENDS_STRING_COLUMNS = ['Shelter Name', 'EIN', 'Organization Type', 'City', 'State', 'County', 'Data Year']
+BEST_FRIENDS_INT_COLUMNS = ['Zip Code']
+
+GEORGIA_DATE_COLUMNS = ['Report Period Start', 'Report Period End']
+
+
+def declare_schema(name, df):
+    """
+    Declares the Arrow schema of a parsed source.
+
+    Parameters:
+        name (str): The kind of source ('georgia', 'annotations' or 'best_friends').
+        df (pd.DataFrame): The parsed source.
+
+    Returns:
+        pa.Schema: The schema the source is stored with.
+    """
+    fields = []
+    counts = set(count_columns(df.columns))
+    for column in df.columns:
+        if name == 'georgia':
+            if column in GEORGIA_DATE_COLUMNS:
+                arrow_type = pa.timestamp('ns')
+            elif column in counts:
+                arrow_type = pa.int64()
+            else:
+                arrow_type = pa.string()
+        elif name == 'annotations':
+            arrow_type = ANNOTATIONS_SCHEMA[column]
+        elif name == 'best_friends':
+            if column in BEST_FRIENDS_STRING_COLUMNS:
+                arrow_type = pa.string()
+            elif column in BEST_FRIENDS_INT_COLUMNS:
+                arrow_type = pa.int64()
+            else:
+                arrow_type = pa.float64()
+        else:
+            raise ValueError(f"Unknown source: {name}")
+        fields.append(pa.field(str(column), arrow_type))
+    return pa.schema(fields)
+
+
+def to_table(df, schema):
+    """
+    Converts a parsed source into an Arrow table with the declared schema.
+    """
+    df = df.copy()
+    df.columns = [str(column) for column in df.columns]
+    for field in schema:
+        values = df[field.name]
+        if pa.types.is_string(field.type):
+            df[field.name] = values.where(values.isna(), values.astype(str))
+        elif pa.types.is_timestamp(field.type):
+            df[field.name] = pd.to_datetime(values)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def restore_frame(name, df):
+    """
+    Restores pandas conventions that Arrow does not keep: NaN for missing
+    strings and integer years mixed with text in the Best Friends Data Year.
+    """
+    df = nulls_to_nan(df)
+    if name == 'best_friends':
+        data_year = df['Data Year']
+        numeric = pd.to_numeric(data_year, errors='coerce')
+        df['Data Year'] = data_year.mask(numeric.notna(), numeric.astype('Int64').astype(object))
+    return df
+
+
+def parse_source(name, path, cache_dir=None, offline=False):
+    """
+    Reads and parses a source workbook into a typed DataFrame.
+
+    Parameters:
+        name (str): The source name.
+        path (str or SourceAdapter): The URL or path of the workbook, or the adapter that reads it.
+        cache_dir (str): Cache directory used for remote workbooks.
+        offline (bool): Only use the local cache for remote workbooks.
+
+    Returns:
+        pd.DataFrame: The parsed DataFrame, or None if it could not be loaded.
+    """
+    return make_adapter(name, path).load(cache_dir=cache_dir, offline=offline)
+
+
+def source_hash(path, offline=False):
+    """
+    Returns the hash of a local workbook or the ETag/Last-Modified of a remote
+    one, hashing the downloaded content when the server sends neither or
+    rejects HEAD requests.
+
+    Returns:
+        tuple: The hash, or None offline or when the source cannot be reached,
+        in which case the existing Arrow file is reused, and the downloaded
+        bytes of a remote workbook that had to be hashed, or None.
+    """
+    if local_path(path) is not None:
+        return hash_file(local_path(path)), None
+    if offline:
+        return None, None
+    try:
+        return content_validator(path)
+    except Exception as e:
+        print(f"Could not check {path} for changes: {e}")
+        return None, None
+
+
+def read_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(output_dir, manifest):
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def read_arrow(path):
+    """
+    Reads an Arrow file into a DataFrame. The file is memory-mapped rather than
+    read into a buffer, but to_pandas still copies every column into NumPy-backed
+    pandas columns, which the rest of the pipeline and restore_frame expect; the
+    result is not a zero-copy view of the file.
+    """
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def ingest_source(name, path, output_dir=INGEST_DIR, force=False, cache_dir=None, offline=False, manifest=None):
+    """
+    Converts one source workbook to Arrow if it changed and loads the result.
+
+    Parameters:
+        name (str): The source name.
+        path (str or SourceAdapter): The URL or path of the workbook, or the adapter that reads it.
+        output_dir (str): Directory holding the Arrow files and manifest.
+        force (bool): Re-convert even if the source is unchanged.
+        cache_dir (str): Cache directory used for remote workbooks.
+        offline (bool): Never contact remote sources; use existing files.
+        manifest (dict): The manifest to read and update. Read from disk if None.
+
+    Returns:
+        pd.DataFrame: The typed DataFrame, or None if it could not be loaded.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = read_manifest(output_dir)
+
+    adapter = make_adapter(name, path)
+    entry = manifest.get(name)
+    output_path = os.path.join(output_dir, name + '.arrow')
+    current_hash, content = source_hash(adapter.location, offline=offline)
+
+    is_current = (
+        entry is not None
+        and os.path.exists(output_path)
+        and entry['source'] == adapter.location
+        and entry.get('adapter') == adapter.signature()
+        and entry['schema_version'] == SCHEMA_VERSION
+        # No hash offline or when the source is unreachable: keep the existing file
+        and (current_hash is None or entry['source_hash'] == current_hash)
+    )
+
+    if force or not is_current:
+        # A workbook downloaded to hash it is parsed from those bytes rather than fetched again
+        validated = (current_hash, content) if content is not None else None
+        df = adapter.load(cache_dir=cache_dir, offline=offline, validated=validated)
+        if df is None:
+            return None
+        table = to_table(df, declare_schema(adapter.kind, df))
+        feather.write_feather(table, output_path, compression='uncompressed')
+        manifest[name] = {
+            'source': adapter.location,
+            'adapter': adapter.signature(),
+            'source_hash': current_hash,
+            'output': os.path.basename(output_path),
+            'rows': table.num_rows,
+            'columns': table.num_columns,
+            'schema_version': SCHEMA_VERSION,
+            'converted_at': time.time(),
+        }
+        if own_manifest:
+            write_manifest(output_dir, manifest)
+        print(f"Converted {name} ({table.num_rows} rows) to {output_path}")
+
+    return restore_frame(adapter.kind, read_arrow(output_path))
+
+
+def ingest_sources(sources=None, output_dir=INGEST_DIR, force=False, cache_dir=None, offline=False, workers=None):
+    """
+    Converts the source workbooks that changed and loads all of them. The
+    sources are fetched and converted concurrently (see dataset_adapters.py).
+
+    Parameters:
+        sources (dict): Source name to URL, path or SourceAdapter. Defaults to SOURCES.
+        output_dir (str): Directory holding the Arrow files and manifest.
+        force (bool): Re-convert every source.
+        cache_dir (str): Cache directory used for remote workbooks.
+        offline (bool): Never contact remote sources; use existing files.
+        workers (int): Number of sources loaded at once.
+
+    Returns:
+        dict: Source name to DataFrame (None for sources that failed to load).
+    """
+    sources = sources or SOURCES
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = read_manifest(output_dir)
+
+    def ingest(name):
+        return ingest_source(name, sources[name], output_dir=output_dir, force=force, cache_dir=cache_dir,
+                             offline=offline, manifest=manifest)
+
+    frames = run_concurrently(ingest, sources, workers=workers)
+    write_manifest(output_dir, manifest)
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the source workbooks to Arrow files.')
+    parser.add_argument('--output-dir', default=INGEST_DIR, help='Directory for the Arrow files and manifest')
+    parser.add_argument('--cache-dir', default=os.environ.get('SHELTER_CACHE_DIR', '.shelter_cache'),
+                        help='Cache directory for remote workbooks')
+    parser.add_argument('--force', action='store_true', help='Re-convert every source')
+    parser.add_argument('--offline', action='store_true', help='Do not contact remote sources')
+    parser.add_argument('--workers', type=int, help='Number of sources loaded at once')
+    args = parser.parse_args()
+
+    frames = ingest_sources(output_dir=args.output_dir, force=args.force, cache_dir=args.cache_dir, offline=args.offline,
+                            workers=args.workers)
+    for name, df in frames.items():
+        if df is None:
+            print(f"Failed to load {name}.")
+        else:
+            print(f"{name}: {len(df)} rows, {len(df.columns)} columns")
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,240 @@
+## Outcome Metrics
+#
+# Computes the outcome rates of the Georgia reports for dogs, cats and both
+# together, by shelter, state, year or month:
+#   - Live Release Rate: live outcomes (adoption, return to owner, transfer,
+#     return to field, other live outcome) over live outcomes plus deaths,
+#     losses and shelter euthanasia; owner-requested euthanasia is left out,
+#     as in the Shelter Animals Count definition
+#   - Euthanasia Rate: shelter and owner-requested euthanasia over all outcomes
+#   - Return To Owner Rate: returns to owner over stray intake
+#   - Balance: intake minus outcomes, the change in the shelter population
+# The intake and outcome counts are stacked into one array and summed by
+# group in a single NumPy pass, and the rates are computed for every group
+# at once. The export's 'Feline list in care' column is counted as cats lost
+# in care. The metrics by shelter, state and year are computed from the
+# aggregation cube and saved next to it, so charts and reports read them
+# instead of recomputing them.
+#
+# Usage:
+#   python dataset_metrics.py --by state
+#   python dataset_metrics.py --by shelter --state GA --sort "Total Live Release Rate" --top 20
+#   python dataset_metrics.py --by month --output monthly_metrics.csv
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_aggregation import CUBE_PATH, load_cube
+
+METRICS_DIR = os.environ.get('SHELTER_METRICS_DIR', os.path.join('aggregates', 'metrics'))
+
+# Intake and outcome counts of each species, by their column in the Georgia export
+COMPONENTS = {
+    'stray': 'stray at large',
+    'relinquished': 'relinquished by owner',
+    'owner_intended_intake': 'intake owner intended euthanasia',
+    'transferred_in': 'transferred in from agency',
+    'other_intake': 'other intakes',
+    'adoption': 'adoption',
+    'returned_to_owner': 'returned to owner',
+    'transferred_out': 'transferred to another agency',
+    'returned_to_field': 'returned to field',
+    'other_live': 'other live outcome',
+    'died': 'died in care',
+    'lost': 'lost in care',
+    'shelter_euthanasia': 'shelter euthanasia',
+    'owner_intended_euthanasia': 'owner intended euthanasia',
+}
+
+INTAKE = ['stray', 'relinquished', 'owner_intended_intake', 'transferred_in', 'other_intake']
+LIVE_OUTCOMES = ['adoption', 'returned_to_owner', 'transferred_out', 'returned_to_field', 'other_live']
+OUTCOMES = LIVE_OUTCOMES + ['died', 'lost', 'shelter_euthanasia', 'owner_intended_euthanasia']
+
+# Columns of the export whose names differ from the pattern
+MISNAMED_COLUMNS = {'Feline lost in care': 'Feline list in care'}
+
+SPECIES = ['Canine', 'Feline']
+
+# Groupings saved with the cube: level -> cube columns
+LEVELS = {
+    'shelter': ['State', 'Shelter Name'],
+    'state': ['State'],
+    'year': ['Data Year'],
+    'state_year': ['State', 'Data Year'],
+}
+
+METRICS = ['Intake', 'Outcomes', 'Live Outcomes', 'Live Release Rate', 'Euthanasia Rate', 'Return To Owner Rate',
+           'Balance']
+
+
+def component_columns():
+    """
+    Returns the source column of every species and component, species first.
+    """
+    columns = []
+    for species in SPECIES:
+        for name in COMPONENTS.values():
+            column = f'{species} {name}'
+            columns.append(MISNAMED_COLUMNS.get(column, column))
+    return columns
+
+
+def ratio(numerator, denominator):
+    """
+    Divides elementwise, leaving missing values where the denominator is zero.
+    """
+    out = np.full(np.shape(numerator), np.nan)
+    return np.divide(numerator, denominator, out=out, where=denominator > 0)
+
+
+def group_sums(values, codes, groups):
+    """
+    Sums the rows of an array by group code in one pass, as a single bincount
+    over the flattened array.
+
+    Parameters:
+        values (np.ndarray): Rows x columns.
+        codes (np.ndarray): The group code (0 to groups - 1) of each row.
+        groups (int): Number of groups.
+
+    Returns:
+        np.ndarray: Groups x columns.
+    """
+    columns = values.shape[1]
+    cells = (codes[:, None] * columns + np.arange(columns)).ravel()
+    return np.bincount(cells, weights=values.ravel(), minlength=groups * columns).reshape(groups, columns)
+
+
+def outcome_metrics(frame, by):
+    """
+    Computes the outcome metrics of each group of rows.
+
+    Parameters:
+        frame (pd.DataFrame): Rows with the Georgia intake and outcome columns,
+            such as the combined dataset or the aggregation cube.
+        by (list): The columns to group by.
+
+    Returns:
+        pd.DataFrame: The group columns and, for 'Canine', 'Feline' and 'Total',
+        each of METRICS (e.g. 'Canine Live Release Rate'). Groups without any
+        intake or outcome are left out.
+    """
+    keys = frame[by]
+    codes = keys.groupby(by, dropna=False, sort=True).ngroup().to_numpy()
+    # The first row of each group, without sorting the codes
+    first = np.empty(codes.max() + 1 if len(codes) else 0, dtype='int64')
+    first[codes[::-1]] = np.arange(len(codes))[::-1]
+    groups = keys.iloc[first].reset_index(drop=True)
+
+    values = np.column_stack([frame[column].to_numpy(dtype='float64') for column in component_columns()])
+    np.nan_to_num(values, copy=False)
+    sums = group_sums(values, codes, len(groups)).reshape(len(groups), len(SPECIES), len(COMPONENTS))
+    # Both species together as a third
+    sums = np.concatenate([sums, sums.sum(axis=1, keepdims=True)], axis=1)
+
+    position = {name: index for index, name in enumerate(COMPONENTS)}
+    def total(names):
+        return sums[:, :, [position[name] for name in names]].sum(axis=2)
+
+    intake, outcomes, live = total(INTAKE), total(OUTCOMES), total(LIVE_OUTCOMES)
+    metrics = {
+        'Intake': intake,
+        'Outcomes': outcomes,
+        'Live Outcomes': live,
+        'Live Release Rate': ratio(live, live + total(['died', 'lost', 'shelter_euthanasia'])),
+        'Euthanasia Rate': ratio(total(['shelter_euthanasia', 'owner_intended_euthanasia']), outcomes),
+        'Return To Owner Rate': ratio(total(['returned_to_owner']), total(['stray'])),
+        'Balance': intake - outcomes,
+    }
+
+    table = groups
+    for index, species in enumerate(SPECIES + ['Total']):
+        for name in METRICS:
+            table[f'{species} {name}'] = metrics[name][:, index]
+    active = (intake[:, -1] > 0) | (outcomes[:, -1] > 0)
+    return table[active].reset_index(drop=True)
+
+
+def metrics_tables(cube):
+    """
+    Computes the metrics of every level in LEVELS from the cube, without duplicates.
+
+    Returns:
+        dict: Level -> metrics table.
+    """
+    cube = cube[~cube['Duplicate'].astype(bool)]
+    return {level: outcome_metrics(cube, by) for level, by in LEVELS.items()}
+
+
+def monthly_metrics(combined_df, by=('State',), date='Report Period Start'):
+    """
+    Computes the metrics by month of the report period from the combined dataset, without duplicates.
+    """
+    reports = combined_df[combined_df[date].notna()]
+    if 'Shelter Name Annotation' in reports.columns:
+        reports = reports[reports['Shelter Name Annotation'].astype(str) != 'R']
+    reports = reports.assign(Month=pd.to_datetime(reports[date]).dt.to_period('M').dt.to_timestamp())
+    return outcome_metrics(reports, list(by) + ['Month'])
+
+
+def save_metrics(tables, directory=METRICS_DIR):
+    """
+    Writes the metrics tables as Parquet files, one per level.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for level, table in tables.items():
+        table.to_parquet(os.path.join(directory, f'{level}.parquet'), index=False)
+    return directory
+
+
+def load_metrics(level, directory=METRICS_DIR, cube_path=CUBE_PATH):
+    """
+    Reads a metrics table, computing every level from the cube first if the
+    tables are missing or older than the cube.
+    """
+    path = os.path.join(directory, f'{level}.parquet')
+    if level not in LEVELS:
+        raise KeyError(f"No metrics level {level!r}; choose one of {', '.join(LEVELS)}")
+    if os.path.exists(path) and not (os.path.exists(cube_path) and os.path.getmtime(cube_path) > os.path.getmtime(path)):
+        return pd.read_parquet(path)
+    if not os.path.exists(cube_path):
+        raise FileNotFoundError(f"No cube at {cube_path}; run dataset_transformation.py first")
+    tables = metrics_tables(load_cube(cube_path))
+    save_metrics(tables, directory)
+    return tables[level]
+
+
+def main():
+    from dataset_partitions import COMBINED_PATH, read_combined
+
+    parser = argparse.ArgumentParser(description='Outcome rates by shelter, state, year or month.')
+    parser.add_argument('--by', choices=list(LEVELS) + ['month'], default='state', help='Grouping of the metrics')
+    parser.add_argument('--state', action='append', help='Only show this state (may be repeated)')
+    parser.add_argument('--sort', default='Total Intake', help='Metric to sort by, largest first')
+    parser.add_argument('--top', type=int, help='Only show this many rows')
+    parser.add_argument('--output', help='Write the table to this CSV file')
+    args = parser.parse_args()
+
+    if args.by == 'month':
+        columns = ['State', 'Shelter Name Annotation', 'Report Period Start'] + component_columns()
+        table = monthly_metrics(read_combined(COMBINED_PATH, columns=columns))
+    else:
+        table = load_metrics(args.by)
+    if args.state and 'State' in table.columns:
+        table = table[table['State'].isin(args.state)]
+    table = table.sort_values(args.sort, ascending=False)
+    if args.top:
+        table = table.head(args.top)
+
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"{len(table)} rows saved to {args.output}")
+    else:
+        print(table.to_string(index=False))
+
+if __name__=='__main__':
+
+    main()
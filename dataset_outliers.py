@@ -0,0 +1,319 @@
+## Robust Outlier Engine
+#
+# Flags data entry mistakes in the monthly Georgia counts against robust
+# per-shelter baselines. The baseline of a report is the median of the same
+# calendar month in the shelter's other years, so a mistaken count never pulls
+# its own baseline, or the shelter's overall median when fewer than MIN_PERIODS
+# other years are available. Removing one value from a sorted month moves its
+# median to one of three values, depending on whether the value is below, at or
+# above the median, so the model keeps those three per shelter and month rather
+# than a median per report. Deviations are scaled by
+# the shelter's median absolute deviation (MAD), so a score is a robust
+# z-score. Every count column is scored in one grouped, vectorized pass;
+# flagged values can be replaced by their baseline and are listed in an audit
+# table.
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import GEORGIA_INTAKE_COLUMNS, GEORGIA_OUTCOME_COLUMNS
+
+OUTLIER_COLUMNS = GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS
+
+OUTLIER_AUDIT_PATH = os.environ.get('SHELTER_OUTLIER_AUDIT_PATH', os.path.join('aggregates', 'outlier_audit.csv'))
+
+# Robust z-score above which a value is an outlier (Iglewicz and Hoaglin)
+THRESHOLD = 3.5
+
+# Smallest deviation from the baseline, in animals, that is flagged
+MIN_DEVIATION = 10
+
+# Fewest other reports of a calendar month needed for a seasonal baseline
+MIN_PERIODS = 3
+
+# Fewest reports of a shelter needed to score it; the spread of fewer is unreliable
+MIN_REPORTS = 12
+
+# Scale factors that make the MAD and the mean absolute deviation estimate a standard deviation
+MAD_SCALE = 1.4826
+MEAN_AD_SCALE = 1.253314
+
+AUDIT_COLUMNS = ['row', 'Shelter Name', 'Report Period Start', 'column', 'value', 'baseline', 'scale', 'score', 'imputed']
+
+
+def report_months(df, date='Report Period Start'):
+    return pd.to_datetime(df[date]).dt.month.to_numpy()
+
+
+def group_keys(shelters, codes, month):
+    """
+    Combines shelter codes and calendar months into one integer key per report;
+    -1 where either is unknown.
+    """
+    keys = codes * 12 + np.nan_to_num(month, nan=1).astype('int64') - 1
+    return np.where((codes >= 0) & ~np.isnan(month), keys, -1)
+
+
+def leave_one_out_medians(values, keys):
+    """
+    Computes the median of each group of reports without one of its values.
+
+    Parameters:
+        values (pd.DataFrame): The counts, one column per count column.
+        keys (np.ndarray): The group of each row.
+
+    Returns:
+        tuple: DataFrames of the medians without a value below, equal to and above
+        the group's median, indexed by group like values.groupby(keys).median().
+    """
+    groups, group = np.unique(keys, return_inverse=True)
+    starts = np.searchsorted(np.sort(group), np.arange(len(groups)))
+    below, at, above = (np.full((len(groups), values.shape[1]), np.nan) for _ in range(3))
+    for position, column in enumerate(values.to_numpy().T):
+        # Missing values sort last in their group and are not counted
+        ordered = column[np.lexsort((column, group))]
+        n = np.bincount(group, weights=~np.isnan(column), minlength=len(groups)).astype('int64')
+
+        def nth(rank):
+            found = (rank >= 0) & (rank < n)
+            picked = np.full(len(groups), np.nan)
+            picked[found] = ordered[starts[found] + rank[found]]
+            return picked
+
+        # An odd group of 2k + 1 values has its median at x[k], an even one of 2k between x[k - 1] and x[k]
+        middle = n // 2
+        before, median, after = nth(middle - 1), nth(middle), nth(middle + 1)
+        odd = n % 2 == 1
+        below[:, position] = np.where(odd, (median + after) / 2, median)
+        at[:, position] = np.where(odd, (before + after) / 2, median)
+        above[:, position] = np.where(odd, (before + median) / 2, before)
+    return tuple(pd.DataFrame(table, index=groups, columns=values.columns) for table in [below, at, above])
+
+
+def fit_baselines(df, columns=OUTLIER_COLUMNS, by='Shelter Name', date='Report Period Start', min_periods=MIN_PERIODS,
+                  min_reports=MIN_REPORTS):
+    """
+    Computes the robust baselines and scales of each shelter.
+
+    Rows without a shelter or report date are ignored, and repeated reports (the same
+    shelter, date and counts, found by hashing the rows) are counted once.
+
+    Parameters:
+        df (pd.DataFrame): Monthly reports.
+        columns (list): The count columns to model. Columns missing from df are skipped.
+        by (str): The shelter column.
+        date (str): The report date column.
+        min_periods (int): Fewest other reports of a calendar month for a seasonal baseline.
+        min_reports (int): Fewest reports of a shelter for it to be scored.
+
+    Returns:
+        dict: The model: the shelters, the seasonal medians, the medians without a
+        value below, at or above them and the counts keyed by shelter and month,
+        overall medians and scales by shelter, and the settings.
+    """
+    columns = [column for column in columns if column in df.columns]
+    reports = df.loc[pd.to_datetime(df[date]).notna() & df[by].notna(), [by, date] + columns]
+    reports = reports[~pd.util.hash_pandas_object(reports, index=False).duplicated().to_numpy()]
+
+    codes, shelters = pd.factorize(reports[by])
+    values = reports[columns].astype('float64')
+    values.index = codes
+
+    keys = group_keys(shelters, codes, report_months(reports, date))
+    seasonal = values.groupby(keys)
+    below, at, above = leave_one_out_medians(values, keys)
+    model = {
+        'columns': columns,
+        'by': by,
+        'date': date,
+        'min_periods': min_periods,
+        'shelters': shelters,
+        'seasonal_median': seasonal.median(),
+        'seasonal_below': below,
+        'seasonal_at': at,
+        'seasonal_above': above,
+        'seasonal_count': seasonal.count(),
+        'overall_median': values.groupby(level=0).median(),
+    }
+
+    # Spread of each shelter's counts around its overall median; residuals from the few
+    # reports of one month would understate it
+    deviation = (values - model['overall_median'].reindex(codes).to_numpy()).abs().groupby(level=0)
+    mad, mean_ad = deviation.median(), deviation.mean()
+    scale = (MAD_SCALE * mad).where(mad > 0, MEAN_AD_SCALE * mean_ad)
+    model['scale'] = scale.where(values.groupby(level=0).size() >= min_reports, axis=0)
+    return model
+
+
+def baselines(model, codes, month, values):
+    """
+    Looks up the baseline of each report: the median of the other reports of its
+    shelter and month. The reports must be among those the model was fitted on.
+
+    Parameters:
+        model (dict): The model returned by fit_baselines.
+        codes (np.ndarray): The position of each report's shelter in model['shelters'], or -1.
+        month (np.ndarray): The calendar month of each report.
+        values (np.ndarray): The counts of each report, one column per model column.
+
+    Returns:
+        np.ndarray: One baseline per report and column; NaN for unknown shelters and months.
+    """
+    keys = group_keys(model['shelters'], codes, month)
+    median, below, at, above = (model[name].reindex(keys).to_numpy()
+                                for name in ['seasonal_median', 'seasonal_below', 'seasonal_at', 'seasonal_above'])
+    seasonal = np.where(values < median, below, np.where(values > median, above, at))
+    others = model['seasonal_count'].reindex(keys).to_numpy() - 1
+    overall = model['overall_median'].reindex(codes).to_numpy()
+    overall[keys < 0] = np.nan
+    return np.where(others >= model['min_periods'], seasonal, overall)
+
+
+def score_outliers(df, model):
+    """
+    Scores every count of every report against the model.
+
+    Returns:
+        tuple: Arrays of values, baselines, scales and robust z-scores, one row
+        per row of df and one column per model column. Rows without a report
+        date or of shelters unknown to the model or with too few reports score NaN.
+    """
+    values = df[model['columns']].astype('float64').to_numpy()
+    codes = model['shelters'].get_indexer(df[model['by']])
+    month = report_months(df, model['date'])
+
+    baseline = baselines(model, codes, month, values)
+    scale = model['scale'].reindex(codes).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (values - baseline) / scale
+    # A shelter whose counts never vary has no scale; only exact matches are expected
+    score[(scale == 0) & (values == baseline)] = 0
+    return values, baseline, scale, score
+
+
+def repair_outliers(df, model, impute=True, threshold=THRESHOLD, min_deviation=MIN_DEVIATION):
+    """
+    Flags outlying counts and optionally replaces them with their baseline.
+
+    Parameters:
+        df (pd.DataFrame): Monthly reports with the model's columns.
+        model (dict): The model returned by fit_baselines.
+        impute (bool): Replace flagged values with their baseline.
+        threshold (float): Robust z-score above which a value is flagged.
+        min_deviation (float): Smallest absolute deviation that is flagged.
+
+    Returns:
+        tuple: The DataFrame (modified in place when imputing) and the audit
+        table with one row per flagged value.
+    """
+    values, baseline, scale, score = score_outliers(df, model)
+    with np.errstate(invalid='ignore'):
+        flagged = (np.abs(score) > threshold) & (np.abs(values - baseline) >= min_deviation)
+    rows, positions = np.nonzero(flagged)
+
+    columns = np.array(model['columns'], dtype=object)
+    audit = pd.DataFrame({
+        'row': df.index.to_numpy()[rows],
+        'Shelter Name': df[model['by']].to_numpy()[rows],
+        'Report Period Start': pd.to_datetime(df[model['date']]).to_numpy()[rows],
+        'column': columns[positions],
+        'value': values[rows, positions],
+        'baseline': baseline[rows, positions],
+        'scale': scale[rows, positions],
+        'score': score[rows, positions],
+        'imputed': baseline[rows, positions] if impute else np.nan,
+    }, columns=AUDIT_COLUMNS)
+
+    if impute:
+        for position in np.unique(positions):
+            column = columns[position]
+            at = rows[positions == position]
+            # Baselines need not be whole counts
+            df[column] = df[column].astype('float64')
+            df.iloc[at, df.columns.get_loc(column)] = baseline[at, position]
+    return df, audit
+
+
+def merge_baselines(model, update):
+    """
+    Replaces the baselines of the shelters fitted in update and keeps those of
+    the other shelters. Baselines of different shelters are independent, so
+    the result equals a fit over all the shelters' reports.
+
+    Parameters:
+        model (dict): The current model, or None.
+        update (dict): A model fitted on the reports of some shelters, with the same settings.
+
+    Returns:
+        dict: The merged model.
+    """
+    if model is None:
+        return update
+    replaced = model['shelters'].isin(update['shelters'])
+    kept = model['shelters'][~replaced]
+    shelters = kept.append(update['shelters'])
+
+    # New codes of the old and updated shelters; -1 drops a replaced shelter
+    old_codes = np.where(replaced, -1, np.arange(len(model['shelters'])) - np.cumsum(replaced))
+    new_codes = np.arange(len(kept), len(shelters))
+
+    def recode(table, codes, seasonal):
+        keys = table.index.to_numpy()
+        mapped = codes[keys // 12 if seasonal else keys]
+        table = table[mapped >= 0]
+        keys, mapped = keys[mapped >= 0], mapped[mapped >= 0]
+        return table.set_axis(mapped * 12 + keys % 12 if seasonal else mapped)
+
+    merged = dict(update, shelters=shelters)
+    for name, seasonal in [('seasonal_median', True), ('seasonal_below', True), ('seasonal_at', True),
+                           ('seasonal_above', True), ('seasonal_count', True), ('overall_median', False),
+                           ('scale', False)]:
+        merged[name] = pd.concat([recode(model[name], old_codes, seasonal),
+                                  recode(update[name], new_codes, seasonal)]).sort_index()
+    return merged
+
+
+def save_baselines(model, path):
+    """
+    Pickles a model for later runs.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_baselines(path):
+    """
+    Reads a model saved by save_baselines, or returns None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_audit(path=OUTLIER_AUDIT_PATH):
+    """
+    Reads an audit table written by save_audit, or returns an empty one.
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=AUDIT_COLUMNS)
+    return pd.read_csv(path, parse_dates=['Report Period Start'])
+
+
+def save_audit(audit, path=OUTLIER_AUDIT_PATH):
+    """
+    Writes the audit table as CSV.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    audit.to_csv(path, index=False)
+    return path
@@ -0,0 +1,228 @@
+## Partitioned Combined Dataset
+#
+# Stores the cleaned combined dataframe as a Parquet dataset partitioned by
+# State and Data Year (State=GA/Data Year=2022/...), so an analysis of a few
+# states or years reads only their files, and only the columns it asks for.
+# Filters on other columns, such as dropping the duplicate reports annotated
+# 'R', are pushed down to the Parquet reader.
+#
+# Usage:
+#   python dataset_partitions.py --years 2021 2023 --state GA
+#   python dataset_partitions.py --years 2022 2022 --columns "Shelter Name" "Total Intake Gross" --output slice.csv
+
+import argparse
+import json
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from dataset_cache import nulls_to_nan
+
+COMBINED_PATH = os.environ.get('SHELTER_COMBINED_PATH', os.path.join('aggregates', 'combined'))
+
+# Directory levels of the dataset; rows without a numeric year are stored under
+# the Hive default partition and read back with a missing Data Year
+PARTITIONING = ds.partitioning(pa.schema([('State', pa.string()), ('Data Year', pa.int16())]), flavor='hive')
+
+
+def to_partition_table(combined_df):
+    """
+    Converts the combined dataframe into an Arrow table with the partition types.
+
+    Data Year is stored as its numeric year, as build_cube reads it. The
+    annotations, which the duplicate filter compares with 'R', and columns
+    mixing text with numbers, such as EIN, are stored as text.
+
+    Parameters:
+        combined_df (pd.DataFrame): The cleaned combined dataframe.
+
+    Returns:
+        pa.Table: The table to write.
+    """
+    df = combined_df.copy()
+    df['State'] = df['State'].astype(object)
+    df['Data Year'] = pd.to_numeric(df['Data Year'], errors='coerce').astype('Int16')
+    annotations = df['Shelter Name Annotation'].astype(object)
+    df['Shelter Name Annotation'] = annotations.where(annotations.isna(), annotations.astype(str))
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if len({type(category) for category in values.cat.categories}) > 1:
+                df[column] = values.cat.rename_categories(str)
+        elif values.dtype == object and column != 'State':
+            if len({type(value) for value in values.dropna()}) > 1:
+                df[column] = values.where(values.isna(), values.astype(str))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    position = table.schema.get_field_index('Shelter Name Annotation')
+    return table.set_column(position, 'Shelter Name Annotation', table.column(position).cast(pa.string()))
+
+
+def save_combined(combined_df, path=COMBINED_PATH):
+    """
+    Writes the combined dataframe as a dataset partitioned by State and Data Year,
+    replacing any earlier dataset at the path.
+
+    Returns:
+        str: The dataset directory.
+    """
+    writer = CombinedWriter(path)
+    writer.write(combined_df)
+    return writer.close()
+
+
+class CombinedWriter:
+    """
+    Writes the combined dataset in parts, such as the chunks of a streamed run
+    or the kept and rebuilt rows of a refresh, into a staging directory that
+    replaces the dataset at the path when closed. Parts may differ in the types
+    of columns they have no values for; read_combined reconciles them.
+    """
+
+    def __init__(self, path=COMBINED_PATH):
+        self.path = path
+        self.staging = path.rstrip(os.sep) + '.tmp'
+        self.parts = 0
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    def write(self, combined_df):
+        """
+        Adds the rows of a combined dataframe to the dataset.
+        """
+        if len(combined_df) == 0:
+            return
+        ds.write_dataset(to_partition_table(combined_df), self.staging, format='parquet', partitioning=PARTITIONING,
+                         basename_template=f'part-{self.parts}-{{i}}.parquet',
+                         existing_data_behavior='overwrite_or_ignore')
+        self.parts += 1
+
+    def close(self):
+        """
+        Replaces the dataset at the path with the parts written.
+
+        Returns:
+            str: The dataset directory.
+        """
+        if not self.parts:
+            raise ValueError(f"No rows written to {self.path}")
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.staging, self.path)
+        return self.path
+
+
+def merge_types(first, second):
+    """
+    Returns a type both Arrow types convert to: the other type for nulls, int64
+    for two integer types, float64 for mixed numbers and text otherwise.
+    """
+    if first == second or pa.types.is_null(second):
+        return first
+    if pa.types.is_null(first):
+        return second
+    if pa.types.is_integer(first) and pa.types.is_integer(second):
+        return pa.int64()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in [first, second]):
+        return pa.float64()
+    return pa.string()
+
+
+def dataset_schema(schemas):
+    """
+    Merges the schemas of the files of a dataset, adding the partition fields.
+    """
+    types = {}
+    for schema in schemas:
+        for field in schema:
+            types[field.name] = merge_types(types[field.name], field.type) if field.name in types else field.type
+    for field in PARTITIONING.schema:
+        types.setdefault(field.name, field.type)
+    return pa.schema(list(types.items()))
+
+
+def combined_filter(years=None, states=None, include_duplicates=False):
+    """
+    Builds the dataset filter of a report slice, with the arguments of slice_cube.
+
+    Parameters:
+        years (tuple): Inclusive (first, last) year range, or None for all rows.
+        states (list): States to keep, or None for all states.
+        include_duplicates (bool): Keep rows annotated as duplicates ('R').
+
+    Returns:
+        ds.Expression or None: The filter, or None to read every row.
+    """
+    conditions = []
+    if years is not None:
+        conditions.append((ds.field('Data Year') >= years[0]) & (ds.field('Data Year') <= years[1]))
+    if states is not None:
+        conditions.append(ds.field('State').isin(list(states)))
+    if not include_duplicates:
+        annotation = ds.field('Shelter Name Annotation')
+        conditions.append(annotation.is_null() | (annotation != 'R'))
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def read_combined(path=COMBINED_PATH, years=None, states=None, include_duplicates=False, columns=None):
+    """
+    Reads a slice of the combined dataset. Only the partitions of the selected
+    states and years are opened and only the requested columns are read.
+
+    Parameters:
+        path (str): The dataset directory written by save_combined.
+        years (tuple): Inclusive (first, last) year range, or None for all years.
+        states (list): States to keep, or None for all states.
+        include_duplicates (bool): Keep rows annotated as duplicates ('R').
+        columns (list): Columns to read, or None for all columns in their original order.
+
+    Returns:
+        pd.DataFrame: The selected rows.
+    """
+    dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+    metadata = dataset.schema.metadata
+    # Files written as separate parts can differ in column types; read them as one merged type
+    schemas = []
+    for fragment in dataset.get_fragments():
+        if not any(fragment.physical_schema.equals(schema) for schema in schemas):
+            schemas.append(fragment.physical_schema)
+    if len(schemas) > 1:
+        dataset = ds.dataset(path, format='parquet', partitioning=PARTITIONING, schema=dataset_schema(schemas))
+    if columns is None:
+        # The partition columns come last in the dataset schema; restore the frame's order
+        pandas_metadata = json.loads(metadata[b'pandas'])
+        columns = [column['name'] for column in pandas_metadata['columns'] if column['name'] in dataset.schema.names]
+    table = dataset.to_table(columns=list(columns), filter=combined_filter(years, states, include_duplicates))
+    if len(schemas) > 1:
+        # The pandas dtypes recorded with one part may not hold the merged types
+        table = table.replace_schema_metadata(None)
+    return nulls_to_nan(table.to_pandas())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read a slice of the partitioned combined dataset.')
+    parser.add_argument('--path', default=COMBINED_PATH, help='Dataset directory')
+    parser.add_argument('--years', nargs=2, type=int, metavar=('FIRST', 'LAST'), help='Inclusive range of data years')
+    parser.add_argument('--state', action='append', help='Keep only this state (may be repeated)')
+    parser.add_argument('--include-duplicates', action='store_true', help="Keep reports annotated 'R'")
+    parser.add_argument('--columns', nargs='+', help='Columns to read')
+    parser.add_argument('--output', help='Write the slice to this CSV file')
+    args = parser.parse_args()
+
+    df = read_combined(args.path, years=args.years, states=args.state, include_duplicates=args.include_duplicates,
+                       columns=args.columns)
+    print(f"Read {len(df)} rows x {len(df.columns)} columns from {args.path}")
+    if args.output:
+        df.to_csv(args.output, index=False)
+        print(f"Slice saved to {args.output}")
+    else:
+        print(df.head())
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,394 @@
+## Incremental Stage Pipeline
+#
+# Runs the stages of dataset_transformation.py as a small DAG. Each stage's
+# output is fingerprinted from the stage's code and the fingerprints of its
+# inputs and pickled under .pipeline_cache, so a rerun only recomputes stages
+# whose code or inputs changed. Figures are render stages of their own. Stages
+# have no side effects; the files a stage's output is saved to for use outside
+# the pipeline are written by its publish step, which runs whenever the stage is
+# computed or one of those files is missing.
+#
+# Usage:
+#   python dataset_pipeline.py                       # run everything
+#   python dataset_pipeline.py --stage clean         # run up to one stage
+#   python dataset_pipeline.py --figure Top_10_Shelters
+#   python dataset_pipeline.py --list
+#   python dataset_pipeline.py --trace trace.json    # record stage timings and memory
+
+import argparse
+import glob
+import hashlib
+import importlib.util
+import inspect
+import json
+import os
+import pickle
+import types
+
+import dataset_transformation as transformation
+from dataset_trace import TRACE_PATH, count_rows, emit, enable_tracing, span
+
+PIPELINE_CACHE_DIR = os.environ.get('SHELTER_PIPELINE_CACHE_DIR', '.pipeline_cache')
+
+# Stage name -> (function, upstream stages passed as arguments in order)
+STAGES = {
+    'load': (transformation.load_sources, []),
+    'annotate': (transformation.annotate_georgia, ['load']),
+    'merge': (transformation.merge_sources, ['annotate', 'load']),
+    'clean': (transformation.clean_combined, ['merge']),
+    'compact': (transformation.compact_combined, ['clean']),
+    'outliers': (transformation.fix_data_entry_mistakes, ['compact']),
+    'cube': (transformation.build_shelter_cube, ['outliers']),
+    'aggregate': (transformation.aggregate_reports, ['cube']),
+}
+
+# Stage name -> (function saving the stage output, upstream stages passed after the output, files it writes)
+PUBLISHERS = {
+    'cube': (transformation.publish_shelter_cube, ['outliers'], transformation.cube_artifacts),
+}
+
+
+def is_project_function(value, func):
+    """
+    Whether a function called by a stage belongs to this project, so its code is part of the fingerprint.
+    """
+    return value.__module__ == func.__module__ or value.__module__.startswith('dataset_')
+
+
+def is_project_module(name):
+    return name.startswith('dataset_')
+
+
+def referenced_names(code):
+    """
+    Returns the global, attribute and imported names used by compiled code and the functions nested in it.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= referenced_names(const)
+    return names
+
+
+def describe_setting(value):
+    """
+    Describes a setting the same way in every run: functions and classes in it
+    are named rather than shown with their addresses, as their code is hashed
+    on its own.
+    """
+    if isinstance(value, (types.FunctionType, type)):
+        return f'{value.__module__}.{value.__qualname__}'
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{describe_setting(key)}: {describe_setting(item)}' for key, item in value.items()) + '}'
+    if isinstance(value, (list, tuple)):
+        return '[' + ', '.join(describe_setting(item) for item in value) + ']'
+    return repr(value)
+
+
+def code_fingerprint(func, seen=None):
+    """
+    Hashes the source of a function and of the project code it uses: the
+    functions it calls, including those imported inside it or reached through
+    a module, the classes it uses with all their methods, and the functions and
+    classes held in settings such as the adapter registry.
+
+    Parameters:
+        func (callable): The stage function, or a project class.
+
+    Returns:
+        str: A hex digest that changes whenever the stage's code changes.
+    """
+    seen = set() if seen is None else seen
+    digest = hashlib.sha256()
+    digest.update(inspect.getsource(func).encode('utf-8'))
+    seen.add(func)
+
+    def follow(value):
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                follow(item)
+        elif isinstance(value, (types.FunctionType, type)) and value not in seen and is_project_function(value, func):
+            digest.update(code_fingerprint(value, seen).encode('utf-8'))
+
+    if isinstance(func, type):
+        # The methods and project base classes of a class
+        for base in func.__bases__:
+            follow(base)
+        for value in vars(func).values():
+            follow(getattr(value, '__func__', value))
+        return digest.hexdigest()
+
+    settings = (list, tuple, dict, str, int, float)
+    for value in func.__defaults__ or ():
+        # Defaults bound from settings, such as outlier thresholds
+        if isinstance(value, settings):
+            digest.update(describe_setting(value).encode('utf-8'))
+
+    names = sorted(referenced_names(func.__code__))
+    # Project modules imported inside the function or used as globals; the names taken from them are followed
+    modules = [value for value in func.__globals__.values()
+               if isinstance(value, types.ModuleType) and is_project_module(value.__name__)]
+    for name in names:
+        if is_project_module(name) and name not in func.__globals__ and importlib.util.find_spec(name) is not None:
+            modules.append(importlib.import_module(name))
+    for name in names:
+        for namespace in [func.__globals__] + [vars(module) for module in modules]:
+            value = namespace.get(name)
+            if isinstance(value, settings):
+                # Module-level settings such as column lists, and the code held in them
+                digest.update(describe_setting(value).encode('utf-8'))
+            follow(value)
+    return digest.hexdigest()
+
+
+def output_fingerprint(name, output):
+    """
+    Fingerprints stage outputs that come from outside the pipeline.
+
+    The load stage reads the ingest manifest, so its fingerprint follows the
+    hashes of the source workbooks rather than the loaded frames.
+    """
+    if name == 'load':
+        from dataset_ingest import INGEST_DIR, read_manifest
+        manifest = read_manifest(INGEST_DIR)
+        return json.dumps({source: entry['source_hash'] for source, entry in sorted(manifest.items())})
+    return ''
+
+
+def stage_fingerprint(name, input_fingerprints, code=None):
+    digest = hashlib.sha256()
+    digest.update(name.encode('utf-8'))
+    digest.update((code or '').encode('utf-8'))
+    for fingerprint in input_fingerprints:
+        digest.update(fingerprint.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def cache_path(name, fingerprint, cache_dir):
+    return os.path.join(cache_dir, f"{name}.{fingerprint[:16]}.pkl")
+
+
+def write_stage(name, fingerprint, output, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(name, fingerprint, cache_dir)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+    # Keep only the latest output of each stage
+    for stale in glob.glob(os.path.join(cache_dir, f"{name}.*.pkl")):
+        if stale != path:
+            os.remove(stale)
+
+
+class Pipeline:
+    """
+    Resolves and runs pipeline stages, reusing cached outputs.
+
+    Parameters:
+        cache_dir (str): Directory for cached stage outputs. None disables caching.
+        force (bool): Recompute every stage that is run.
+        output_dir (str): Directory the figures are written to.
+    """
+
+    def __init__(self, cache_dir=PIPELINE_CACHE_DIR, force=False, output_dir='.'):
+        self.cache_dir = cache_dir
+        self.force = force
+        self.output_dir = output_dir
+        self.outputs = {}
+        self.fingerprints = {}
+        self.computed = []
+        self.render_report = None
+
+    def fingerprint(self, name):
+        """
+        Returns the fingerprint of a stage's output without loading it, where possible.
+        """
+        if name in self.fingerprints:
+            return self.fingerprints[name]
+        func, upstream = STAGES[name]
+        if name == 'load':
+            # External inputs are only known once the sources are checked
+            self.run(name)
+            return self.fingerprints[name]
+        fingerprint = stage_fingerprint(name, [self.fingerprint(stage) for stage in upstream], code_fingerprint(func))
+        self.fingerprints[name] = fingerprint
+        return fingerprint
+
+    def run(self, name):
+        """
+        Returns a stage's output, computing it and its inputs only if needed.
+
+        Parameters:
+            name (str): The stage name.
+
+        Returns:
+            object: The stage output.
+        """
+        if name in self.outputs:
+            return self.outputs[name]
+        func, upstream = STAGES[name]
+
+        if name == 'load':
+            # Loading is cheap once the sources are ingested to Arrow
+            with span(name, cached=False) as record:
+                output = func()
+                if record is not None:
+                    record['rows'] = count_rows(output)
+            self.fingerprints[name] = stage_fingerprint(name, [output_fingerprint(name, output)], code_fingerprint(func))
+            self.outputs[name] = output
+            self.computed.append(name)
+            return output
+
+        fingerprint = self.fingerprint(name)
+        path = cache_path(name, fingerprint, self.cache_dir) if self.cache_dir else None
+        cached = bool(path and not self.force and os.path.exists(path))
+        inputs = [] if cached else [self.run(stage) for stage in upstream]
+        if cached:
+            # Inputs are not needed, except to publish their missing files
+            for stage in upstream:
+                if self.is_unpublished(stage):
+                    self.run(stage)
+
+        with span(name, cached=cached) as record:
+            if cached:
+                with open(path, 'rb') as f:
+                    output = pickle.load(f)
+            else:
+                output = func(*inputs)
+                if self.cache_dir:
+                    write_stage(name, fingerprint, output, self.cache_dir)
+                self.computed.append(name)
+            if record is not None:
+                record['rows'] = count_rows(output)
+
+        self.outputs[name] = output
+        if name in PUBLISHERS:
+            self.publish(name, output, computed=not cached)
+        return output
+
+    def is_unpublished(self, name):
+        """
+        Whether a file published by a stage or by one of its inputs is missing.
+        """
+        if name in PUBLISHERS and not all(os.path.exists(path) for path in PUBLISHERS[name][2]):
+            return True
+        return any(self.is_unpublished(stage) for stage in STAGES[name][1])
+
+    def publish(self, name, output, computed):
+        """
+        Writes the files of a stage's output when the stage was computed or one of them is missing.
+        """
+        func, upstream, paths = PUBLISHERS[name]
+        missing = [path for path in paths if not os.path.exists(path)]
+        if not computed and not missing:
+            return
+        with span('publish.' + name, category='publish', missing=len(missing)):
+            func(output, *[self.run(stage) for stage in upstream])
+
+    def render_fingerprint(self, figure):
+        plot, tables, kwargs = transformation.FIGURES[figure]
+        name = 'render.' + figure
+        return stage_fingerprint(name, [self.fingerprint('aggregate'), repr(tables), repr(sorted(kwargs.items()))],
+                                 code_fingerprint(plot) + code_fingerprint(transformation.render_figure))
+
+    def is_rendered(self, figure):
+        path = os.path.join(self.output_dir, figure + '.png')
+        if not self.cache_dir or self.force or not os.path.exists(path):
+            return False
+        return os.path.exists(cache_path('render.' + figure, self.render_fingerprint(figure), self.cache_dir))
+
+    def render(self, figures, workers=None):
+        """
+        Renders the figures that are not already up to date, in parallel.
+
+        Parameters:
+            figures (list): Names from dataset_transformation.FIGURES.
+            workers (int): Number of render processes; see dataset_render.render_figures.
+
+        Returns:
+            dict: The render report, or None if every figure was up to date.
+        """
+        from dataset_render import render_figures
+
+        stale = [figure for figure in figures if not self.is_rendered(figure)]
+        if not stale:
+            return None
+
+        reports = self.run('aggregate')
+        with span('render', category='render', figures=len(stale)):
+            report = render_figures(reports, stale, output_dir=self.output_dir, workers=workers)
+        for result in report['figures']:
+            name = 'render.' + result['figure']
+            emit({'name': name, 'category': 'render', 'start': result['started_at'], 'wall_seconds': result['seconds'],
+                  'cpu_seconds': result['cpu_seconds'], 'process_peak_rss_mb': result['peak_rss_mb'],
+                  'pid': result['pid'], 'tid': 0})
+            if self.cache_dir:
+                write_stage(name, self.render_fingerprint(result['figure']), result['path'], self.cache_dir)
+            self.computed.append(name)
+        self.render_report = report
+        return report
+
+
+def run_pipeline(stage=None, figures=None, cache_dir=PIPELINE_CACHE_DIR, force=False, output_dir='.', workers=None):
+    """
+    Runs the pipeline up to a stage, or renders figures.
+
+    Parameters:
+        stage (str): Run only up to this stage. If None, every figure is rendered.
+        figures (list): Figures to render. Defaults to all figures when no stage is given.
+        cache_dir (str): Directory for cached stage outputs. None disables caching.
+        force (bool): Recompute every stage that is run.
+        output_dir (str): Directory the figures are written to.
+        workers (int): Number of processes used to render figures.
+
+    Returns:
+        Pipeline: The pipeline, with the outputs and the list of stages it computed.
+    """
+    pipeline = Pipeline(cache_dir=cache_dir, force=force, output_dir=output_dir)
+    with span('pipeline', category='run', stage=stage):
+        if stage is not None:
+            pipeline.run(stage)
+        if figures is None and stage is None:
+            figures = list(transformation.FIGURES)
+        if figures:
+            pipeline.render(figures, workers=workers)
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the shelter dataset pipeline incrementally.')
+    parser.add_argument('--stage', choices=list(STAGES), help='Run the pipeline up to this stage')
+    parser.add_argument('--figure', action='append', choices=list(transformation.FIGURES),
+                        help='Render only this figure (may be repeated)')
+    parser.add_argument('--force', action='store_true', help='Recompute stages even if cached')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write cached stage outputs')
+    parser.add_argument('--output-dir', default='.', help='Directory for the figures')
+    parser.add_argument('--workers', type=int, help='Number of processes used to render figures')
+    parser.add_argument('--list', action='store_true', help='List the stages and figures')
+    parser.add_argument('--trace', default=TRACE_PATH,
+                        help='Write stage timings and memory to this file (.jsonl, or .json for Chrome trace format)')
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, upstream) in STAGES.items():
+            print(f"stage  {name:<10} <- {', '.join(upstream) or '(sources)'}")
+        for figure in transformation.FIGURES:
+            print(f"figure {figure}")
+        return
+
+    if args.trace:
+        enable_tracing(args.trace)
+
+    pipeline = run_pipeline(stage=args.stage, figures=args.figure, cache_dir=None if args.no_cache else PIPELINE_CACHE_DIR,
+                            force=args.force, output_dir=args.output_dir, workers=args.workers)
+    print(f"Computed: {', '.join(pipeline.computed) or 'nothing (all cached)'}")
+    if pipeline.render_report is not None:
+        from dataset_render import format_report
+        print(format_report(pipeline.render_report))
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,186 @@
+## Fast Column Profiling
+#
+# Reports the pandas dtype, Python value types, missing values, distinct values
+# and memory of every column. Python types are inferred from the pandas dtype
+# wherever it determines them; only object columns of mixed content are
+# inspected value by value, optionally on a sample. Columns are profiled in a
+# thread pool.
+
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Python type of the values of each numpy dtype kind
+KIND_TYPES = {
+    'f': float,
+    'i': int,
+    'u': int,
+    'b': bool,
+    'c': complex,
+}
+
+# Python type of every non-null value for object columns of one inferred type
+INFERRED_TYPES = {
+    'string': str,
+    'bytes': bytes,
+}
+
+
+def null_type_counts(values, null_count):
+    """
+    Splits the missing values of an object column into None and NaN.
+    """
+    if null_count == 0:
+        return {}
+    none_count = int(np.equal(values.to_numpy(), None).sum())
+    counts = {}
+    if none_count:
+        counts[type(None)] = none_count
+    if null_count - none_count:
+        counts[float] = null_count - none_count
+    return counts
+
+
+def python_type_counts(values, sample=None, random_state=0):
+    """
+    Counts the Python types of the values in a column, as values.apply(type) would.
+
+    Parameters:
+        values (pd.Series): The column.
+        sample (int): For object columns of mixed types, inspect only this many
+            values and scale the counts to the column length. None inspects all.
+        random_state (int): Seed used when sampling.
+
+    Returns:
+        dict: Python type to number of values.
+    """
+    n = len(values)
+    if n == 0:
+        return {}
+    dtype = values.dtype
+    null_count = int(values.isna().sum())
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        # Types of the observed categories; missing values are not counted
+        counts = Counter()
+        for category, count in values.value_counts(dropna=True).items():
+            if count:
+                counts[type(category)] += int(count)
+        return dict(counts)
+
+    if isinstance(dtype, np.dtype):
+        if dtype.kind in KIND_TYPES:
+            return {KIND_TYPES[dtype.kind]: n}
+        if dtype.kind == 'M':
+            counts = {pd.Timestamp: n - null_count, type(pd.NaT): null_count}
+            return {key: count for key, count in counts.items() if count}
+        if dtype.kind == 'm':
+            counts = {pd.Timedelta: n - null_count, type(pd.NaT): null_count}
+            return {key: count for key, count in counts.items() if count}
+
+    if isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in KIND_TYPES:
+        # Nullable integer, float and boolean columns
+        counts = {KIND_TYPES[dtype.kind]: n - null_count, type(pd.NA): null_count}
+        return {key: count for key, count in counts.items() if count}
+
+    if dtype == object:
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred in INFERRED_TYPES:
+            counts = {INFERRED_TYPES[inferred]: n - null_count}
+            counts.update(null_type_counts(values, null_count))
+            return {key: count for key, count in counts.items() if count}
+        if inferred == 'empty':
+            return null_type_counts(values, null_count)
+        if sample is not None and n > sample:
+            sampled = values.sample(sample, random_state=random_state).map(type).value_counts()
+            return {key: int(round(count * n / sample)) for key, count in sampled.items()}
+
+    # Mixed object columns and other extension types are inspected value by value
+    return {key: int(count) for key, count in values.map(type).value_counts().items()}
+
+
+def profile_column(values, compact_values=None, sample=None):
+    """
+    Profiles a single column.
+
+    Parameters:
+        values (pd.Series): The column.
+        compact_values (pd.Series): The same column under the compact dtype schema, if any.
+        sample (int): See python_type_counts.
+
+    Returns:
+        dict: The column profile.
+    """
+    profile = {
+        'pandas_dtype': str(values.dtype),
+        'python_types': python_type_counts(values, sample=sample),
+        'nan_count': values.isna().sum(),
+        'unique_values': values.nunique(),
+        'memory_bytes': values.memory_usage(deep=True, index=False),
+    }
+    if compact_values is not None:
+        profile['compact_dtype'] = str(compact_values.dtype)
+        profile['compact_memory_bytes'] = compact_values.memory_usage(deep=True, index=False)
+    return profile
+
+
+def profile_dtypes(df, compact_df=None, workers=None, sample=None):
+    """
+    Profiles every column of a DataFrame, in parallel.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to profile.
+        compact_df (pd.DataFrame): The same frame under the compact dtype schema, if any.
+        workers (int): Number of threads. Defaults to the number of CPUs.
+        sample (int): See python_type_counts.
+
+    Returns:
+        dict: Column name to column profile, in column order.
+    """
+    def profile(position):
+        compact_values = compact_df.iloc[:, position] if compact_df is not None else None
+        return profile_column(df.iloc[:, position], compact_values, sample=sample)
+
+    positions = range(len(df.columns))
+    workers = workers or min(len(df.columns), os.cpu_count() or 1) or 1
+    if workers <= 1:
+        profiles = [profile(position) for position in positions]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            profiles = list(pool.map(profile, positions))
+    return dict(zip(df.columns, profiles))
+
+
+def profile_to_frame(profiles):
+    """
+    Converts column profiles to a DataFrame with one row per column.
+    """
+    rows = []
+    for column, profile in profiles.items():
+        row = dict(profile)
+        row['python_types'] = ', '.join(f"{key.__name__}: {count}" for key, count in profile['python_types'].items())
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.Index(list(profiles), name='column'))
+
+
+def profile_to_json(profiles, path=None):
+    """
+    Serializes column profiles to JSON, writing them to path if given.
+    """
+    serializable = {
+        str(column): {
+            key: ({type_.__name__: int(count) for type_, count in value.items()} if key == 'python_types'
+                  else value if isinstance(value, str) else int(value))
+            for key, value in profile.items()
+        }
+        for column, profile in profiles.items()
+    }
+    text = json.dumps(serializable, indent=2)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
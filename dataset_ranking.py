@@ -0,0 +1,303 @@
+## Shelter Ranking Index
+#
+# Ranks shelters by any measure of the aggregation cube without regrouping it.
+# The index holds, for each shelter, state and duplicate flag, the total of
+# every ranked measure in each Data Year and its running (cumulative) total
+# across the years, plus the order of all shelters by each measure over all
+# years. The total of a year range is then the difference of two cumulative
+# totals, so a top-K query for any measure, states and years is a handful of
+# array operations over the shelters. The index is saved next to the cube and
+# updated with the cube parts of new reports as they arrive.
+#
+# Usage:
+#   python dataset_ranking.py                                  # top 10 shelters by Total Animals
+#   python dataset_ranking.py --top 25 --measure "Canine adoption" --years 2021 2023 --state GA
+#   python dataset_ranking.py --list
+
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_aggregation import CUBE_KEYS, CUBE_PATH, load_cube
+
+RANKING_PATH = os.environ.get('SHELTER_RANKING_PATH', os.path.join('aggregates', 'shelter_ranking.pkl'))
+
+# The rows of the index; every shelter is ranked over the rows it has
+ENTITY_KEYS = ['Shelter Name', 'State', 'Duplicate']
+
+
+def build_ranking(cube, measures=None):
+    """
+    Builds the ranking index of a cube.
+
+    Parameters:
+        cube (pd.DataFrame): The cube returned by build_cube, or any frame with
+            the cube keys and measure columns.
+        measures (dict): Ranked measure -> the cube columns it adds up. Defaults
+            to each measure column of the cube on its own.
+
+    Returns:
+        dict: The entities (one row per Shelter Name, State and Duplicate flag,
+        with the code of their shelter), the sorted shelter names and years, the
+        measure names, the yearly and cumulative totals (entities x years x
+        measures, with a last slot for rows without a numeric year), which
+        cells have reports, and the shelter codes ranked by each measure.
+    """
+    if measures is None:
+        measures = {column: [column] for column in cube.columns if column not in CUBE_KEYS}
+    # Reports without a shelter name cannot be ranked
+    cube = cube[cube['Shelter Name'].notna()]
+
+    years = pd.to_numeric(cube['Data Year'], errors='coerce').astype('float64')
+    year_values = np.sort(pd.unique(years.dropna()))
+    slots = np.searchsorted(year_values, years.fillna(np.inf).to_numpy())
+
+    keys = cube[ENTITY_KEYS].astype({'Shelter Name': object, 'State': object, 'Duplicate': bool})
+    codes = keys.groupby(ENTITY_KEYS, dropna=False, sort=True).ngroup().to_numpy()
+    entities = keys.iloc[np.unique(codes, return_index=True)[1]].reset_index(drop=True)
+    shelters, entities['Shelter'] = np.unique(entities['Shelter Name'].astype(str), return_inverse=True)
+
+    values = np.column_stack([cube[columns].to_numpy(dtype='float64').sum(axis=1) for columns in measures.values()])
+    totals = np.zeros((len(entities), len(year_values) + 1, len(measures)))
+    np.add.at(totals, (codes, slots), values)
+    reported = np.zeros((len(entities), len(year_values) + 1), dtype=bool)
+    reported[codes, slots] = True
+
+    index = {
+        'entities': entities,
+        'shelters': shelters,
+        'years': year_values,
+        'measures': list(measures),
+        'totals': totals,
+        'cumulative': totals.cumsum(axis=1),
+        'reported': reported,
+    }
+    # The ranking of each measure over all years, without duplicates, as most queries ask for it
+    index['order'] = {}
+    for measure in index['measures']:
+        ranked, present = shelter_totals(index, measure)
+        index['order'][measure] = rank(ranked, np.flatnonzero(present))
+    return index
+
+
+def rank(values, candidates, k=None):
+    """
+    Orders candidate shelters by decreasing value; ties keep the order of the
+    shelter names, as nlargest(keep='first') does on a sorted index.
+
+    Parameters:
+        values (np.ndarray): The value of every shelter.
+        candidates (np.ndarray): The codes of the shelters to rank.
+        k (int): Only rank the first k. None ranks every candidate.
+
+    Returns:
+        np.ndarray: Shelter codes, best first.
+    """
+    if k is not None and k < len(candidates):
+        # Only the shelters at least as large as the kth largest value need sorting
+        threshold = np.partition(values[candidates], len(candidates) - k)[len(candidates) - k]
+        candidates = candidates[values[candidates] >= threshold]
+    ordered = candidates[np.lexsort((candidates, -values[candidates]))]
+    return ordered if k is None else ordered[:k]
+
+
+def year_slots(index, years=None):
+    """
+    Returns the first and last slots of a year range; all slots, including
+    rows without a numeric year, when years is None.
+    """
+    if years is None:
+        return 0, len(index['years']) + 1
+    return np.searchsorted(index['years'], years[0], 'left'), np.searchsorted(index['years'], years[1], 'right')
+
+
+def entity_mask(index, states=None, include_duplicates=False):
+    """
+    Selects the entities of some states, without duplicates unless asked for.
+    """
+    entities = index['entities']
+    mask = np.ones(len(entities), dtype=bool)
+    if states is not None:
+        mask &= entities['State'].isin(states).to_numpy()
+    if not include_duplicates:
+        mask &= ~entities['Duplicate'].to_numpy(dtype=bool)
+    return mask
+
+
+def shelter_totals(index, measure, years=None, states=None, include_duplicates=False):
+    """
+    Totals a measure for every shelter over a year range and set of states.
+
+    Parameters:
+        index (dict): The ranking index.
+        measure (str): The ranked measure.
+        years (tuple): Inclusive (first, last) year range, or None for all rows.
+        states (list): States to keep, or None for all states.
+        include_duplicates (bool): Count the rows annotated as duplicates ('R').
+
+    Returns:
+        tuple: The total of each shelter and whether it has any report in the selection.
+    """
+    if measure not in index['measures']:
+        raise KeyError(f"{measure!r} is not ranked; choose one of {', '.join(index['measures'])}")
+    cumulative = index['cumulative'][:, :, index['measures'].index(measure)]
+    first, last = year_slots(index, years)
+    if last > first:
+        values = cumulative[:, last - 1] - (cumulative[:, first - 1] if first > 0 else 0)
+    else:
+        values = np.zeros(len(cumulative))
+    mask = entity_mask(index, states, include_duplicates) & index['reported'][:, first:last].any(axis=1)
+
+    codes = index['entities']['Shelter'].to_numpy()[mask]
+    count = len(index['shelters'])
+    return np.bincount(codes, weights=values[mask], minlength=count), np.bincount(codes, minlength=count) > 0
+
+
+def top_k(index, k=10, measure='Total Animals', years=None, states=None, include_duplicates=False):
+    """
+    Returns the k shelters with the largest total of a measure.
+
+    Parameters:
+        index (dict): The ranking index.
+        k (int): Number of shelters.
+        measure (str): The ranked measure.
+        years (tuple): Inclusive (first, last) year range, or None for all rows.
+        states (list): States to keep, or None for all states.
+        include_duplicates (bool): Count the rows annotated as duplicates ('R').
+
+    Returns:
+        pd.Series: The totals of the top shelters by Shelter Name, largest first.
+    """
+    values, present = shelter_totals(index, measure, years, states, include_duplicates)
+    if years is None and states is None and not include_duplicates:
+        codes = index['order'][measure][:k]
+    else:
+        codes = rank(values, np.flatnonzero(present), k)
+    return pd.Series(values[codes], index=pd.Index(index['shelters'][codes], name='Shelter Name'), name=measure)
+
+
+def yearly_totals(index, shelters, measure='Total Animals', years=None, states=None, include_duplicates=False):
+    """
+    Tabulates a measure by shelter and year for some shelters.
+
+    Returns:
+        pd.DataFrame: One row per shelter in the given order and one column per
+        year with reports in the selection (of any shelter); years in which a
+        shelter has no report are missing.
+    """
+    first, last = year_slots(index, years)
+    last = min(last, len(index['years']))
+    mask = entity_mask(index, states, include_duplicates)
+    reported = index['reported'][:, first:last] & mask[:, None]
+
+    codes = np.searchsorted(index['shelters'], np.asarray(shelters, dtype=str))
+    rows = np.full(len(index['shelters']), -1)
+    rows[codes] = np.arange(len(codes))
+    entity_rows = rows[index['entities']['Shelter'].to_numpy()]
+
+    selected = mask & (entity_rows >= 0)
+    values = np.zeros((len(codes), last - first))
+    counts = np.zeros((len(codes), last - first), dtype='int64')
+    totals = index['totals'][:, first:last, index['measures'].index(measure)]
+    np.add.at(values, entity_rows[selected], totals[selected])
+    np.add.at(counts, entity_rows[selected], reported[selected])
+
+    columns = reported.any(axis=0)
+    table = pd.DataFrame(np.where(counts > 0, values, np.nan)[:, columns],
+                         index=pd.Index(list(shelters), name='Shelter Name'),
+                         columns=pd.Index(index['years'][first:last][columns], name='Data Year'))
+    return table
+
+
+def ranking_rows(index):
+    """
+    Lays out the reported cells of an index as cube rows with one column per measure.
+    """
+    entity, slot = np.nonzero(index['reported'])
+    rows = index['entities'].iloc[entity][ENTITY_KEYS].reset_index(drop=True)
+    years = np.append(index['years'], np.nan) if len(index['years']) else np.array([np.nan])
+    rows['Data Year'] = years[slot]
+    for position, measure in enumerate(index['measures']):
+        rows[measure] = index['totals'][entity, slot, position]
+    return rows
+
+
+def merge_rankings(index, update):
+    """
+    Adds the index of new reports (built over the same measures) to an index.
+    """
+    if index is None:
+        return update
+    rows = pd.concat([ranking_rows(index), ranking_rows(update)], ignore_index=True)
+    return build_ranking(rows, {measure: [measure] for measure in index['measures']})
+
+
+def drop_shelters(index, names):
+    """
+    Removes some shelters from an index, so they can be added again from their rebuilt reports.
+    """
+    rows = ranking_rows(index)
+    return build_ranking(rows[~rows['Shelter Name'].isin(set(names))],
+                         {measure: [measure] for measure in index['measures']})
+
+
+def save_ranking(index, path=RANKING_PATH):
+    """
+    Pickles the ranking index.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_ranking(path=RANKING_PATH, cube_path=CUBE_PATH):
+    """
+    Reads the ranking index, rebuilding it from the cube if it is missing or
+    older than the cube.
+    """
+    if os.path.exists(path) and not (os.path.exists(cube_path) and os.path.getmtime(cube_path) > os.path.getmtime(path)):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    if not os.path.exists(cube_path):
+        raise FileNotFoundError(f"No cube at {cube_path}; run dataset_transformation.py first")
+    from dataset_transformation import ranking_measures
+
+    cube = load_cube(cube_path)
+    index = build_ranking(cube, {name: columns for name, columns in ranking_measures.items()
+                                 if set(columns) <= set(cube.columns)})
+    save_ranking(index, path)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank shelters by a measure of the aggregation cube.')
+    parser.add_argument('--top', type=int, default=10, help='Number of shelters')
+    parser.add_argument('--measure', default='Total Animals', help='Measure to rank by')
+    parser.add_argument('--years', type=int, nargs=2, metavar=('FIRST', 'LAST'), help='Inclusive range of Data Years')
+    parser.add_argument('--state', action='append', help='Only rank shelters in this state (may be repeated)')
+    parser.add_argument('--include-duplicates', action='store_true', help="Count rows annotated as duplicates ('R')")
+    parser.add_argument('--list', action='store_true', help='List the ranked measures')
+    args = parser.parse_args()
+
+    index = load_ranking()
+    if args.list:
+        print('\n'.join(index['measures']))
+        return
+
+    start = time.perf_counter()
+    top = top_k(index, args.top, args.measure, years=args.years, states=args.state,
+                include_duplicates=args.include_duplicates)
+    print(f"Top {len(top)} of {len(index['shelters'])} shelters in {(time.perf_counter() - start) * 1000:.2f} ms")
+    print(top.to_string())
+
+if __name__=='__main__':
+
+    main()
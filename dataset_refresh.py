@@ -0,0 +1,376 @@
+## Incremental Refresh
+#
+# Updates the aggregation cube, the outlier baselines and the outlier audit for
+# a new release of the cumulative Georgia export without reprocessing its whole
+# history. Each report is keyed by its Shelter Name, Report Period Start and
+# Report Period End (numbered where a key repeats) and fingerprinted by a hash
+# of its values. Compared with the keys saved by the previous run:
+#   - shelters that only gained reports after their earlier ones have the new
+#     reports annotated, merged, cleaned, scored against baselines refitted
+#     with them, and added to the cube; earlier reports keep their repairs
+#   - shelters with changed or removed reports, and new shelters, are rebuilt
+#     from all their reports
+# The shelter ranking index and the partitioned combined dataset are updated
+# from the same parts. With SHELTER_DUPLICATES=auto or both, duplicates are
+# detected in the whole export and applied to the reports processed. A change
+# to the annotations, the Best Friends data, the duplicate mode or the cube
+# measures rebuilds everything, as does --full.
+#
+# Usage:
+#   python dataset_refresh.py                   # apply the current export
+#   python dataset_refresh.py --full            # rebuild the state from scratch
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_aggregation import CUBE_PATH, build_cube, combine_cubes, load_cube, save_cube
+from dataset_duplicates import DUPLICATE_MODE, apply_duplicates, check_mode, detect_duplicates, duplicate_annotations
+from dataset_identity import (annotation_lookup, join_annotations, join_best_friends, load_shelter_index,
+                              occurrences, save_shelter_index, shelter_ids, update_shelter_index)
+from dataset_ingest import SOURCES, INGEST_DIR
+from dataset_partitions import COMBINED_PATH, CombinedWriter, read_combined
+from dataset_outliers import (AUDIT_COLUMNS, OUTLIER_AUDIT_PATH, OUTLIER_COLUMNS, fit_baselines, load_audit,
+                              load_baselines, merge_baselines, repair_outliers, save_audit, save_baselines)
+from dataset_ranking import (RANKING_PATH, build_ranking, drop_shelters, load_ranking, merge_rankings,
+                             save_ranking)
+from dataset_transformation import CACHE_DIR, clean_combined, cube_measures, ranking_measures
+
+REFRESH_DIR = os.environ.get('SHELTER_REFRESH_DIR', 'aggregates')
+REPORT_KEYS_FILE = 'report_keys.parquet'
+BASELINES_FILE = 'outlier_baselines.pkl'
+STATE_FILE = 'refresh_state.json'
+
+# Bump when the processing of a report changes so the next refresh rebuilds everything
+REFRESH_VERSION = 2
+
+REPORT_KEY = ['Shelter Name', 'Report Period Start', 'Report Period End']
+
+
+def frame_hash(df):
+    """
+    Hashes the values of a DataFrame.
+    """
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def report_keys(georgia):
+    """
+    Keys and fingerprints each report of the Georgia export.
+
+    Returns:
+        pd.DataFrame: The key columns, the number of the report among reports
+        with the same key ('Occurrence') and a hash of its values ('Row Hash').
+    """
+    keys = georgia[REPORT_KEY].copy()
+    keys['Occurrence'] = keys.groupby(REPORT_KEY, dropna=False).cumcount()
+    keys['Row Hash'] = pd.util.hash_pandas_object(georgia, index=False).to_numpy()
+    return keys
+
+
+def diff_reports(previous, current, previous_ids, current_ids):
+    """
+    Classifies the shelters of a new export by how their reports changed.
+
+    Parameters:
+        previous, current (pd.DataFrame): report_keys of the last run and of the new export.
+        previous_ids, current_ids (pd.Series): The shelter ID of each of their rows.
+
+    Returns:
+        dict: The current rows that are new ('added', a boolean array), the
+        shelter IDs to rebuild from all their reports ('rebuild') and those
+        that only gained reports ('append'), and counts of added, changed and
+        removed reports.
+    """
+    on = REPORT_KEY + ['Occurrence']
+    merged = pd.merge(current[on + ['Row Hash']].assign(**{'Shelter ID': current_ids.to_numpy(), 'Row': np.arange(len(current))}),
+                      previous[on + ['Row Hash']].assign(**{'Previous ID': previous_ids.to_numpy()}),
+                      on=on, how='outer', suffixes=('', ' Previous'), indicator=True)
+    added = merged[merged['_merge'] == 'left_only']
+    removed = merged[merged['_merge'] == 'right_only']
+    both = merged[merged['_merge'] == 'both']
+    changed = both[both['Row Hash'] != both['Row Hash Previous']]
+
+    rebuild = set(changed['Shelter ID']) | set(removed['Previous ID'])
+    # New shelters may match Best Friends rows that were kept on their own
+    rebuild |= set(added['Shelter ID']) - set(previous_ids)
+
+    # New reports must follow the earlier reports of their shelter, or the
+    # annotations of the later reports move; such shelters are rebuilt
+    added_rows = np.zeros(len(current), dtype=bool)
+    added_rows[added['Row'].astype('int64').to_numpy()] = True
+    position = occurrences(current_ids)
+    earlier = previous_ids.value_counts()
+    late = position >= current_ids.map(earlier).fillna(0)
+    rebuild |= set(current_ids[added_rows & ~late.to_numpy()])
+
+    append = set(added['Shelter ID']) - rebuild
+    return {
+        'added': added_rows,
+        'rebuild': rebuild,
+        'append': append,
+        'counts': {'added': len(added), 'changed': len(changed), 'removed': len(removed)},
+    }
+
+
+def rebuild_shelters(georgia, georgia_ids, lookup, best_friends, index, ids, measures, detected=None,
+                     duplicates=DUPLICATE_MODE):
+    """
+    Processes every report of some shelters, as the batch pipeline does for all of them.
+    detected holds the duplicate annotations detected in the whole export, applied by
+    the duplicate mode (see dataset_duplicates.py).
+
+    Returns:
+        tuple: The shelters' cube, baselines, audit table and combined rows; None for each if they have no rows.
+    """
+    shelters = georgia_ids.isin(ids).to_numpy()
+    rows = georgia[shelters].reset_index(drop=True)
+    partners = best_friends[shelter_ids(best_friends['Shelter Name'], index).isin(ids).to_numpy()]
+    if rows.empty and partners.empty:
+        return None, None, None, None
+
+    rows, _ = join_annotations(rows, lookup, index)
+    if detected is not None:
+        rows = apply_duplicates(rows, detected[shelters], duplicates)
+    combined, _ = join_best_friends(rows, partners, index, how='outer')
+    combined = clean_combined(combined)
+    model = fit_baselines(combined)
+    combined, audit = repair_outliers(combined, model)
+    return build_cube(combined, measures), model, audit, combined
+
+
+def append_reports(georgia, georgia_ids, added, lookup, best_friends, index, ids, offsets, measures, detected=None,
+                   duplicates=DUPLICATE_MODE):
+    """
+    Processes the new reports of shelters that only gained reports.
+
+    The shelters' baselines are refitted on all their reports; only the new
+    reports are scored against them.
+
+    Parameters:
+        offsets (dict): Number of earlier reports of each shelter, for the annotation join.
+        detected (np.ndarray): Duplicate annotations detected in the whole export, or None.
+        duplicates (str): The duplicate mode detected is applied by.
+
+    Returns:
+        tuple: The cube of the new reports, the shelters' baselines, the audit table and the combined rows.
+    """
+    shelters = georgia_ids.isin(ids).to_numpy()
+    # clean_combined zero-fills the counts the batch pipeline fits on
+    history = georgia[shelters]
+    model = fit_baselines(history.fillna({column: 0 for column in OUTLIER_COLUMNS if column in history.columns}))
+    rows = georgia[shelters & added].reset_index(drop=True)
+    rows, _ = join_annotations(rows, lookup, index, offsets=dict(offsets))
+    if detected is not None:
+        rows = apply_duplicates(rows, detected[shelters & added], duplicates)
+    combined, _ = join_best_friends(rows, best_friends, index, how='left')
+    combined = clean_combined(combined)
+    combined, audit = repair_outliers(combined, model)
+    return build_cube(combined, measures), model, audit, combined
+
+
+def read_state(state_dir=REFRESH_DIR):
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(state, state_dir=REFRESH_DIR):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, STATE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def refresh(georgia, annotations, best_friends, index, state_dir=REFRESH_DIR, cube_path=CUBE_PATH,
+            audit_path=OUTLIER_AUDIT_PATH, measures=cube_measures, full=False, ranking_path=RANKING_PATH,
+            combined_path=COMBINED_PATH, duplicates=DUPLICATE_MODE):
+    """
+    Brings the saved cube, baselines and audit up to date with a Georgia export.
+
+    Parameters:
+        georgia (pd.DataFrame): The typed Georgia export.
+        annotations (pd.DataFrame): The Shelter Name Annotations.
+        best_friends (pd.DataFrame): The Best Friends Animal Society data.
+        index (dict): The shelter index; new shelters are added to it.
+        state_dir (str): Directory of the report keys, baselines and refresh state.
+        cube_path (str): The cube to update.
+        audit_path (str): The outlier audit table to update.
+        measures (list): The cube measures.
+        full (bool): Rebuild everything instead of applying the changes.
+        ranking_path (str): The shelter ranking index to update.
+        combined_path (str): The partitioned combined dataset to update.
+        duplicates (str): How duplicates are annotated (see dataset_duplicates.py).
+
+    Returns:
+        tuple: The updated cube and a summary of what was processed.
+    """
+    for frame in [georgia, annotations, best_friends]:
+        update_shelter_index(index, frame['Shelter Name'])
+    sources = {'version': REFRESH_VERSION, 'annotations': frame_hash(annotations),
+               'best_friends': frame_hash(best_friends), 'measures': list(measures), 'duplicates': duplicates}
+
+    georgia = georgia.reset_index(drop=True)
+    georgia_ids = shelter_ids(georgia['Shelter Name'], index)
+    # Duplicates are detected in the whole export, as a report may repeat one of another shelter.
+    # The detected annotation is part of each report's fingerprint, so a report whose annotation
+    # changes with other shelters' reports has its shelter rebuilt.
+    check_mode(duplicates)
+    detected = None
+    if duplicates != 'manual':
+        detected = duplicate_annotations(georgia, detect_duplicates(georgia)).to_numpy()
+    keys = report_keys(georgia if detected is None else georgia.assign(**{'Detected Annotation': detected}))
+    lookup = annotation_lookup(annotations, index)
+
+    state = read_state(state_dir)
+    keys_path = os.path.join(state_dir, REPORT_KEYS_FILE)
+    baselines_path = os.path.join(state_dir, BASELINES_FILE)
+    incremental = (not full and state is not None and state['sources'] == sources
+                   and all(os.path.exists(path) for path in [keys_path, baselines_path, cube_path, combined_path]))
+
+    if incremental:
+        previous = pd.read_parquet(keys_path)
+        previous_ids = shelter_ids(previous['Shelter Name'], index)
+        diff = diff_reports(previous, keys, previous_ids, georgia_ids)
+        cube, model, audit = load_cube(cube_path), load_baselines(baselines_path), load_audit(audit_path)
+        rebuild, append = diff['rebuild'], diff['append']
+
+        # Drop what the rebuilt shelters contributed
+        rebuilt = shelter_ids(cube['Shelter Name'], index).isin(rebuild).to_numpy()
+        rebuilt_names = set(cube.loc[rebuilt, 'Shelter Name'])
+        cube = cube[~rebuilt]
+        kept = read_combined(combined_path, include_duplicates=True)
+        kept = kept[~shelter_ids(kept['Shelter Name'], index).isin(rebuild).to_numpy()]
+        audit = audit[~shelter_ids(audit['Shelter Name'], index).isin(rebuild).to_numpy()]
+        offsets = previous_ids.value_counts().to_dict()
+        counts = diff['counts']
+    else:
+        cube, model, audit = None, None, pd.DataFrame(columns=AUDIT_COLUMNS)
+        kept = None
+        rebuild = set(georgia_ids) | set(shelter_ids(best_friends['Shelter Name'], index))
+        append = set()
+        counts = {'added': len(georgia), 'changed': 0, 'removed': 0}
+
+    cubes, audits, combined = [cube], [audit], [kept]
+    if rebuild:
+        part, update, part_audit, rows = rebuild_shelters(georgia, georgia_ids, lookup, best_friends, index, rebuild,
+                                                          measures, detected, duplicates)
+        if part is not None:
+            cubes.append(part)
+            audits.append(part_audit)
+            combined.append(rows)
+            model = merge_baselines(model, update)
+    if append:
+        part, update, part_audit, rows = append_reports(georgia, georgia_ids, diff['added'], lookup, best_friends,
+                                                        index, append, offsets, measures, detected, duplicates)
+        cubes.append(part)
+        audits.append(part_audit)
+        combined.append(rows)
+        model = merge_baselines(model, update)
+
+    cube = combine_cubes([part for part in cubes if part is not None and len(part)], measures)
+    # The ranking index takes the new cube parts; everything is ranked again after a full refresh
+    ranked = {name: columns for name, columns in ranking_measures.items() if set(columns) <= set(measures)}
+    parts = [part for part in cubes[1:] if part is not None and len(part)]
+    if incremental and os.path.exists(ranking_path):
+        ranking = drop_shelters(load_ranking(ranking_path, cube_path), rebuilt_names)
+        for part in parts:
+            ranking = merge_rankings(ranking, build_ranking(part, ranked))
+    else:
+        ranking = build_ranking(cube, ranked)
+    # Audit rows number the rows of the frame each part was repaired in
+    audit = pd.concat([part for part in audits if len(part)] or [audits[0]], ignore_index=True)
+
+    # The combined dataset keeps the rows of the other shelters and takes the new rows as parts
+    writer = CombinedWriter(combined_path)
+    for rows in combined:
+        if rows is not None:
+            writer.write(rows)
+    writer.close()
+    save_cube(cube, cube_path)
+    save_ranking(ranking, ranking_path)
+    save_audit(audit, audit_path)
+    if model is not None:
+        save_baselines(model, baselines_path)
+    os.makedirs(state_dir, exist_ok=True)
+    keys.to_parquet(keys_path, index=False)
+    write_state({'sources': sources, 'rows': len(georgia), 'updated': time.time()}, state_dir)
+
+    summary = dict(counts, mode='incremental' if incremental else 'full', rows=len(georgia),
+                   rebuilt_shelters=len(rebuild), appended_shelters=len(append))
+    return cube, summary
+
+
+def run_refresh(sources=None, full=False, figures=None, output_dir='.', workers=None, offline=False):
+    """
+    Loads the sources, refreshes the cube and renders the figures.
+
+    Returns:
+        dict: The cube, the report tables, the render report and a summary.
+    """
+    from dataset_ingest import ingest_sources
+    from dataset_transformation import aggregate_reports
+
+    start = time.perf_counter()
+    frames = ingest_sources(sources or SOURCES, output_dir=INGEST_DIR, cache_dir=CACHE_DIR, offline=offline)
+    failed = [name for name, frame in frames.items() if frame is None]
+    if failed:
+        raise RuntimeError(f"Failed to load data: {', '.join(failed)}")
+    loaded = time.perf_counter()
+
+    index = load_shelter_index()
+    cube, summary = refresh(frames['georgia'], frames['annotations'], frames['best_friends'], index, full=full)
+    save_shelter_index(index)
+    reports = aggregate_reports(cube)
+    summary['load_seconds'] = loaded - start
+    summary['refresh_seconds'] = time.perf_counter() - loaded
+
+    render_report = None
+    if figures is None or figures:
+        from dataset_render import render_figures
+        render_report = render_figures(reports, figures, output_dir=output_dir, workers=workers)
+
+    return {'cube': cube, 'reports': reports, 'render_report': render_report, 'summary': summary}
+
+
+def format_summary(summary):
+    """
+    Formats a refresh summary as one line.
+    """
+    return (f"{summary['mode'].capitalize()} refresh of {summary['rows']} reports: {summary['added']} added, "
+            f"{summary['changed']} changed, {summary['removed']} removed; {summary['rebuilt_shelters']} shelters "
+            f"rebuilt, {summary['appended_shelters']} appended (load {summary['load_seconds']:.2f}s, "
+            f"refresh {summary['refresh_seconds']:.2f}s); cube saved to {CUBE_PATH}")
+
+
+def main():
+    from dataset_render import format_report
+    from dataset_transformation import FIGURES
+
+    parser = argparse.ArgumentParser(description='Apply a new release of the Georgia export to the saved aggregates.')
+    parser.add_argument('--full', action='store_true', help='Rebuild the aggregates from scratch')
+    parser.add_argument('--figure', action='append', choices=list(FIGURES),
+                        help='Render only this figure (may be repeated)')
+    parser.add_argument('--no-figures', action='store_true', help='Only update the aggregates')
+    parser.add_argument('--output-dir', default='.', help='Directory for the figures')
+    parser.add_argument('--workers', type=int, help='Number of processes used to render figures')
+    parser.add_argument('--offline', action='store_true', help='Do not contact remote sources')
+    args = parser.parse_args()
+
+    result = run_refresh(full=args.full, figures=[] if args.no_figures else args.figure, output_dir=args.output_dir,
+                         workers=args.workers, offline=args.offline)
+    print(format_summary(result['summary']))
+    if result['render_report'] is not None:
+        print(format_report(result['render_report']))
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,115 @@
+## Parallel Figure Rendering
+#
+# Renders the figures in dataset_transformation.FIGURES from the precomputed
+# report tables in a pool of worker processes using the non-interactive Agg
+# backend. Only the workers switch to Agg, so the caller's backend and open
+# figures are left alone. Every figure is closed after it is saved, and the
+# total render time and peak resident memory of the workers are reported.
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb(who='self'):
+    """
+    Returns the peak resident set size in MB of this process ('self') or of
+    its largest finished child ('children'), or None where unsupported.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+def use_agg_backend():
+    # Worker initializer; never called in the process that renders the figures from
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def render_one(name, tables, output_dir):
+    """
+    Renders a single figure and closes it. Runs inside a worker process.
+
+    Parameters:
+        name (str): The figure name.
+        tables (dict): The report tables the figure needs.
+        output_dir (str): Directory the PNG is written to.
+
+    Returns:
+        dict: The figure name and path, the start time, wall and CPU seconds, and
+        the peak RSS in MB and process ID of the worker.
+    """
+    from dataset_transformation import render_figure
+
+    started_at, start, cpu = time.time(), time.perf_counter(), time.process_time()
+    path = render_figure(name, tables, output_dir=output_dir)
+    return {
+        'figure': name,
+        'path': path,
+        'started_at': started_at,
+        'seconds': time.perf_counter() - start,
+        'cpu_seconds': time.process_time() - cpu,
+        'peak_rss_mb': peak_rss_mb(),
+        'pid': os.getpid(),
+    }
+
+
+def render_figures(reports, figures=None, output_dir='.', workers=None):
+    """
+    Renders figures from the aggregated report tables in parallel.
+
+    Parameters:
+        reports (dict): The tables returned by aggregate_reports.
+        figures (list): Figure names to render. Defaults to all figures.
+        output_dir (str): Directory the PNGs are written to.
+        workers (int): Number of worker processes. Even one figure is rendered in a
+            worker, so this process keeps its matplotlib backend.
+
+    Returns:
+        dict: Per-figure results plus the total render time and peak worker RSS.
+    """
+    from dataset_transformation import FIGURES
+
+    figures = list(FIGURES) if figures is None else list(figures)
+    workers = workers or min(len(figures), os.cpu_count() or 1)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Send each worker only the tables its figure needs
+    jobs = [(name, {table: reports[table] for table in FIGURES[name][1]}) for name in figures]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs))), initializer=use_agg_backend) as pool:
+        futures = [pool.submit(render_one, name, tables, output_dir) for name, tables in jobs]
+        results = [future.result() for future in futures]
+    total_seconds = time.perf_counter() - start
+
+    peaks = [result['peak_rss_mb'] for result in results if result['peak_rss_mb'] is not None]
+    return {
+        'figures': results,
+        'workers': workers,
+        'total_seconds': total_seconds,
+        'peak_rss_mb': max(peaks) if peaks else None,
+    }
+
+
+def format_report(report):
+    """
+    Formats a render report as a short summary.
+    """
+    peak = report['peak_rss_mb']
+    peak_text = f"{peak:,.0f} MB" if peak is not None else "n/a"
+    lines = [f"Rendered {len(report['figures'])} figures with {report['workers']} worker(s) "
+             f"in {report['total_seconds']:.2f}s (peak RSS {peak_text})"]
+    for result in report['figures']:
+        lines.append(f"  {result['figure']:<34} {result['seconds']:6.2f}s")
+    return '\n'.join(lines)
@@ -0,0 +1,131 @@
+## Compact Dtype Schema for the Combined Shelter Frame
+#
+# Declares the intake and outcome count columns of the Georgia and Best Friends
+# data and the name/state/annotation columns. compact_frame() stores each count
+# column as the smallest nullable integer type that holds its values, and the
+# name/state/annotation columns as categoricals.
+
+import numpy as np
+import pandas as pd
+
+# Georgia Animal Shelter Database counts
+GEORGIA_INTAKE_COLUMNS = [
+    'Canine stray at large', 'Feline stray at large',
+    'Canine relinquished by owner', 'Feline relinquished by owner',
+    'Canine intake owner intended euthanasia', 'Feline intake owner intended euthanasia',
+    'Canine transferred in from agency', 'Feline transferred in from agency',
+    'Canine other intakes', 'Feline other intakes',
+]
+
+GEORGIA_OUTCOME_COLUMNS = [
+    'Canine adoption', 'Feline adoption',
+    'Canine returned to owner', 'Feline returned to owner',
+    'Canine transferred to another agency', 'Feline transferred to another agency',
+    'Canine returned to field', 'Feline returned to field',
+    'Canine other live outcome', 'Feline other live outcome',
+    'Canine died in care', 'Feline died in care',
+    'Canine lost in care', 'Feline list in care',
+    'Canine shelter euthanasia', 'Feline shelter euthanasia',
+    'Canine owner intended euthanasia', 'Feline owner intended euthanasia',
+]
+
+# Best Friends Animal Society intake counts
+BEST_FRIENDS_INTAKE_COLUMNS = [
+    f'{group} {measure}'
+    for group, measures in [
+        ('Total', ['Intake Gross', 'Intake Net', 'Intake Stray At Large', 'Intake Relinquished By Owner',
+                   'Intake Transferred In', 'Intake Other Intakes', 'Intake Owner Intended Euthanasia',
+                   'Intake Reason Not Given']),
+        ('Canine', ['Total Intake Gross', 'Total Intake Net', 'Intake Stray at Large', 'Intake Relinquished By Owner',
+                    'Intake Transferred In', 'Intake Other Intakes', 'Intake Owner Intended Euthanasia',
+                    'Intake Reason Not Given']),
+        ('Feline', ['Total Intake Gross', 'Total Intake Net', 'Intake Stray At Large', 'Intake Relinquished By Owner',
+                    'Intake Transferred In', 'Intake Other Intakes', 'Intake Owner Intended Euthanasia',
+                    'Intake Reason Not Given']),
+        ('Undesignated Species', ['Total Intake Gross', 'Total Intake Net', 'Intake Stray at Large',
+                                  'Intake Relinquished by Owner', 'Intake Transferred In', 'Intake Other Intakes',
+                                  'Intake Owner Intended Euthanasia', 'Intake Reason Not Given']),
+    ]
+    for measure in measures
+]
+
+COUNT_COLUMNS = GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS + BEST_FRIENDS_INTAKE_COLUMNS
+
+# Columns that describe a report; every other column of the sources holds counts
+GEORGIA_DESCRIPTIVE_COLUMNS = ['Shelter Name', 'License Number', 'Report Period Start', 'Report Period End']
+BEST_FRIENDS_DESCRIPTIVE_COLUMNS = ['Shelter Name', 'EIN', 'Organization Type', 'City', 'State', 'Zip Code', 'County',
+                                    'Data Year']
+DESCRIPTIVE_COLUMNS = list(dict.fromkeys(GEORGIA_DESCRIPTIVE_COLUMNS + ['Shelter Name Annotation']
+                                         + BEST_FRIENDS_DESCRIPTIVE_COLUMNS))
+
+CATEGORY_COLUMNS = ['Shelter Name', 'State', 'Shelter Name Annotation']
+
+# Candidate count types, smallest first
+INTEGER_DTYPES = ['Int8', 'Int16', 'Int32', 'Int64']
+
+
+def count_columns(columns):
+    """
+    Returns the count columns among the given columns, in their order.
+    """
+    return [column for column in columns if column not in DESCRIPTIVE_COLUMNS]
+
+
+def smallest_integer_dtype(values):
+    """
+    Returns the smallest nullable integer dtype that holds the values exactly.
+
+    Parameters:
+        values (pd.Series): A numeric column.
+
+    Returns:
+        str or None: The dtype name, or None if the column holds non-integer values.
+    """
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.isna().sum() != values.isna().sum():
+        return None
+    present = numeric.dropna().to_numpy(dtype='float64')
+    if len(present) == 0:
+        return INTEGER_DTYPES[0]
+    if not np.array_equal(present, np.floor(present)):
+        return None
+
+    low, high = present.min(), present.max()
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+
+def compact_frame(df):
+    """
+    Converts the declared count columns to compact nullable integers and the
+    name, state and annotation columns to categoricals.
+
+    Count columns holding non-integer values (such as imputed averages) keep
+    their dtype. Columns missing from the frame are skipped.
+
+    Parameters:
+        df (pd.DataFrame): The cleaned combined dataframe.
+
+    Returns:
+        pd.DataFrame: The compact DataFrame.
+    """
+    compact = df.copy()
+    for column in COUNT_COLUMNS:
+        if column in compact.columns:
+            dtype = smallest_integer_dtype(compact[column])
+            if dtype is not None:
+                compact[column] = pd.to_numeric(compact[column]).astype(dtype)
+    for column in CATEGORY_COLUMNS:
+        if column in compact.columns:
+            compact[column] = compact[column].astype('category')
+    return compact
+
+
+def memory_usage_mb(df):
+    """
+    Returns the deep memory usage of a DataFrame in MB.
+    """
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
@@ -0,0 +1,480 @@
+## Interactive Report Server
+#
+# Serves the report charts as interactive plotly views on a local web server.
+# The cleaned combined dataset is loaded once and summed into the aggregation
+# cube; every view is a slice of the cube for the years, states and species
+# chosen in the page's filters. Report tables and rendered views are kept in a
+# bounded LRU cache shared by all request threads, and concurrent requests for
+# the same filters wait for one computation instead of repeating it.
+#
+# Endpoints:
+#   /                         the list of views
+#   /view/<name>              an interactive chart (?years=2021-2023&state=GA&species=canine)
+#   /api/<table>              a report table as JSON, with the same filters
+#   /stats                    cache hits, misses and size
+#
+# Usage:
+#   python dataset_server.py                          # serve on http://127.0.0.1:8050
+#   python dataset_server.py --port 8080 --source aggregates/combined
+#   python dataset_server.py --load-test 1000 --concurrency 16
+
+import argparse
+import collections
+import html
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from dataset_aggregation import build_cube
+from dataset_partitions import COMBINED_PATH, read_combined
+from dataset_transformation import aggregate_reports, cube_measures
+
+HOST = '127.0.0.1'
+PORT = int(os.environ.get('SHELTER_SERVER_PORT', 8050))
+
+# Report tables and views kept in memory
+CACHE_SIZE = int(os.environ.get('SHELTER_SERVER_CACHE_SIZE', 256))
+
+DEFAULT_YEARS = (2021, 2023)
+SPECIES = ['all', 'canine', 'feline']
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache that computes each missing value once.
+
+    Parameters:
+        maxsize (int): Number of values kept.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        """
+        Returns the cached value of key, calling compute() if it is missing.
+        Threads asking for a key that is being computed wait for the result.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            event = self.pending.get(key)
+            if event is None:
+                event = self.pending[key] = threading.Event()
+                self.misses += 1
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            event.wait()
+            with self.lock:
+                if key in self.entries:
+                    self.hits += 1
+                    return self.entries[key]
+            # The computation failed or its value was already evicted
+            return compute()
+
+        try:
+            value = compute()
+            with self.lock:
+                self.entries[key] = value
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            event.set()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'maxsize': self.maxsize}
+
+
+def bar(x, y, name=None):
+    import plotly.graph_objects as go
+
+    return go.Bar(x=list(x), y=list(y), name=name)
+
+
+def state_figure(totals, title):
+    import plotly.graph_objects as go
+
+    figure = go.Figure(bar(totals.index, totals.values))
+    figure.update_layout(title=title, xaxis_title='State', yaxis_title='Total Count')
+    return figure
+
+
+def species_figure(tables, species, kind, label):
+    import plotly.graph_objects as go
+
+    figure = go.Figure()
+    for name, table in [('Dogs', f'dog_{kind}_totals'), ('Cats', f'cat_{kind}_totals')]:
+        if species == 'all' or (species == 'canine') == (name == 'Dogs'):
+            figure.add_trace(bar(tables[table].index, tables[table].values, name=name))
+    figure.update_layout(title=f'Total Stray Pets by State and Species, {kind} intake ({label})', barmode='group',
+                         xaxis_title='State', yaxis_title='Total Count')
+    return figure
+
+
+def state_intake_view(tables, species, label):
+    table = {'all': 'state_totals', 'canine': 'dog_gross_totals', 'feline': 'cat_gross_totals'}[species]
+    name = {'all': 'Pets', 'canine': 'Dogs', 'feline': 'Cats'}[species]
+    return state_figure(tables[table], f'Total Stray {name} by State ({label})')
+
+
+def top_shelters_view(tables, species, label):
+    import plotly.graph_objects as go
+
+    top = tables['top_10_data']
+    figure = go.Figure([bar(top.index, top[year].fillna(0).values, name=f'{year:g}') for year in top.columns])
+    figure.update_layout(title=f'Top 10 Animal Shelters by Animal Count ({label})', barmode='stack',
+                         xaxis_title='Shelter Name', yaxis_title='Total Animal Count', legend_title='Year')
+    return figure
+
+
+def outcomes_view(tables, species, label):
+    import plotly.graph_objects as go
+
+    figure = go.Figure()
+    for name, table in [('Canine', 'canine_outcomes'), ('Feline', 'feline_outcomes')]:
+        if species == 'all' or species == name.lower():
+            outcomes = tables[table]
+            figure.add_trace(go.Bar(x=outcomes['count'], y=outcomes['outcome_type'], orientation='h', name=name))
+    # Outcomes cover every year of the selected states, as in the static figures
+    figure.update_layout(title='Outcomes in Shelter System (all years)', xaxis_title='Count', yaxis_title='Outcome Type')
+    return figure
+
+
+# View name -> (link text, figure builder)
+VIEWS = {
+    'state_intake': ('Total intake by state', state_intake_view),
+    'species_split': ('Gross intake by species', lambda tables, species, label: species_figure(tables, species, 'gross', label)),
+    'net_intake': ('Net intake by species', lambda tables, species, label: species_figure(tables, species, 'net', label)),
+    'top_shelters': ('Top 10 shelters', top_shelters_view),
+    'outcomes': ('Outcomes', outcomes_view),
+    'undesignated': ('Undesignated species intake', lambda tables, species, label: state_figure(
+        tables['undesignated_totals'], f'Total Undesignated Stray Pets by State ({label})')),
+}
+
+
+# Report tables served by /api
+TABLES = ['state_totals', 'dog_gross_totals', 'cat_gross_totals', 'dog_net_totals', 'cat_net_totals', 'top_10_data',
+          'top_10_by_year', 'canine_outcomes', 'feline_outcomes', 'undesignated_totals']
+
+
+def parse_filters(query):
+    """
+    Reads the filters of a request.
+
+    Parameters:
+        query (str): The query string, e.g. 'years=2021-2023&state=GA&state=TX&species=canine'.
+
+    Returns:
+        tuple: (years, states, species) with years as an inclusive (first, last)
+        tuple or None for all years and states as a sorted tuple or None for all states.
+
+    Raises:
+        ValueError: If a filter cannot be read.
+    """
+    params = urllib.parse.parse_qs(query)
+    years = params.get('years', [None])[-1]
+    if years is None:
+        years = DEFAULT_YEARS
+    elif years == 'all':
+        years = None
+    else:
+        first, _, last = years.partition('-')
+        years = (int(first), int(last or first))
+        if years[0] > years[1]:
+            raise ValueError(f'years must run from the first year to the last, e.g. {years[1]}-{years[0]}')
+    states = sorted({state.strip() for value in params.get('state', []) for state in value.split(',') if state.strip()})
+    species = params.get('species', ['all'])[-1]
+    if species not in SPECIES:
+        raise ValueError(f"species must be one of {', '.join(SPECIES)}")
+    return years, tuple(states) or None, species
+
+
+def years_label(years):
+    if years is None:
+        return 'all years'
+    return f'{years[0]}' if years[0] == years[1] else f'{years[0]}-{years[1]}'
+
+
+class ReportData:
+    """
+    The aggregation cube of the combined dataset and the caches of its report tables and views.
+
+    Parameters:
+        combined_df (pd.DataFrame): The cleaned combined dataset, loaded once.
+        cache_size (int): Entries kept by the LRU cache.
+    """
+
+    def __init__(self, combined_df, cache_size=CACHE_SIZE):
+        measures = [column for column in cube_measures if column in combined_df.columns]
+        self.cube = build_cube(combined_df, measures)
+        self.states = sorted(state for state in self.cube['State'].dropna().unique())
+        self.years = sorted(int(year) for year in self.cube['Data Year'].dropna().unique())
+        self.cache = LRUCache(cache_size)
+        self.computed = 0
+        # pandas builds column lookups lazily and plotly imports its JSON
+        # encoder on first use, neither safely across threads; computations
+        # are CPU bound anyway, so they run one at a time
+        self.compute_lock = threading.RLock()
+
+    @classmethod
+    def load(cls, source=COMBINED_PATH, cache_size=CACHE_SIZE):
+        return cls(read_combined(source, include_duplicates=True), cache_size=cache_size)
+
+    def tables(self, years=DEFAULT_YEARS, states=None):
+        """
+        Returns the report tables for some years and states, computing them once.
+        """
+        def compute():
+            with self.compute_lock:
+                self.computed += 1
+                return aggregate_reports(self.cube, years=years, states=list(states) if states else None)
+
+        return self.cache.get(('tables', years, states), compute)
+
+    def view(self, name, years=DEFAULT_YEARS, states=None, species='all'):
+        """
+        Returns the HTML body of a view (the plotly chart without plotly.js).
+        """
+        def compute():
+            label = years_label(years) + (f", {', '.join(states)}" if states else '')
+            with self.compute_lock:
+                figure = VIEWS[name][1](self.tables(years, states), species, label)
+                return figure.to_html(full_html=False, include_plotlyjs=False)
+
+        return self.cache.get(('view', name, years, states, species), compute)
+
+    def table_json(self, table, years=DEFAULT_YEARS, states=None):
+        """
+        Returns a report table as JSON ({'index': ..., 'columns': ..., 'data': ...}).
+        """
+        def compute():
+            with self.compute_lock:
+                return self.tables(years, states)[table].to_json(orient='split')
+
+        return self.cache.get(('json', table, years, states), compute)
+
+
+def page(data, name, years, states, species, body):
+    """
+    Lays out a view with the filter form and the links to the other views.
+    """
+    def options(values, selected):
+        return ''.join(f'<option value="{html.escape(str(value))}"{" selected" if value in selected else ""}>'
+                       f'{html.escape(str(value))}</option>' for value in values)
+
+    first, last = years if years is not None else (data.years[0], data.years[-1]) if data.years else ('', '')
+    query = urllib.parse.urlencode({'years': f'{first}-{last}', 'state': ','.join(states or []), 'species': species})
+    links = ' | '.join(f'<a href="/view/{view}?{query}">{html.escape(text)}</a>' for view, (text, _) in VIEWS.items())
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Shelter Reports</title><script src="/plotly.min.js"></script></head>
+<body>
+<p>{links}</p>
+<form action="/view/{name}">
+  Years <select name="years">{options([f'{a}-{b}' for a in data.years for b in data.years if b >= a] + ['all'],
+                                       [f'{first}-{last}' if years is not None else 'all'])}</select>
+  States <select name="state" multiple size="4">{options(data.states, states or [])}</select>
+  Species <select name="species">{options(SPECIES, [species])}</select>
+  <input type="submit" value="Show">
+</form>
+{body}
+</body></html>"""
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are written separately; without this each kept-alive
+    # response waits for the client's delayed acknowledgement (about 40 ms)
+    disable_nagle_algorithm = True
+
+    def send(self, status, body, content_type='text/html; charset=utf-8'):
+        body = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        data = self.server.data
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip('/').split('/')]
+        try:
+            years, states, species = parse_filters(url.query)
+        except ValueError as e:
+            return self.send(400, f'Bad filter: {e}', 'text/plain; charset=utf-8')
+
+        if parts == ['']:
+            items = ''.join(f'<li><a href="/view/{view}">{html.escape(text)}</a></li>' for view, (text, _) in VIEWS.items())
+            return self.send(200, f'<!DOCTYPE html><html><body><h1>Shelter Reports</h1><ul>{items}</ul></body></html>')
+        if parts == ['plotly.min.js']:
+            return self.send(200, plotly_js(), 'application/javascript')
+        if parts == ['stats']:
+            stats = dict(data.cache.stats(), computed=data.computed)
+            return self.send(200, json.dumps(stats), 'application/json')
+        if len(parts) == 2 and parts[0] == 'view' and parts[1] in VIEWS:
+            body = data.view(parts[1], years, states, species)
+            return self.send(200, page(data, parts[1], years, states, species, body))
+        if len(parts) == 2 and parts[0] == 'api':
+            if parts[1] not in TABLES:
+                return self.send(404, f'No table {parts[1]}', 'text/plain; charset=utf-8')
+            return self.send(200, data.table_json(parts[1], years, states), 'application/json')
+        return self.send(404, 'Not found', 'text/plain; charset=utf-8')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+_plotly_js = None
+
+
+def plotly_js():
+    """
+    Returns the plotly.js bundle shipped with the plotly package, so pages work offline.
+    """
+    global _plotly_js
+    if _plotly_js is None:
+        from plotly.offline import get_plotlyjs
+
+        _plotly_js = get_plotlyjs().encode('utf-8')
+    return _plotly_js
+
+
+def make_server(data, host=HOST, port=PORT, verbose=False):
+    """
+    Creates the report server; call serve_forever() on it to handle requests.
+
+    Parameters:
+        data (ReportData): The loaded dataset.
+        host (str): Interface to listen on.
+        port (int): Port to listen on; 0 picks a free port.
+        verbose (bool): Log every request.
+
+    Returns:
+        ThreadingHTTPServer: The server, handling each request in its own thread.
+    """
+    server = ThreadingHTTPServer((host, port), ReportHandler)
+    server.daemon_threads = True
+    server.data = data
+    server.verbose = verbose
+    return server
+
+
+def load_test(base_url, requests=500, concurrency=8, paths=None):
+    """
+    Sends many concurrent requests to a running server.
+
+    Parameters:
+        base_url (str): The server address, e.g. 'http://127.0.0.1:8050'.
+        requests (int): Number of requests.
+        concurrency (int): Number of client threads, each keeping its connection open.
+        paths (list): Paths requested in turn. Defaults to every view and a few
+            tables for a handful of filters.
+
+    Returns:
+        dict: Number of requests and errors, total seconds, requests per second
+        and the median, 95th percentile and slowest latency in milliseconds.
+    """
+    from dataset_adapters import run_concurrently
+    from dataset_cache import http_request
+
+    if paths is None:
+        filters = ['', '?years=2021-2022', '?state=GA', '?species=canine', '?years=all&species=feline']
+        paths = ([f'/view/{view}{query}' for view in VIEWS for query in filters]
+                 + [f'/api/{table}{query}' for table in ['state_totals', 'top_10_data'] for query in filters])
+
+    def client(worker):
+        latencies, errors = [], 0
+        for number in range(worker, requests, concurrency):
+            start = time.perf_counter()
+            try:
+                http_request(base_url + paths[number % len(paths)])
+            except OSError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    start = time.perf_counter()
+    results = run_concurrently(client, range(concurrency), workers=concurrency)
+    seconds = time.perf_counter() - start
+    latencies = np.array([latency for latencies, _ in results.values() for latency in latencies]) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors for _, errors in results.values()),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def format_load_test(result, stats):
+    """
+    Formats a load test result and the server's cache statistics.
+    """
+    return (f"{result['requests']} requests ({result['errors']} errors) in {result['seconds']:.2f}s: "
+            f"{result['requests_per_second']:.0f} req/s, p50 {result['p50_ms']:.1f} ms, "
+            f"p95 {result['p95_ms']:.1f} ms, max {result['max_ms']:.1f} ms; cache {stats['hits']} hits, "
+            f"{stats['misses']} misses, {stats['computed']} report computations")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the shelter reports as interactive plotly views.')
+    parser.add_argument('--host', default=HOST, help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='Port to listen on')
+    parser.add_argument('--source', default=COMBINED_PATH, help='Partitioned combined dataset')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='Report tables and views kept in memory')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    parser.add_argument('--load-test', type=int, metavar='REQUESTS',
+                        help='Start the server on a free port, send this many requests and exit')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads of the load test')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    data = ReportData.load(args.source, cache_size=args.cache_size)
+    print(f"Loaded {len(data.cube)} cube rows from {args.source} in {time.perf_counter() - start:.2f}s")
+
+    if args.load_test:
+        server = make_server(data, args.host, 0, verbose=args.verbose)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            result = load_test(f'http://{args.host}:{server.server_address[1]}', args.load_test, args.concurrency)
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(format_load_test(result, dict(data.cache.stats(), computed=data.computed)))
+        return
+
+    server = make_server(data, args.host, args.port, verbose=args.verbose)
+    print(f"Serving the reports on http://{args.host}:{server.server_address[1]}/ (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__=='__main__':
+
+    main()
@@ -1,20 +1,38 @@
+import io
+
 import pandas as pd
 
-def load_data(url):
+def load_data(url, cache_dir=None, ttl=None, offline=False, max_bytes=None, max_age=None, validated=None):
     """
     Loads data from the provided URL and returns a pandas DataFrame.
 
     Parameters:
         url (str): The URL of the Excel file to load.
+        cache_dir (str): Directory of the local on-disk cache. If None, the file is read directly.
+        ttl (float): Seconds during which a cached copy is used without revalidating the source.
+        offline (bool): Only use the local cache and never touch the network.
+        max_bytes (int): Maximum total size of the cache before least recently used entries are evicted.
+        max_age (float): Maximum age in seconds of cache entries before they are evicted.
+        validated (tuple): The validator and downloaded bytes of the file if it was just
+            checked for changes; the bytes are read instead of downloading the file again.
 
     Returns:
         pd.DataFrame: The loaded DataFrame.
     """
     try:
-        # Read the Excel file from the URL
-        df = pd.read_excel(url)
+        if cache_dir is None and validated is not None and validated[1] is not None:
+            df = pd.read_excel(io.BytesIO(validated[1]))
+        elif cache_dir is None:
+            # Read the Excel file from the URL
+            df = pd.read_excel(url)
+        else:
+            from dataset_cache import load_cached
+            df = load_cached(url, cache_dir, ttl=ttl, offline=offline, max_bytes=max_bytes, max_age=max_age,
+                             validated=validated)
+            if df is None:
+                return None
         print("Data successfully loaded.")
         return df
     except Exception as e:
         print(f"An error occurred while loading the data: {e}")
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,243 @@
+## Embedded SQL Query Layer
+#
+# Loads the partitioned combined dataset (see dataset_partitions.py) into an
+# SQLite database with indexes on State, Shelter Name and Data Year, and
+# defines a view for each report of dataset_transformation.py. Ad-hoc
+# questions are then answered with SQL against the file, without running the
+# pipeline. The database is rebuilt when the combined dataset is newer.
+#
+# Usage:
+#   python dataset_sql.py --list
+#   python dataset_sql.py --view state_totals
+#   python dataset_sql.py --sql "SELECT State, COUNT(*) AS reports FROM report_rows GROUP BY State"
+#   python dataset_sql.py --rebuild
+
+import argparse
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from dataset_partitions import COMBINED_PATH, read_combined
+from dataset_schema import BEST_FRIENDS_INTAKE_COLUMNS
+from dataset_transformation import (animal_columns, cat_gross_columns, cat_net_columns, columns_to_sum,
+                                    dog_gross_columns, dog_net_columns, outcome_columns)
+
+SQL_PATH = os.environ.get('SHELTER_SQL_PATH', os.path.join('aggregates', 'shelters.sqlite'))
+
+# Years and rows behind the reports, as aggregate_reports slices the cube
+REPORT_YEARS = (2021, 2023)
+
+INDEXED_COLUMNS = ['State', 'Shelter Name', 'Data Year']
+
+
+def quote(name):
+    """
+    Quotes a column or table name for SQL.
+    """
+    return '"' + name.replace('"', '""') + '"'
+
+
+def total(columns):
+    """
+    SQL for the sum of several columns over a group; missing counts add nothing.
+    """
+    return ' + '.join(f'TOTAL({quote(column)})' for column in columns)
+
+
+def outcome_view(species):
+    """
+    SQL for the outcome totals of one species over every row, as in aggregate_reports.
+    """
+    return ' UNION ALL '.join(f"SELECT '{column}' AS outcome_type, TOTAL({quote(column)}) AS count FROM combined"
+                              for column in outcome_columns if species in column)
+
+
+def state_view(source, columns):
+    """
+    SQL for the total of some columns by state, largest first.
+    """
+    return f'SELECT State, {total(columns)} AS total FROM {source} GROUP BY State ORDER BY total DESC'
+
+
+# View name -> SQL; the report views match the tables of aggregate_reports
+VIEWS = {
+    'report_rows': (f'SELECT * FROM combined WHERE {quote("Data Year")} BETWEEN {REPORT_YEARS[0]} AND {REPORT_YEARS[1]} '
+                    f"AND ({quote('Shelter Name Annotation')} IS NULL OR {quote('Shelter Name Annotation')} != 'R')"),
+    'state_totals': state_view('report_rows', columns_to_sum),
+    'dog_gross_totals': state_view('report_rows', dog_gross_columns),
+    'cat_gross_totals': state_view('report_rows', cat_gross_columns),
+    'dog_net_totals': state_view('report_rows', dog_net_columns),
+    'cat_net_totals': state_view('report_rows', cat_net_columns),
+    'shelter_year_totals': (f'SELECT {quote("Shelter Name")}, {quote("Data Year")}, {total(animal_columns)} AS total '
+                            f'FROM report_rows GROUP BY {quote("Shelter Name")}, {quote("Data Year")}'),
+    'top_10_shelters': (f'SELECT {quote("Shelter Name")}, SUM(total) AS total FROM shelter_year_totals '
+                        f'GROUP BY {quote("Shelter Name")} ORDER BY total DESC, {quote("Shelter Name")} LIMIT 10'),
+    'top_10_by_year': (f'SELECT {quote("Shelter Name")}, {quote("Data Year")} AS Year, total AS {quote("Total Animals")} '
+                       f'FROM shelter_year_totals WHERE {quote("Shelter Name")} IN '
+                       f'(SELECT {quote("Shelter Name")} FROM top_10_shelters)'),
+    'canine_outcomes': outcome_view('Canine'),
+    'feline_outcomes': outcome_view('Feline'),
+    'undesignated_totals': state_view(
+        f'(SELECT * FROM combined WHERE {quote("Data Year")} BETWEEN {REPORT_YEARS[0]} AND {REPORT_YEARS[1]})',
+        ['Undesignated Species Total Intake Gross']),
+}
+
+
+def sql_column_names(columns):
+    """
+    Renames columns whose names only differ by case from an earlier column,
+    which SQLite treats as the same column. The Best Friends counts named like
+    Georgia counts, such as 'Canine Intake Owner Intended Euthanasia', get the
+    suffix ' (Best Friends)'.
+    """
+    names = []
+    seen = set()
+    for column in columns:
+        name = column
+        if name.lower() in seen:
+            name = f'{column} (Best Friends)' if column in BEST_FRIENDS_INTAKE_COLUMNS else column
+            number = 2
+            while name.lower() in seen:
+                name = f'{column} ({number})'
+                number += 1
+        seen.add(name.lower())
+        names.append(name)
+    return names
+
+
+def to_sql_frame(combined_df):
+    """
+    Converts the combined dataframe to types SQLite stores: text for
+    categoricals and dates, floats with NULLs for nullable counts, and the
+    numeric Data Year.
+    """
+    df = combined_df.copy()
+    df.columns = sql_column_names(df.columns)
+    df['Data Year'] = pd.to_numeric(df['Data Year'], errors='coerce')
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            df[column] = values.astype(object).where(values.notna(), None)
+        elif pd.api.types.is_extension_array_dtype(values.dtype) and pd.api.types.is_numeric_dtype(values.dtype):
+            df[column] = values.astype('float64')
+        elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+            df[column] = values.dt.strftime('%Y-%m-%d').where(values.notna(), None)
+    return df
+
+
+def build_database(combined_df, path=SQL_PATH):
+    """
+    Writes the combined dataframe to an SQLite database with its indexes and report views,
+    replacing any earlier database at the path.
+
+    Parameters:
+        combined_df (pd.DataFrame): The cleaned combined dataframe.
+        path (str): The database file.
+
+    Returns:
+        str: The database file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    staging = path + '.tmp'
+    if os.path.exists(staging):
+        os.remove(staging)
+
+    connection = sqlite3.connect(staging)
+    try:
+        to_sql_frame(combined_df).to_sql('combined', connection, index=False, chunksize=10000)
+        for column in INDEXED_COLUMNS:
+            name = 'idx_' + column.lower().replace(' ', '_')
+            connection.execute(f'CREATE INDEX {name} ON combined ({quote(column)})')
+        for name, sql in VIEWS.items():
+            connection.execute(f'CREATE VIEW {name} AS {sql}')
+        connection.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(staging, path)
+    return path
+
+
+def is_stale(path=SQL_PATH, source=COMBINED_PATH):
+    """
+    Whether the database is missing or older than the combined dataset it is loaded from.
+    """
+    if not os.path.exists(path):
+        return True
+    return os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(path)
+
+
+def connect(path=SQL_PATH, source=COMBINED_PATH):
+    """
+    Opens the database, building it from the combined dataset first if it is stale.
+
+    Returns:
+        sqlite3.Connection: A connection to the database.
+    """
+    if is_stale(path, source):
+        if not os.path.exists(source):
+            raise FileNotFoundError(f"No combined dataset at {source}; run dataset_transformation.py first")
+        build_database(read_combined(source, include_duplicates=True), path)
+    return sqlite3.connect(path)
+
+
+def query(sql, params=(), path=SQL_PATH, source=COMBINED_PATH):
+    """
+    Runs a query against the database.
+
+    Parameters:
+        sql (str): The query; views such as report_rows and state_totals can be used as tables.
+        params (tuple or dict): Query parameters.
+        path (str): The database file.
+        source (str): The combined dataset the database is built from.
+
+    Returns:
+        pd.DataFrame: The result rows.
+    """
+    connection = connect(path, source)
+    try:
+        return pd.read_sql_query(sql, connection, params=params)
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the combined shelter data with SQL.')
+    parser.add_argument('--sql', help='Run this query')
+    parser.add_argument('--view', choices=list(VIEWS), help='Show a report view')
+    parser.add_argument('--list', action='store_true', help='List the views and the columns of the combined table')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the database from the combined dataset')
+    parser.add_argument('--output', help='Write the result to this CSV file')
+    args = parser.parse_args()
+
+    if args.rebuild and os.path.exists(SQL_PATH):
+        os.remove(SQL_PATH)
+
+    if args.list:
+        columns = query('SELECT name FROM pragma_table_info(\'combined\')')['name']
+        print('views:   ' + ', '.join(VIEWS))
+        print('columns: ' + ', '.join(columns))
+        return
+
+    sql = args.sql or (f'SELECT * FROM {args.view}' if args.view else None)
+    if sql is None:
+        connect().close()
+        print(f"Database ready at {SQL_PATH}")
+        return
+
+    start = time.perf_counter()
+    result = query(sql)
+    print(f"{len(result)} rows in {(time.perf_counter() - start) * 1000:.1f} ms")
+    if args.output:
+        result.to_csv(args.output, index=False)
+        print(f"Result saved to {args.output}")
+    else:
+        print(result.to_string(index=False))
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,350 @@
+## Streaming Ingest
+#
+# Processes the Georgia Animal Shelter Database export in chunks of rows, so
+# exports covering many years and states run in bounded memory. Rows are read
+# with openpyxl in read-only mode, or batch by batch from the row groups of a
+# Parquet export. Each chunk is parsed, annotated, merged with the Best Friends
+# data, cleaned and summed into the aggregation cube before the next chunk is
+# read, and written as a part of the partitioned combined dataset. Only the
+# cube, the annotations and the Best Friends data stay in memory.
+# Outliers are repaired against baselines fitted in a first pass over the
+# export, which keeps only the shelter, date and count columns. With
+# SHELTER_DUPLICATES=auto or both, the same pass keeps the duplicate keys of
+# each report and detects the duplicates of the whole export.
+#
+# Usage:
+#   python dataset_stream.py                          # stream the Georgia export
+#   python dataset_stream.py --georgia export.parquet --chunk-size 50000
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from dataset_adapters import HEADER_SEARCH_ROWS, GeorgiaExportAdapter
+from dataset_aggregation import CUBE_PATH, build_cube, combine_cubes, save_cube
+from dataset_cache import download_cached, local_path, nulls_to_nan
+from dataset_duplicates import DUPLICATE_MODE, apply_duplicates, check_mode, duplicate_keys, match_duplicates
+from dataset_identity import (annotation_lookup, join_annotations, join_best_friends, load_shelter_index,
+                              save_shelter_index, shelter_ids, update_shelter_index)
+from dataset_ingest import ANNOTATIONS_PATH, BEST_FRIENDS_PATH, GEORGIA_DATE_COLUMNS, GEORGIA_URL, INGEST_DIR
+from dataset_outliers import AUDIT_COLUMNS, OUTLIER_AUDIT_PATH, OUTLIER_COLUMNS, fit_baselines, repair_outliers, save_audit
+from dataset_metrics import METRICS_DIR, metrics_tables, save_metrics
+from dataset_partitions import COMBINED_PATH, CombinedWriter
+from dataset_ranking import RANKING_PATH, build_ranking, save_ranking
+from dataset_transformation import CACHE_DIR, clean_combined, coerce_georgia_types, cube_measures, ranking_measures
+from dataset_validation import validate_source
+
+# Rows processed at a time
+CHUNK_SIZE = int(os.environ.get('SHELTER_CHUNK_SIZE', 10000))
+
+
+def download_workbook(url, cache_dir=CACHE_DIR, offline=False):
+    """
+    Returns a local path for a workbook, downloading remote workbooks to disk.
+
+    The download goes through the on-disk cache (see dataset_cache.download_cached)
+    and is kept as a file, so openpyxl can read it without holding it in memory.
+
+    Parameters:
+        url (str): The URL or path of the workbook.
+        cache_dir (str): Directory for downloaded workbooks.
+        offline (bool): Only use an existing download.
+
+    Returns:
+        str: The local path, or None if it is unavailable offline.
+    """
+    if local_path(url) is not None:
+        return local_path(url)
+    return download_cached(url, os.path.join(cache_dir, 'stream'), offline=offline)
+
+
+def iter_workbook_rows(path):
+    """
+    Yields the value tuples of the rows of a workbook's first sheet, reading
+    it in openpyxl's read-only mode.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def georgia_chunk(rows, positions, names):
+    """
+    Builds a validated, typed Georgia chunk from raw workbook rows, as
+    GeorgiaExportAdapter does for the whole sheet.
+
+    Raises:
+        SchemaError: If the rows do not match the Georgia schema.
+    """
+    values = [[row[position] if position < len(row) else None for position in positions] for row in rows]
+    chunk = coerce_georgia_types(validate_source('georgia', pd.DataFrame(values, columns=names)))
+    for column in GEORGIA_DATE_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = pd.to_datetime(chunk[column])
+    return chunk
+
+
+def iter_georgia_workbook(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields the Georgia export in typed chunks, reading the workbook row by row.
+
+    Parameters:
+        path (str): Local path of the export workbook.
+        chunk_size (int): Number of rows per chunk.
+
+    Returns:
+        generator: DataFrames in the layout of the ingested Georgia source.
+    """
+    rows = iter_workbook_rows(path)
+    # The header is the first row naming the columns the adapter looks for
+    for _ in range(HEADER_SEARCH_ROWS):
+        header = next(rows, None)
+        if header is None:
+            return
+        if all(column in header for column in GeorgiaExportAdapter.required_columns):
+            break
+    else:
+        raise ValueError(f"No header row naming {', '.join(GeorgiaExportAdapter.required_columns)} in the first "
+                         f"{HEADER_SEARCH_ROWS} rows of {path}")
+
+    # Keep the named columns
+    positions = [position for position, name in enumerate(header) if name is not None]
+    names = [header[position] for position in positions]
+
+    chunk = []
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield georgia_chunk(chunk, positions, names)
+            chunk = []
+    if chunk:
+        yield georgia_chunk(chunk, positions, names)
+
+
+def iter_georgia_parquet(path, chunk_size=CHUNK_SIZE):
+    """
+    Yields an already parsed Georgia export stored as Parquet, one batch at a time.
+    """
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield coerce_georgia_types(validate_source('georgia', nulls_to_nan(batch.to_pandas())))
+
+
+def iter_georgia_chunks(path, chunk_size=CHUNK_SIZE):
+    if path.endswith('.parquet'):
+        return iter_georgia_parquet(path, chunk_size)
+    return iter_georgia_workbook(path, chunk_size)
+
+
+def scan_stream(chunks, duplicates=DUPLICATE_MODE):
+    """
+    First pass over chunks of the Georgia data. Fits the outlier baselines (see
+    dataset_outliers.py), keeping only the columns the model needs, and unless
+    the duplicate mode is 'manual' detects the duplicate reports of the whole
+    export from the keys of each chunk (see dataset_duplicates.py).
+
+    Returns:
+        tuple: The model, as fit_baselines returns for the whole export, and the
+        detected annotation of each Georgia row (None in 'manual' mode).
+    """
+    check_mode(duplicates)
+    parts, keys = [], []
+    for chunk in chunks:
+        columns = [column for column in OUTLIER_COLUMNS if column in chunk.columns]
+        # Counts are whole numbers, which float32 holds exactly
+        part = chunk[['Shelter Name', 'Report Period Start']].join(chunk[columns].astype('float32'))
+        parts.append(part.drop_duplicates())
+        if duplicates != 'manual':
+            keys.append(duplicate_keys(chunk))
+    model = fit_baselines(pd.concat(parts, ignore_index=True))
+    if duplicates == 'manual':
+        return model, None
+    keys = pd.concat(keys, ignore_index=True)
+    detected = np.full(len(keys), np.nan, dtype=object)
+    detected[match_duplicates(keys)['Row'].to_numpy()] = 'R'
+    return model, detected
+
+
+def fit_stream_baselines(chunks):
+    """
+    Fits the outlier baselines from chunks of the Georgia data (see scan_stream).
+
+    Returns:
+        dict: The model, as fit_baselines returns for the whole export.
+    """
+    return scan_stream(chunks, 'manual')[0]
+
+
+def stream_cube(chunks, annotations, best_friends, index, measures=cube_measures, model=None, writer=None,
+                detected=None, duplicates=DUPLICATE_MODE):
+    """
+    Builds the aggregation cube incrementally from chunks of the Georgia data.
+
+    Each chunk goes through the annotate, merge and clean stages, has its
+    outliers repaired and is added to a running cube. With the model and
+    detected duplicates of scan_stream, the result matches build_cube over the
+    combined dataframe of the batch pipeline.
+
+    Parameters:
+        chunks (iterable): Typed chunks of the Georgia data, in sheet order.
+        annotations (pd.DataFrame): The Shelter Name Annotations.
+        best_friends (pd.DataFrame): The Best Friends Animal Society data.
+        index (dict): The shelter index; shelters first seen in a chunk are added to it.
+        measures (list): The count columns to sum.
+        model (dict): Outlier baselines from scan_stream; outliers are kept if None.
+        writer (CombinedWriter): Receives the cleaned and repaired rows of each chunk, if given.
+        detected (np.ndarray): Duplicate annotations of each Georgia row from scan_stream;
+            only the manual annotations are used if None.
+        duplicates (str): The duplicate mode detected is applied by.
+
+    Returns:
+        tuple: The cube and a summary dict with the number of Georgia rows and
+        chunks and the outlier audit table.
+    """
+    update_shelter_index(index, annotations['Shelter Name'])
+    update_shelter_index(index, best_friends['Shelter Name'])
+    lookup = annotation_lookup(annotations, index)
+
+    cube = None
+    template = None
+    georgia_rows = 0
+    chunk_count = 0
+    offsets = {}
+    combined_rows = 0
+    audits = []
+
+    def add(combined_chunk):
+        nonlocal cube, combined_rows
+        # Number the rows across chunks, so audit rows are unique
+        combined_chunk = clean_combined(combined_chunk.reset_index(drop=True))
+        combined_chunk.index += combined_rows
+        combined_rows += len(combined_chunk)
+        if model is not None:
+            combined_chunk, audit = repair_outliers(combined_chunk, model)
+            audits.append(audit)
+        if writer is not None:
+            writer.write(combined_chunk)
+        partial = build_cube(combined_chunk, measures)
+        cube = partial if cube is None else combine_cubes([cube, partial], measures)
+
+    for chunk in chunks:
+        update_shelter_index(index, chunk['Shelter Name'])
+        chunk, _ = join_annotations(chunk.reset_index(drop=True), lookup, index, offsets=offsets)
+        if detected is not None:
+            chunk = apply_duplicates(chunk, detected[georgia_rows:georgia_rows + len(chunk)], duplicates)
+        georgia_rows += len(chunk)
+        chunk_count += 1
+        if template is None:
+            template = chunk.iloc[0:0]
+        combined_chunk, _ = join_best_friends(chunk, best_friends, index, how='left')
+        add(combined_chunk)
+
+    if template is None:
+        return None, {'rows': 0, 'chunks': 0, 'audit': pd.DataFrame(columns=AUDIT_COLUMNS)}
+
+    # Best Friends shelters that never matched a Georgia row, as the outer merge keeps them
+    unmatched = best_friends[~shelter_ids(best_friends['Shelter Name'], index).isin(list(offsets))]
+    if len(unmatched):
+        combined_chunk, _ = join_best_friends(template, unmatched, index, how='right')
+        add(combined_chunk)
+
+    audit = pd.concat(audits, ignore_index=True) if audits else pd.DataFrame(columns=AUDIT_COLUMNS)
+    return cube, {'rows': georgia_rows, 'chunks': chunk_count, 'audit': audit}
+
+
+def run_stream(georgia=GEORGIA_URL, annotations=ANNOTATIONS_PATH, best_friends=BEST_FRIENDS_PATH,
+               chunk_size=CHUNK_SIZE, figures=None, output_dir='.', workers=None, offline=False):
+    """
+    Streams the Georgia export into the aggregation cube and renders the figures.
+
+    Parameters:
+        georgia (str): URL or path of the Georgia export (.xlsx or .parquet).
+        annotations (str): Path of the Shelter Name Annotations workbook.
+        best_friends (str): Path of the Best Friends workbook.
+        chunk_size (int): Number of Georgia rows processed at a time.
+        figures (list): Figures to render. Defaults to all figures; an empty list renders none.
+        output_dir (str): Directory the figures are written to.
+        workers (int): Number of processes used to render figures.
+        offline (bool): Only use local copies of remote sources.
+
+    Returns:
+        dict: The cube, the report tables, the render report and a summary.
+    """
+    from dataset_ingest import ingest_sources
+    from dataset_transformation import aggregate_reports
+
+    start = time.perf_counter()
+
+    # The annotations and Best Friends data are small and loaded whole
+    frames = ingest_sources({'annotations': annotations, 'best_friends': best_friends},
+                            output_dir=INGEST_DIR, cache_dir=CACHE_DIR, offline=offline)
+    failed = [name for name, frame in frames.items() if frame is None]
+    path = download_workbook(georgia, offline=offline)
+    if path is None:
+        failed.append('georgia')
+    if failed:
+        raise RuntimeError(f"Failed to load data: {', '.join(failed)}")
+
+    # A first pass fits the outlier baselines and detects duplicates, the second builds the cube
+    model, detected = scan_stream(iter_georgia_chunks(path, chunk_size))
+    index = load_shelter_index()
+    writer = CombinedWriter(COMBINED_PATH)
+    cube, summary = stream_cube(iter_georgia_chunks(path, chunk_size), frames['annotations'], frames['best_friends'], index,
+                                model=model, writer=writer, detected=detected)
+    save_shelter_index(index)
+    save_audit(summary['audit'], OUTLIER_AUDIT_PATH)
+    if cube is None:
+        raise RuntimeError(f"No rows found in {georgia}")
+    writer.close()
+    save_cube(cube, CUBE_PATH)
+    save_ranking(build_ranking(cube, ranking_measures), RANKING_PATH)
+    save_metrics(metrics_tables(cube), METRICS_DIR)
+    reports = aggregate_reports(cube)
+    summary['seconds'] = time.perf_counter() - start
+
+    render_report = None
+    if figures is None or figures:
+        from dataset_render import render_figures
+        render_report = render_figures(reports, figures, output_dir=output_dir, workers=workers)
+
+    return {'cube': cube, 'reports': reports, 'render_report': render_report, 'summary': summary}
+
+
+def main():
+    from dataset_render import format_report, peak_rss_mb
+    from dataset_transformation import FIGURES
+
+    parser = argparse.ArgumentParser(description='Stream the Georgia export through the pipeline in chunks.')
+    parser.add_argument('--georgia', default=GEORGIA_URL, help='URL or path of the Georgia export (.xlsx or .parquet)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Number of rows processed at a time')
+    parser.add_argument('--figure', action='append', choices=list(FIGURES),
+                        help='Render only this figure (may be repeated)')
+    parser.add_argument('--no-figures', action='store_true', help='Only build the aggregation cube')
+    parser.add_argument('--output-dir', default='.', help='Directory for the figures')
+    parser.add_argument('--workers', type=int, help='Number of processes used to render figures')
+    parser.add_argument('--offline', action='store_true', help='Do not contact remote sources')
+    args = parser.parse_args()
+
+    result = run_stream(georgia=args.georgia, chunk_size=args.chunk_size, figures=[] if args.no_figures else args.figure,
+                        output_dir=args.output_dir, workers=args.workers, offline=args.offline)
+    summary = result['summary']
+    peak = peak_rss_mb()
+    print(f"Streamed {summary['rows']} rows in {summary['chunks']} chunks in {summary['seconds']:.2f}s "
+          f"(peak RSS {f'{peak:,.0f} MB' if peak is not None else 'n/a'}); cube saved to {CUBE_PATH}")
+    print(f"Replaced {len(summary['audit'])} outlying counts; audit saved to {OUTLIER_AUDIT_PATH}")
+    if result['render_report'] is not None:
+        print(format_report(result['render_report']))
+
+if __name__=='__main__':
+
+    main()
@@ -0,0 +1,205 @@
+## Stage Instrumentation
+#
+# Records the wall time, CPU time, memory and row counts of each pipeline stage
+# and figure. Tracing is off unless SHELTER_TRACE (or --trace on the pipeline
+# command line) names an output file when the run starts:
+#   *.jsonl  one JSON object per span
+#   *.json   Chrome trace events, viewable in chrome://tracing or Perfetto
+# Spans are written as they finish, so a trace survives a failed run. When
+# tracing is off, span() returns a shared no-op context manager.
+#
+# The peak memory of a span (peak_rss_mb) is found by a thread that samples the
+# resident set size every SAMPLE_SECONDS while spans are open; a span shorter
+# than that reports the larger of its sizes at entry and exit. The peak of the
+# whole process so far is kept as process_peak_rss_mb.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from dataset_render import peak_rss_mb
+
+TRACE_PATH = os.environ.get('SHELTER_TRACE')
+
+# Seconds between the resident set size samples taken while spans are open
+SAMPLE_SECONDS = float(os.environ.get('SHELTER_TRACE_SAMPLE_SECONDS', '0.01'))
+
+_tracer = None
+
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def current_rss_mb():
+    """
+    Returns the current resident set size in MB, or None where /proc is unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+def count_rows(output):
+    """
+    Returns the row count of a stage output: an int for a DataFrame or Series,
+    a dict of counts for a dict of them, or None for anything else.
+    """
+    if hasattr(output, 'shape') and hasattr(output, 'index'):
+        return len(output)
+    if isinstance(output, dict):
+        counts = {str(key): len(value) for key, value in output.items() if hasattr(value, 'shape')}
+        return counts or None
+    return None
+
+
+class Tracer:
+    """
+    Writes finished spans to a JSON lines or Chrome trace file.
+
+    Parameters:
+        path (str): The trace file. Names ending in .json are written as Chrome
+            trace events; anything else as JSON lines.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.chrome = path.endswith('.json')
+        self.lock = threading.Lock()
+        # Peak resident set size sampled for each open span, and the sampling thread
+        self.peaks = {}
+        self.sampler = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            if self.chrome:
+                # JSON Array Format; the closing bracket is optional
+                f.write('[\n')
+
+    def emit(self, record):
+        """
+        Writes one finished span.
+
+        Parameters:
+            record (dict): The span, with at least name, category, start (epoch
+                seconds) and wall_seconds. Other keys are kept as arguments.
+        """
+        if self.chrome:
+            args = {key: value for key, value in record.items()
+                    if key not in ('name', 'category', 'start', 'wall_seconds', 'pid', 'tid')}
+            event = {
+                'name': record['name'],
+                'cat': record['category'],
+                'ph': 'X',
+                'ts': record['start'] * 1e6,
+                'dur': record['wall_seconds'] * 1e6,
+                'pid': record.get('pid', os.getpid()),
+                'tid': record.get('tid', threading.get_ident()),
+                'args': args,
+            }
+            line = json.dumps(event, default=str) + ',\n'
+        else:
+            line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def sample(self):
+        """
+        Raises the peak of every open span to the current resident set size until
+        no span is open.
+        """
+        while True:
+            time.sleep(SAMPLE_SECONDS)
+            rss = current_rss_mb()
+            with self.lock:
+                if not self.peaks:
+                    self.sampler = None
+                    return
+                for key, peak in self.peaks.items():
+                    self.peaks[key] = max(peak, rss)
+
+    @contextlib.contextmanager
+    def span(self, name, category='stage', **fields):
+        """
+        Measures the enclosed block and emits it as a span.
+
+        Yields:
+            dict: The span record; the block may add fields such as 'rows'.
+        """
+        record = {'name': name, 'category': category, **fields}
+        start, wall, cpu = time.time(), time.perf_counter(), time.process_time()
+        rss_before = current_rss_mb()
+        sampled = rss_before is not None
+        if sampled:
+            with self.lock:
+                self.peaks[id(record)] = rss_before
+                if self.sampler is None:
+                    self.sampler = threading.Thread(target=self.sample, name='trace-sampler', daemon=True)
+                    self.sampler.start()
+        try:
+            yield record
+        finally:
+            rss = current_rss_mb()
+            if sampled:
+                with self.lock:
+                    peak = max(self.peaks.pop(id(record)), rss or 0)
+            record.update({
+                'start': start,
+                'wall_seconds': time.perf_counter() - wall,
+                'cpu_seconds': time.process_time() - cpu,
+                'rss_mb': rss,
+                'rss_before_mb': rss_before,
+                'peak_rss_mb': peak if sampled else None,
+                'process_peak_rss_mb': peak_rss_mb(),
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+            })
+            self.emit(record)
+
+
+def enable_tracing(path):
+    """
+    Starts writing spans to path. Returns the tracer.
+    """
+    global _tracer
+    _tracer = Tracer(path)
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, category='stage', **fields):
+    """
+    Measures a block when tracing is on:
+
+        with span('merge') as record:
+            ...
+            if record is not None:
+                record['rows'] = len(df)
+
+    Yields:
+        dict or None: The span record, or None when tracing is off.
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, category, **fields)
+
+
+def emit(record):
+    """
+    Writes a span measured elsewhere, such as in a render worker, when tracing is on.
+    """
+    if _tracer is not None:
+        _tracer.emit(record)
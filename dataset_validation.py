@@ -0,0 +1,193 @@
+## Source Schema Validation
+#
+# Checks each source as soon as its header is found, before it is typed,
+# merged or cached: the expected columns must be present under their names,
+# counts must be whole non-negative numbers in a plausible range and report
+# periods must be dates that end after they start. Every check is a vectorized
+# operation over a column, so a workbook is validated in milliseconds and a
+# shifted or renamed layout stops the run with a list of the problems instead
+# of failing late or zero-filling the wrong columns.
+#
+# Usage:
+#   python dataset_validation.py                  # validate the default sources
+#   python dataset_validation.py --offline
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_schema import BEST_FRIENDS_DESCRIPTIVE_COLUMNS, GEORGIA_DESCRIPTIVE_COLUMNS, count_columns
+
+# Largest monthly or yearly count accepted from any shelter
+MAX_COUNT = int(os.environ.get('SHELTER_MAX_COUNT', 1000000))
+
+# Offending rows quoted per problem
+EXAMPLES = 3
+
+# Columns each kind of source must name; every other column of a Georgia or
+# Best Friends source is checked as a count
+REQUIRED_COLUMNS = {
+    'georgia': GEORGIA_DESCRIPTIVE_COLUMNS,
+    'annotations': ['Shelter Name', 'Shelter Name Annotation'],
+    'best_friends': BEST_FRIENDS_DESCRIPTIVE_COLUMNS,
+}
+
+
+class SchemaError(ValueError):
+    """
+    Raised when a source does not have the expected layout or values.
+
+    Attributes:
+        source (str): The source name.
+        problems (list): One description per problem found.
+    """
+
+    def __init__(self, source, problems):
+        self.source = source
+        self.problems = problems
+        super().__init__(f"{source} failed schema validation:\n  " + '\n  '.join(problems))
+
+
+def examples(df, mask, column):
+    """
+    Quotes the first offending rows of a column, numbered as data rows.
+    """
+    rows = np.flatnonzero(mask)[:EXAMPLES]
+    quoted = ', '.join(f"row {row}: {df[column].iloc[row]!r}" for row in rows)
+    more = ' ...' if mask.sum() > EXAMPLES else ''
+    return f"{quoted}{more}"
+
+
+def check_columns(df, required):
+    """
+    Checks that the required columns are present once each.
+
+    Returns:
+        list: The problems found.
+    """
+    problems = []
+    missing = [column for column in required if column not in df.columns]
+    if missing:
+        problems.append(f"missing columns: {', '.join(missing)}")
+    duplicated = sorted(set(df.columns[df.columns.duplicated()].astype(str)))
+    if duplicated:
+        problems.append(f"repeated columns: {', '.join(duplicated)}")
+    return problems
+
+
+def check_counts(df, columns, allow_missing=False, max_count=MAX_COUNT):
+    """
+    Checks that count columns hold whole numbers between 0 and max_count.
+
+    Parameters:
+        df (pd.DataFrame): The source.
+        columns (list): The count columns.
+        allow_missing (bool): Accept empty cells and "NaN" strings, which the pipeline zero-fills.
+        max_count (int): The largest plausible count.
+
+    Returns:
+        list: The problems found.
+    """
+    problems = []
+    for column in columns:
+        values = df[column]
+        if values.dtype == object:
+            missing = values.isna() | values.astype(str).str.lower().eq('nan')
+        else:
+            missing = values.isna()
+        numbers = pd.to_numeric(values.mask(missing), errors='coerce')
+        checks = [
+            ('non-numeric values', numbers.isna() & ~missing),
+            ('fractional values', (numbers % 1).fillna(0).ne(0)),
+            ('negative values', numbers.lt(0)),
+            (f'values above {max_count}', numbers.gt(max_count)),
+        ]
+        if not allow_missing:
+            checks.insert(0, ('missing values', missing))
+        for problem, mask in checks:
+            mask = mask.to_numpy(dtype=bool)
+            if mask.any():
+                problems.append(f"{column}: {mask.sum()} {problem} ({examples(df, mask, column)})")
+    return problems
+
+
+def check_periods(df, start='Report Period Start', end='Report Period End'):
+    """
+    Checks that report periods are dates and do not end before they start.
+
+    Returns:
+        list: The problems found.
+    """
+    problems = []
+    dates = {}
+    for column in [start, end]:
+        values = df[column]
+        dates[column] = pd.to_datetime(values, errors='coerce')
+        mask = (dates[column].isna() & values.notna()).to_numpy()
+        if mask.any():
+            problems.append(f"{column}: {mask.sum()} values that are not dates ({examples(df, mask, column)})")
+    mask = (dates[end] < dates[start]).to_numpy()
+    if mask.any():
+        problems.append(f"{end}: {mask.sum()} periods ending before they start ({examples(df, mask, end)})")
+    return problems
+
+
+def validate_source(kind, df, name=None, max_count=MAX_COUNT):
+    """
+    Validates a parsed source before it is typed.
+
+    Parameters:
+        kind (str): The kind of source ('georgia', 'annotations' or 'best_friends').
+        df (pd.DataFrame): The source with its header applied and columns mapped.
+        name (str): The source name used in messages. Defaults to the kind.
+        max_count (int): The largest plausible count.
+
+    Returns:
+        pd.DataFrame: The source, unchanged.
+
+    Raises:
+        SchemaError: If any check fails.
+    """
+    problems = check_columns(df, REQUIRED_COLUMNS.get(kind, []))
+    if not problems:
+        if kind == 'georgia':
+            problems += check_periods(df)
+            problems += check_counts(df, count_columns(df.columns), max_count=max_count)
+        elif kind == 'best_friends':
+            problems += check_counts(df, count_columns(df.columns), allow_missing=True, max_count=max_count)
+    if problems:
+        raise SchemaError(name or kind, problems)
+    return df
+
+
+def main():
+    from dataset_adapters import make_adapter
+    from dataset_ingest import SOURCES
+    from dataset_transformation import CACHE_DIR
+
+    parser = argparse.ArgumentParser(description='Check the layout and values of the source workbooks.')
+    parser.add_argument('--offline', action='store_true', help='Only use cached copies of remote sources')
+    args = parser.parse_args()
+
+    failed = False
+    for name, source in SOURCES.items():
+        adapter = make_adapter(name, source)
+        try:
+            df = adapter.load(cache_dir=CACHE_DIR, offline=args.offline)
+        except SchemaError as e:
+            print(e)
+            failed = True
+            continue
+        if df is None:
+            print(f"{name}: could not be loaded")
+            failed = True
+        else:
+            print(f"{name}: {len(df)} rows, {len(df.columns)} columns OK")
+    if failed:
+        raise SystemExit(1)
+
+if __name__=='__main__':
+
+    main()
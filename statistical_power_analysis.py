@@ -1,15 +1,434 @@
-## Statistical Power Analysis 
+## Statistical Power Analysis
+#
+# Required sample sizes for study designs across effect sizes, significance
+# levels, powers, test families and Bonferroni-corrected numbers of
+# comparisons. A whole grid of scenarios is solved at once: power is evaluated
+# with the same noncentral t and normal distributions statsmodels uses, for
+# all scenarios in one array, and the sample sizes are found with a
+# vectorized bracketing root finder. Solved scenarios are memoized, and any
+# scenario the vectorized solver cannot bracket falls back to statsmodels'
+# solve_power in worker processes.
+#
+# Usage:
+#   python statistical_power_analysis.py               # the original single design
+#   python statistical_power_analysis.py --effect-size 0.2 0.5 0.8 --alpha 0.05 0.01 --comparisons 1 5 --output power_grid.csv
+#   python statistical_power_analysis.py --curves Power_Curves.png
+#   python statistical_power_analysis.py --benchmark
 
-import statsmodels.stats.power as smp
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
 
 # Define parameters
 effect_size = (0.2)  # Example effect size
 alpha = (0.01)       # Significance level
 power = 0.80       # Desired power
 
-# Create a power analysis object
-analysis = smp.TTestIndPower()
+# Test families: number of samples, test statistic and the matching statsmodels power class
+TESTS = {
+    'ttest_ind': {'samples': 2, 'distribution': 't', 'statsmodels': 'TTestIndPower'},
+    'ttest': {'samples': 1, 'distribution': 't', 'statsmodels': 'TTestPower'},
+    'ztest_ind': {'samples': 2, 'distribution': 'normal', 'statsmodels': 'NormalIndPower'},
+    'ztest': {'samples': 1, 'distribution': 'normal', 'statsmodels': 'NormalIndPower'},
+}
+
+ALTERNATIVES = ['two-sided', 'larger', 'smaller']
+
+# Relative tolerance of the solved sample sizes and the iteration limits of the solver
+RTOL = 1e-10
+MAX_ITERATIONS = 100
+MAX_GROWTHS = 200
+
+GRID_COLUMNS = ['test', 'alternative', 'effect_size', 'alpha', 'comparisons', 'corrected_alpha', 'power', 'ratio',
+                'nobs1', 'nobs2', 'total_nobs', 'solver']
+
+# Memoized sample sizes by scenario
+_solved = {}
+
+
+def clear_cache():
+    _solved.clear()
+
+
+def power_values(test, effect_size, nobs1, alpha, ratio=1.0, alternative='two-sided'):
+    """
+    Calculates the power of a test for arrays of scenarios.
+
+    Parameters:
+        test (str): A key of TESTS.
+        effect_size, nobs1, alpha, ratio (float or np.ndarray): Standardized
+            effect sizes, sizes of the first sample, significance levels and
+            ratios of the second sample size to the first; broadcast together.
+            The ratio is ignored by one-sample tests.
+        alternative (str): 'two-sided', 'larger' or 'smaller'.
+
+    Returns:
+        np.ndarray: The power of each scenario, as statsmodels calculates it
+        where the noncentral t distribution is computable.
+    """
+    family = TESTS[test]
+    if alternative not in ALTERNATIVES:
+        raise ValueError(f"alternative has to be one of {', '.join(ALTERNATIVES)}")
+    effect_size, nobs1, alpha, ratio = np.broadcast_arrays(*(np.asarray(value, dtype='float64')
+                                                            for value in (effect_size, nobs1, alpha, ratio)))
+
+    if family['samples'] == 2:
+        nobs2 = nobs1 * ratio
+        nobs = 1.0 / (1.0 / nobs1 + 1.0 / nobs2)
+        df = nobs1 + nobs2 - 2
+    else:
+        nobs = nobs1
+        df = nobs1 - 1
+    shift = effect_size * np.sqrt(nobs)
+    alpha_ = alpha / 2 if alternative == 'two-sided' else alpha
+
+    result = np.zeros(shift.shape)
+    with np.errstate(invalid='ignore'):
+        if family['distribution'] == 't':
+            # The noncentral t is not computable far in its tails, where it is 0 or 1 to double precision;
+            # which one follows from the side of the critical value the noncentrality is on
+            if alternative in ('two-sided', 'larger'):
+                critical = stats.t.isf(alpha_, df)
+                upper = 1 - special.nctdtr(df, shift, critical)
+                result += np.where(np.isnan(upper), shift > critical, upper)
+            if alternative in ('two-sided', 'smaller'):
+                critical = stats.t.ppf(alpha_, df)
+                lower = special.nctdtr(df, shift, critical)
+                result += np.where(np.isnan(lower), shift < critical, lower)
+        else:
+            if alternative in ('two-sided', 'larger'):
+                result += stats.norm.sf(stats.norm.isf(alpha_) - shift)
+            if alternative in ('two-sided', 'smaller'):
+                result += stats.norm.cdf(stats.norm.ppf(alpha_) - shift)
+    return result
+
+
+def smallest_nobs(test, ratio):
+    """
+    Returns the lower end of the sample size bracket: one degree of freedom for
+    t-tests, whose critical values are unusable below it, and almost no
+    observations for z-tests.
+    """
+    family = TESTS[test]
+    if family['distribution'] == 'normal':
+        return np.full(np.shape(ratio), 1e-8)
+    if family['samples'] == 2:
+        return 3.0 / (1.0 + np.asarray(ratio))
+    return np.full(np.shape(ratio), 2.0)
+
+
+def solve_nobs1(test, effect_size, alpha, power, ratio=1.0, alternative='two-sided'):
+    """
+    Solves the first sample size giving the target power, for arrays of scenarios.
+
+    The bracket starts at the smallest valid size and the normal
+    approximation, which grows until the bracket holds the root; the Illinois variant of regula
+    falsi then narrows every bracket at once.
+
+    Parameters:
+        test (str): A key of TESTS.
+        effect_size, alpha, power, ratio (np.ndarray): One value per scenario.
+        alternative (str): 'two-sided', 'larger' or 'smaller'.
+
+    Returns:
+        np.ndarray: The sample sizes; NaN where no root was bracketed or the solver did not converge.
+    """
+    effect_size, alpha, power, ratio = np.broadcast_arrays(*(np.asarray(value, dtype='float64')
+                                                            for value in (effect_size, alpha, power, ratio)))
+
+    def excess(nobs1, at=slice(None)):
+        return power_values(test, effect_size[at], nobs1, alpha[at], ratio[at], alternative) - power[at]
+
+    low = smallest_nobs(test, ratio)
+    low_excess = excess(low)
+
+    # Normal approximation of the root, scaled to the first sample
+    alpha_ = alpha / 2 if alternative == 'two-sided' else alpha
+    with np.errstate(divide='ignore', invalid='ignore'):
+        approximate = ((stats.norm.isf(alpha_) + stats.norm.ppf(power)) / np.abs(effect_size)) ** 2
+        if TESTS[test]['samples'] == 2:
+            approximate = approximate * (1 + ratio) / ratio
+    # t-tests need a little more than the approximation; growing the bracket slowly keeps it out of the
+    # far tail, where the noncentral t distribution is not computable
+    high = np.where(np.isfinite(approximate), np.maximum(1.1 * approximate, low), low) + 4
+    high_excess = excess(high)
+    for _ in range(MAX_GROWTHS):
+        short = high_excess < 0
+        if not short.any():
+            break
+        high[short] *= 1.25
+        high_excess[short] = excess(high[short], short)
+
+    nobs1 = np.full(effect_size.shape, np.nan)
+    active = (low_excess < 0) & (high_excess >= 0)
+    # Which end of each bracket moved last, for the Illinois halving
+    last = np.zeros(effect_size.shape, dtype='int8')
+    for _ in range(MAX_ITERATIONS):
+        if not active.any():
+            break
+        at = np.flatnonzero(active)
+        guess = low[at] - low_excess[at] * (high[at] - low[at]) / (high_excess[at] - low_excess[at])
+        guess_excess = excess(guess, at)
+
+        below = guess_excess < 0
+        moved_low, moved_high = at[below], at[~below]
+        high_excess[moved_low[last[moved_low] == -1]] /= 2
+        low_excess[moved_high[last[moved_high] == 1]] /= 2
+        low[moved_low], low_excess[moved_low], last[moved_low] = guess[below], guess_excess[below], -1
+        high[moved_high], high_excess[moved_high], last[moved_high] = guess[~below], guess_excess[~below], 1
+
+        converged = (high[at] - low[at] <= RTOL * guess) | (guess_excess == 0)
+        nobs1[at[converged]] = guess[converged]
+        active[at[converged]] = False
+    return nobs1
+
+
+def statsmodels_nobs1(scenario):
+    """
+    Solves one scenario with statsmodels' solve_power. Runs in worker processes.
+
+    Parameters:
+        scenario (tuple): (test, alternative, effect_size, alpha, power, ratio).
+
+    Returns:
+        float: The first sample size, or NaN if statsmodels fails.
+    """
+    import warnings
+    import statsmodels.stats.power as smp
+
+    test, alternative, effect_size, alpha, power, ratio = scenario
+    analysis = getattr(smp, TESTS[test]['statsmodels'])()
+    kwargs = {'effect_size': effect_size, 'alpha': alpha, 'power': power, 'alternative': alternative}
+    if test == 'ztest':
+        kwargs['ratio'] = 0
+    elif TESTS[test]['samples'] == 2:
+        kwargs['ratio'] = ratio
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return float(np.squeeze(analysis.solve_power(**kwargs)))
+    except (ValueError, RuntimeError, ZeroDivisionError):
+        return np.nan
+
+
+def solve_scenarios(scenarios, workers=None):
+    """
+    Solves the first sample size of each scenario: from the memo, with the
+    vectorized solver, or with statsmodels in worker processes for the
+    scenarios the vectorized solver leaves unsolved.
+
+    Parameters:
+        scenarios (list): (test, alternative, effect_size, alpha, power, ratio) tuples.
+        workers (int): Number of processes for the fallback.
+
+    Returns:
+        tuple: The sample sizes (np.ndarray) and the solver of each scenario (list).
+    """
+    missing = [scenario for scenario in dict.fromkeys(scenarios) if scenario not in _solved]
+
+    # One vectorized solve per test family and alternative
+    groups = {}
+    for scenario in missing:
+        groups.setdefault(scenario[:2], []).append(scenario)
+    fallback = []
+    for (test, alternative), group in groups.items():
+        values = np.array([scenario[2:] for scenario in group], dtype='float64')
+        solved = solve_nobs1(test, values[:, 0], values[:, 1], values[:, 2], values[:, 3], alternative)
+        for scenario, nobs1 in zip(group, solved):
+            if np.isnan(nobs1):
+                fallback.append(scenario)
+            else:
+                _solved[scenario] = (float(nobs1), 'vectorized')
+
+    if fallback:
+        workers = workers or min(len(fallback), os.cpu_count() or 1)
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(statsmodels_nobs1, fallback))
+        else:
+            results = [statsmodels_nobs1(scenario) for scenario in fallback]
+        for scenario, nobs1 in zip(fallback, results):
+            _solved[scenario] = (nobs1, 'statsmodels')
+
+    nobs1 = np.array([_solved[scenario][0] for scenario in scenarios], dtype='float64')
+    return nobs1, [_solved[scenario][1] for scenario in scenarios]
+
+
+def sample_size_grid(effect_sizes, alphas=(alpha,), powers=(power,), tests=('ttest_ind',), comparisons=(1,),
+                     ratios=(1.0,), alternatives=('two-sided',), workers=None):
+    """
+    Calculates the required sample sizes of every combination of the design parameters.
+
+    Significance levels are Bonferroni-corrected for the number of comparisons.
+
+    Parameters:
+        effect_sizes (list): Standardized effect sizes (Cohen's d).
+        alphas (list): Family-wise significance levels.
+        powers (list): Target powers.
+        tests (list): Keys of TESTS.
+        comparisons (list): Numbers of tests the significance level is shared by.
+        ratios (list): Ratios of the second sample size to the first (two-sample tests only).
+        alternatives (list): 'two-sided', 'larger' or 'smaller'.
+        workers (int): Number of processes for scenarios solved by statsmodels.
+
+    Returns:
+        pd.DataFrame: One row per scenario with the fractional sample sizes,
+        the total whole number of observations and the solver used.
+    """
+    rows = []
+    for test, alternative, d, a, m, p, r in itertools.product(tests, alternatives, effect_sizes, alphas, comparisons,
+                                                              powers, ratios):
+        if test not in TESTS:
+            raise ValueError(f"Unknown test {test}; expected one of {', '.join(TESTS)}")
+        if TESTS[test]['samples'] == 1:
+            r = 0.0
+        rows.append((test, alternative, float(d), float(a), int(m), float(a) / int(m), float(p), float(r)))
+    grid = pd.DataFrame(rows, columns=GRID_COLUMNS[:8]).drop_duplicates(ignore_index=True)
+
+    scenarios = list(zip(grid['test'], grid['alternative'], grid['effect_size'], grid['corrected_alpha'], grid['power'],
+                         grid['ratio']))
+    grid['nobs1'], grid['solver'] = solve_scenarios(scenarios, workers=workers)
+    grid['nobs2'] = grid['nobs1'] * grid['ratio']
+    grid['total_nobs'] = np.ceil(grid['nobs1']) + np.ceil(grid['nobs2'])
+    return grid[GRID_COLUMNS]
+
+
+def power_curves(effect_sizes, nobs1, alpha=alpha, test='ttest_ind', ratio=1.0, alternative='two-sided',
+                 comparisons=1):
+    """
+    Calculates power against sample size for each effect size.
+
+    Returns:
+        pd.DataFrame: Power with one row per first sample size and one column per effect size.
+    """
+    nobs1 = np.asarray(nobs1, dtype='float64')
+    effect_sizes = np.asarray(effect_sizes, dtype='float64')
+    values = power_values(test, effect_sizes[np.newaxis, :], nobs1[:, np.newaxis], alpha / comparisons, ratio,
+                          alternative)
+    return pd.DataFrame(values, index=pd.Index(nobs1, name='nobs1'), columns=pd.Index(effect_sizes, name='effect_size'))
+
+
+def plot_power_curves(curves, path='Power_Curves.png', target=power):
+    """
+    Plots power curves with the target power marked and saves the figure.
+    """
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for column in curves.columns:
+        ax.plot(curves.index, curves[column], label=f"d = {column:g}")
+    ax.axhline(target, color='gray', linestyle='--', linewidth=1)
+    ax.set_xlabel('Sample size per group')
+    ax.set_ylabel('Power')
+    ax.set_title('Power of the Test by Sample Size and Effect Size')
+    ax.set_ylim(0, 1)
+    ax.legend(title='Effect size')
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def benchmark_grid(grid_kwargs, repeat=1):
+    """
+    Times solving a grid with the vectorized solver, from the memo, and with
+    one statsmodels solve_power call per scenario.
+
+    Returns:
+        dict: Seconds per solver, the number of scenarios, the largest
+        relative difference from statsmodels and the number of scenarios
+        whose statsmodels solution misses the target power.
+    """
+    clear_cache()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        clear_cache()
+        grid = sample_size_grid(workers=1, **grid_kwargs)
+    vectorized = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    sample_size_grid(workers=1, **grid_kwargs)
+    memoized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [statsmodels_nobs1(scenario) for scenario in
+                zip(grid['test'], grid['alternative'], grid['effect_size'], grid['corrected_alpha'], grid['power'],
+                    grid['ratio'])]
+    loop = time.perf_counter() - start
+
+    # statsmodels' root finder stops short in some tails; compare only where it reached the target power
+    expected = np.array(expected)
+    reached = np.zeros(len(grid), dtype=bool)
+    for (test, alternative), rows in grid.groupby(['test', 'alternative']).indices.items():
+        achieved = power_values(test, grid['effect_size'].to_numpy()[rows], expected[rows],
+                                grid['corrected_alpha'].to_numpy()[rows], grid['ratio'].to_numpy()[rows], alternative)
+        reached[rows] = np.abs(achieved - grid['power'].to_numpy()[rows]) < 1e-6
+    difference = np.abs(grid['nobs1'].to_numpy() - expected)[reached] / expected[reached]
+    return {
+        'scenarios': len(grid),
+        'seconds': {'vectorized': vectorized, 'memoized': memoized, 'statsmodels': loop},
+        'max_relative_difference': float(difference.max()) if len(difference) else 0.0,
+        'statsmodels_misses': int((~reached).sum()),
+    }
+
+
+# Grid timed by --benchmark and by dataset_benchmark.py --power
+BENCHMARK_GRID = {
+    'effect_sizes': list(np.round(np.arange(0.1, 1.01, 0.05), 2)),
+    'alphas': [0.1, 0.05, 0.01, 0.001],
+    'powers': [0.8, 0.9, 0.95],
+    'tests': list(TESTS),
+    'comparisons': [1, 5, 10],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Required sample sizes for a grid of study designs.')
+    parser.add_argument('--effect-size', type=float, nargs='+', default=[effect_size], help="Effect sizes (Cohen's d)")
+    parser.add_argument('--alpha', type=float, nargs='+', default=[alpha], help='Family-wise significance levels')
+    parser.add_argument('--power', type=float, nargs='+', default=[power], help='Target powers')
+    parser.add_argument('--test', nargs='+', default=['ttest_ind'], choices=list(TESTS), help='Test families')
+    parser.add_argument('--comparisons', type=int, nargs='+', default=[1],
+                        help='Numbers of comparisons for the Bonferroni correction')
+    parser.add_argument('--ratio', type=float, nargs='+', default=[1.0],
+                        help='Ratios of the second sample size to the first')
+    parser.add_argument('--alternative', nargs='+', default=['two-sided'], choices=ALTERNATIVES)
+    parser.add_argument('--output', help='CSV file for the sample size table')
+    parser.add_argument('--curves', help='Image file for the power curves of the effect sizes')
+    parser.add_argument('--workers', type=int, help='Number of processes for scenarios solved by statsmodels')
+    parser.add_argument('--benchmark', action='store_true', help='Time the grid solver against statsmodels')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        result = benchmark_grid(BENCHMARK_GRID)
+        print(f"{result['scenarios']} scenarios (max relative difference {result['max_relative_difference']:.1e}; "
+              f"statsmodels misses the target power in {result['statsmodels_misses']})")
+        for solver, seconds in result['seconds'].items():
+            print(f"  {solver:<12} {seconds:8.3f}s")
+        return
+
+    grid = sample_size_grid(args.effect_size, args.alpha, args.power, args.test, args.comparisons, args.ratio,
+                            args.alternative, workers=args.workers)
+    if len(grid) == 1:
+        print(f"Required sample size from power analysis: {grid['nobs1'].iloc[0]}")
+    else:
+        print(grid.to_string(index=False))
+    if args.output:
+        grid.to_csv(args.output, index=False)
+        print(f"Sample size table saved to {args.output}")
+    if args.curves:
+        largest = np.nanmax(grid['nobs1']) if grid['nobs1'].notna().any() else 100
+        curves = power_curves(args.effect_size, np.linspace(2, 1.2 * largest, 200), args.alpha[0], args.test[0],
+                              args.ratio[0], args.alternative[0], args.comparisons[0])
+        plot_power_curves(curves, args.curves, args.power[0])
+        print(f"Power curves saved to {args.curves}")
+
+if __name__=='__main__':
 
-# Calculate sample size
-sample_size = analysis.solve_power(effect_size=effect_size, alpha=alpha, power=power, alternative='two-sided')
-print(f"Required sample size from power analysis: {sample_size}")
\ No newline at end of file
+    main()
@@ -0,0 +1,81 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_transformation import clean_combined, copy_year, replace_nan_string
+
+def build_combined_df():
+    # Georgia layout: four descriptive columns followed by 29 count columns
+    georgia_counts = ['Georgia Count %d' % i for i in range(29)]
+    georgia = pd.DataFrame({
+        'Shelter Name': ['SHELTER A', 'SHELTER A', 'SHELTER B', 'Shared Shelter'],
+        'License Number': ['L1', 'L1', 'L2', 'L3'],
+        'Report Period Start': ['2021-09-01', '2022-09-01', '2023-01-01', '2022-02-01'],
+        'Report Period End': ['2021-09-30', '2022-09-30', '2023-01-31', '2022-02-28'],
+    })
+    for i, column in enumerate(georgia_counts):
+        georgia[column] = np.arange(4) + i
+    georgia['Shelter Name Annotation'] = [np.nan, 'R', np.nan, np.nan]
+
+    # Best Friends layout: eight descriptive columns followed by count columns
+    best_friends = pd.DataFrame({
+        'Shelter Name': ['The Haven', 'Shared Shelter', 'No Data Shelter'],
+        'EIN': ['63-1253853', 'nan', '11-1111111'],
+        'Organization Type': ['Rescue', 'Shelter', 'Rescue'],
+        'City': ['Fairhope', 'Atlanta', 'Austin'],
+        'State': ['AL', np.nan, 'TX'],
+        'Zip Code': [36532, 30301, 73301],
+        'County': ['Baldwin County', 'Fulton County', 'Travis County'],
+        'Data Year': [2023, 2022, 'No Data from 2023, 2022, or 2021'],
+        'Total Intake Gross': [403.0, 12.0, np.nan],
+        'Canine Total Intake Gross': [160.0, np.nan, np.nan],
+        'Feline Total Intake Gross': pd.Series([243.0, 'NaN', np.nan], dtype=object),
+    })
+
+    return pd.merge(georgia, best_friends, on='Shelter Name', how='outer').reset_index(drop=True)
+
+def legacy_clean(combined_df):
+    combined_df['Data Year'] = combined_df.apply(lambda row: copy_year(row['Report Period End'], row['Data Year']), axis=1)
+    combined_df['State'] = combined_df['State'].fillna('GA')
+    for columns in (combined_df.columns[4:35].tolist(), combined_df.columns[41:].tolist()):
+        for column in columns:
+            combined_df[column] = combined_df[column].apply(replace_nan_string)
+        combined_df[columns] = combined_df[columns].fillna(0)
+    return combined_df
+
+def test_clean_combined_matches_row_wise_functions():
+    expected = legacy_clean(build_combined_df())
+    result = clean_combined(build_combined_df())
+
+    # The position slices also zero-filled the annotation and EIN columns, which are not counts;
+    # those are now kept as they are
+    descriptive = ['Shelter Name Annotation', 'EIN']
+    pd.testing.assert_frame_equal(result.drop(columns=descriptive), expected.drop(columns=descriptive))
+    assert expected['Shelter Name Annotation'].tolist() == [0, 'R', 0, 0, 0, 0]
+    assert expected['EIN'].tolist() == [0, 0, 0, 0, '63-1253853', '11-1111111']
+    pd.testing.assert_frame_equal(result[descriptive], build_combined_df()[descriptive])
+
+def test_clean_combined_values():
+    result = clean_combined(build_combined_df())
+
+    # Georgia rows take their year from Report Period End
+    assert result.loc[result['Shelter Name'] == 'SHELTER B', 'Data Year'].tolist() == [2023]
+    assert result.loc[result['Shelter Name'] == 'No Data Shelter', 'Data Year'].tolist() == ['No Data from 2023, 2022, or 2021']
+
+    # Missing states default to Georgia
+    assert result.loc[result['Shelter Name'] == 'SHELTER A', 'State'].tolist() == ['GA', 'GA']
+
+    # String "NaN" and missing counts are zero-filled
+    assert result['Feline Total Intake Gross'].tolist() == [0, 0, 0, 0, 243.0, 0]
+    assert result['Shelter Name Annotation'].tolist().count('R') == 1
+
+def test_clean_combined_resolves_columns_by_name():
+    # An extra Georgia count column shifts every later column by one position
+    combined_df = build_combined_df()
+    combined_df.insert(5, 'Canine beginning count', [np.nan, 1.0, 2.0, 3.0, np.nan, np.nan])
+    result = clean_combined(combined_df)
+
+    assert result['Canine beginning count'].tolist() == [0, 1.0, 2.0, 3.0, 0, 0]
+    assert result['Feline Total Intake Gross'].tolist() == [0, 0, 0, 0, 243.0, 0]
+    # Descriptive columns are not zero-filled
+    assert result['Shelter Name Annotation'].tolist().count(0) == 0
+    pd.testing.assert_series_equal(result['EIN'], build_combined_df()['EIN'])
@@ -0,0 +1,116 @@
+import functools
+import http.server
+import threading
+import time
+import pytest
+import pandas as pd
+from dataset_adapters import BestFriendsAdapter, GeorgiaExportAdapter, load_sources, make_adapter
+from dataset_cache import close_connections, http_request
+from dataset_transformation import coerce_georgia_types, parse_georgia_headers
+
+HEADERS = ['Shelter Name', 'License Number', 'Report Period Start', 'Report Period End',
+           'Canine stray at large', 'Feline stray at large']
+
+def report_rows(n_rows=4):
+    return [['SHELTER %d' % (i % 2), 'L%d' % (i % 2), '2022-%02d-01' % (i + 1), '2022-%02d-28' % (i + 1), i, 2 * i]
+            for i in range(n_rows)]
+
+def write_state_export(path, title_rows=3):
+    # The state's layout: a title block and an empty first column
+    rows = [[None, 'Shelter Report Data Export'] + [None] * 5 for _ in range(title_rows)]
+    rows.append([None] + HEADERS)
+    rows += [[None] + row for row in report_rows()]
+    pd.DataFrame(rows).to_excel(path, header=False, index=False)
+    return str(path)
+
+@pytest.fixture
+def http_sources(tmp_path):
+    names = ['region_%d' % i for i in range(4)]
+    for name in names:
+        write_state_export(tmp_path / f'{name}.xlsx')
+
+    connections = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            connections.append(self.client_address)
+            super().setup()
+
+        def do_GET(self):
+            time.sleep(0.5)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(tmp_path)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield {name: GeorgiaExportAdapter(name, f"{base}/{name}.xlsx") for name in names}, connections
+    server.shutdown()
+    server.server_close()
+
+def test_state_export_parses_as_before(tmp_path):
+    path = write_state_export(tmp_path / 'georgia.xlsx')
+    df = make_adapter('georgia', path).load()
+    expected = coerce_georgia_types(parse_georgia_headers(pd.read_excel(path)))
+    pd.testing.assert_frame_equal(df, expected)
+
+def test_header_detection_and_column_mapping(tmp_path):
+    # A regional export: more title rows, no empty first column and its own names
+    renamed = ['Facility'] + HEADERS[1:4] + ['Dogs stray', 'Cats stray']
+    rows = [['Regional Report'] + [None] * 5] * 5 + [renamed] + report_rows()
+    path = tmp_path / 'regional.xlsx'
+    pd.DataFrame(rows).to_excel(path, header=False, index=False)
+
+    adapter = GeorgiaExportAdapter('regional', str(path), columns={
+        'Facility': 'Shelter Name', 'Dogs stray': 'Canine stray at large', 'Cats stray': 'Feline stray at large'})
+    raw = adapter.fetch()
+    assert adapter.detect_header(raw) == 4
+    df = adapter.load()
+    assert df.columns.tolist() == HEADERS
+    assert df['Canine stray at large'].tolist() == [0, 1, 2, 3]
+
+    # Without the mapping there is no Shelter Name header
+    with pytest.raises(ValueError, match='No header row'):
+        GeorgiaExportAdapter('regional', str(path)).load()
+
+def test_header_on_the_first_row(tmp_path):
+    path = tmp_path / 'best_friends.xlsx'
+    df = pd.DataFrame({'Shelter Name': ['The Haven'], 'EIN': ['63-1253853'], 'Organization Type': ['Rescue'],
+                       'City': ['Fairhope'], 'State': ['AL'], 'Zip Code': [36532], 'County': ['Baldwin County'],
+                       'Data Year': [2023], 'Total Intake Gross': [403.0]})
+    df.to_excel(path, index=False)
+    adapter = make_adapter('best_friends', str(path))
+    assert isinstance(adapter, BestFriendsAdapter)
+    pd.testing.assert_frame_equal(adapter.load(), pd.read_excel(path))
+
+    with pytest.raises(ValueError, match='No adapter'):
+        make_adapter('regional', str(path))
+
+def test_sources_load_concurrently(http_sources, tmp_path):
+    adapters, connections = http_sources
+    start = time.perf_counter()
+    frames = load_sources(adapters, cache_dir=str(tmp_path / 'cache'), workers=4)
+    elapsed = time.perf_counter() - start
+
+    # Four downloads of half a second each overlap
+    assert elapsed < 1.5
+    for df in frames.values():
+        assert df['Shelter Name'].tolist() == ['SHELTER 0', 'SHELTER 1'] * 2
+    # Each source checks for changes and downloads over one connection
+    assert len(connections) == 4
+
+def test_requests_reuse_connections(http_sources):
+    adapters, connections = http_sources
+    try:
+        for adapter in adapters.values():
+            headers, _ = http_request(adapter.location, method='HEAD')
+            _, body = http_request(adapter.location)
+            assert len(body) == int(headers['Content-Length'])
+    finally:
+        close_connections()
+    assert len(connections) == 1
@@ -0,0 +1,44 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_aggregation import build_cube, load_cube, save_cube, slice_cube, totals_by
+
+@pytest.fixture
+def combined_df():
+    return pd.DataFrame({
+        'Shelter Name': ['A', 'A', 'A', 'B', 'B', 'C', 'C'],
+        'State': ['GA', 'GA', 'GA', 'TX', 'TX', 'TX', 'TX'],
+        'Data Year': [2021, 2021, 2022, 2023, 'No Data from 2023, 2022, or 2021', 2020, 2022],
+        'Shelter Name Annotation': [0, 0, 'R', 0, 0, 0, 0],
+        'Canine stray at large': [1, 2, 3, 4, 5, 6, 7],
+        'Feline stray at large': [10.0, np.nan, 30.0, 40.0, 50.0, 60.0, 70.0],
+    })
+
+def test_cube_slices_match_direct_groupby(combined_df):
+    measures = ['Canine stray at large', 'Feline stray at large']
+    cube = build_cube(combined_df, measures)
+
+    # Shelter A's two 2021 rows collapse into one cube row
+    assert len(cube) == 6
+
+    df_filtered = combined_df[pd.to_numeric(combined_df['Data Year'], errors='coerce').between(2021, 2023)]
+    df_filtered = df_filtered[df_filtered['Shelter Name Annotation'] != 'R']
+    expected = df_filtered.groupby('State')[measures].sum().sum(axis=1)
+
+    result = totals_by(slice_cube(cube, years=(2021, 2023)), 'State', measures)
+    pd.testing.assert_series_equal(result, expected)
+    assert result.to_dict() == {'GA': 13.0, 'TX': 121.0}
+
+def test_slice_cube_filters(combined_df):
+    cube = build_cube(combined_df, ['Canine stray at large'])
+
+    # Duplicates and rows without a numeric year are kept on request
+    assert slice_cube(cube, include_duplicates=True)['Canine stray at large'].sum() == 28
+    assert slice_cube(cube)['Canine stray at large'].sum() == 25
+    assert slice_cube(cube, years=(2022, 2022), states=['TX'])['Shelter Name'].tolist() == ['C']
+
+def test_save_and_load_cube(combined_df, tmp_path):
+    cube = build_cube(combined_df, ['Canine stray at large', 'Feline stray at large'])
+    path = save_cube(cube, str(tmp_path / 'aggregates' / 'cube.parquet'))
+
+    pd.testing.assert_frame_equal(load_cube(path), cube)
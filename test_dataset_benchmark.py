@@ -0,0 +1,55 @@
+import pytest
+import pandas as pd
+from dataset_benchmark import (BEST_FRIENDS_COLUMNS, append_history, find_regressions, read_history, run_benchmark,
+                               run_import_benchmark, synthetic_annotations, synthetic_best_friends, synthetic_georgia)
+from dataset_transformation import coerce_georgia_types, parse_georgia_headers
+
+def test_synthetic_data_has_the_real_layout():
+    sheet = synthetic_georgia(100)
+    georgia = coerce_georgia_types(parse_georgia_headers(sheet))
+
+    # Four descriptive columns followed by 29 count columns
+    assert georgia.shape == (100, 33)
+    assert (georgia.dtypes.iloc[4:] == 'int64').all()
+    assert georgia['Shelter Name'].nunique() == 3
+
+    annotations = synthetic_annotations(sheet)
+    assert annotations['Shelter Name'].tolist() == georgia['Shelter Name'].tolist()
+    assert set(annotations['Shelter Name Annotation'].dropna()) <= {'R'}
+
+    best_friends = synthetic_best_friends(50, 100)
+    assert best_friends.columns.tolist() == BEST_FRIENDS_COLUMNS
+    assert len(best_friends) == 50
+    assert 'DEKALB COUNTY ANIMAL SERVICES' in set(best_friends['Shelter Name'])
+
+def test_run_benchmark_times_each_phase():
+    run = run_benchmark(200, workbook_rows=200, render=False)
+
+    assert list(run['phases']) == ['load', 'header_parse', 'coercion', 'merge', 'cleaning', 'compact', 'outliers',
+                                   'aggregation']
+    assert all(seconds > 0 for seconds in run['phases'].values())
+    assert run['rows'] == 200 and run['best_friends_rows'] == 104
+
+    # Larger sizes skip writing a workbook
+    assert run_benchmark(300, workbook_rows=200, render=False)['phases']['load'] is None
+
+def test_history_and_regressions(tmp_path):
+    path = str(tmp_path / 'benchmarks' / 'history.json')
+    first = {'rows': 100, 'phases': {'merge': 1.0, 'cleaning': 1.0, 'load': None}}
+    second = {'rows': 100, 'phases': {'merge': 1.1, 'cleaning': 2.0, 'load': None}}
+    other_size = {'rows': 1000, 'phases': {'merge': 9.0, 'cleaning': 9.0, 'load': None}}
+
+    append_history(first, path)
+    append_history(other_size, path)
+    history = append_history(second, path)
+    assert len(read_history(path)) == 3
+
+    assert find_regressions(second, history, threshold=1.25) == [('cleaning', 1.0, 2.0)]
+    assert find_regressions(first, [first]) == []
+
+def test_data_path_does_not_import_plotting_libraries():
+    run = run_import_benchmark(repeat=1)
+
+    assert run['loads_matplotlib'] == {'dataset_transformation': False, 'dataset_pipeline': False,
+                                       'dataset_transformation+plotting': True}
+    assert run['phases']['dataset_transformation'] < run['phases']['dataset_transformation+plotting']
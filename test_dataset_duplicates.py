@@ -0,0 +1,164 @@
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_duplicates import (annotate_duplicates, annotations_workbook, compare_annotations, detect_duplicates,
+                                duplicate_annotations, first_rows, main, name_fingerprint)
+from dataset_aggregation import build_cube
+from dataset_benchmark import REPORTS_PER_SHELTER, synthetic_annotations, synthetic_best_friends, synthetic_georgia
+from dataset_identity import join_annotations, join_best_friends, update_shelter_index
+from dataset_ingest import INGEST_DIR
+from dataset_refresh import refresh
+from dataset_schema import GEORGIA_INTAKE_COLUMNS, GEORGIA_OUTCOME_COLUMNS
+from dataset_stream import iter_georgia_chunks, scan_stream, stream_cube
+from dataset_transformation import (clean_combined, coerce_georgia_types, cube_measures, fix_data_entry_mistakes,
+                                    parse_georgia_headers)
+
+def reports(rows):
+    """
+    Builds Georgia reports from (name, license, month, stray dogs, adopted dogs, adopted cats) tuples.
+    """
+    df = pd.DataFrame(rows, columns=['Shelter Name', 'License Number', 'Month', 'Canine stray at large',
+                                     'Canine adoption', 'Feline adoption'])
+    df.insert(2, 'Report Period Start', pd.to_datetime('2022-' + df['Month'].astype(str) + '-01'))
+    df.insert(3, 'Report Period End', df['Report Period Start'] + pd.offsets.MonthEnd(0))
+    return df.drop(columns='Month')
+
+@pytest.fixture
+def georgia():
+    return reports([
+        ('ATHENS CLARKE CO ANIMAL CONTROL', 'L-100', 1, 10, 5, 2),
+        ('ATHENS CLARKE CO ANIMAL CONTROL', 'L-100', 2, 12, 6, 2),
+        # The same shelter and month spelled differently
+        ('Athens-Clarke County Animal Control', 'L-100', 1, 11, 5, 2),
+        # Same license under another name
+        ('CLARKE SHELTER', 'L-100', 2, 3, 1, 1),
+        # The counts of another shelter's report of the same month
+        ('MACON ANIMAL SERVICES', 'L-200', 1, 10, 5, 2),
+        # Reports with few counts and no license are not compared
+        ('SMALL SHELTER A', 'N/A', 1, 1, 0, 0),
+        ('SMALL SHELTER B', 'N/A', 1, 1, 0, 0),
+        ('MACON ANIMAL SERVICES', 'L-200', 3, 10, 5, 2),
+    ])
+
+def test_name_fingerprint():
+    assert name_fingerprint('ATHENS CLARKE CO ANIMAL CONTROL') == name_fingerprint('Athens-Clarke County Animal Control')
+    assert name_fingerprint('The Humane Soc. of Macon') == name_fingerprint('MACON HUMANE SOCIETY')
+    assert name_fingerprint('MACON ANIMAL SERVICES') != name_fingerprint('MACON ANIMAL CONTROL')
+    assert name_fingerprint(np.nan) is None
+
+def test_first_rows():
+    assert first_rows(np.array([2, -1, 0, 2, 0, 1, -1, 1])).tolist() == [0, -1, 2, 0, 2, 5, -1, 5]
+    assert first_rows(np.array([-1, -1])).tolist() == [-1, -1]
+    codes = np.random.default_rng(0).integers(-1, 50, 10000)
+    expected = pd.Series(np.arange(len(codes))).groupby(codes).transform('min').where(codes >= 0, -1)
+    assert first_rows(codes).tolist() == expected.tolist()
+
+def test_detect_duplicates(georgia):
+    report = detect_duplicates(georgia)
+    assert report.to_dict('list') == {'Row': [2, 3, 4], 'Duplicate Of': [0, 1, 0], 'Reason': ['name', 'license', 'counts']}
+
+    # Reports are only compared within a state and period, and never without a period
+    blocked = georgia.assign(State=['GA', 'GA', 'TX', 'GA', 'GA', 'GA', 'GA', 'GA'])
+    assert detect_duplicates(blocked)['Row'].tolist() == [3, 4]
+    georgia.loc[2, 'Report Period Start'] = pd.NaT
+    assert 2 not in detect_duplicates(georgia)['Row'].tolist()
+
+def test_annotate_duplicates_modes(georgia):
+    assert annotate_duplicates(georgia, 'manual') == (georgia, None)
+    annotated, report = annotate_duplicates(georgia, 'auto')
+    assert annotated['Shelter Name Annotation'].eq('R').tolist() == [False, False, True, True, True, False, False, False]
+
+    manual = georgia.assign(**{'Shelter Name Annotation': [np.nan] * 7 + ['R']})
+    annotated, _ = annotate_duplicates(manual, 'both')
+    assert annotated['Shelter Name Annotation'].eq('R').tolist() == [False, False, True, True, True, False, False, True]
+    assert compare_annotations(duplicate_annotations(georgia, report), manual['Shelter Name Annotation']) == {
+        'both': 0, 'detected_only': 3, 'manual_only': 1, 'recall': 0.0}
+
+    with pytest.raises(ValueError, match='Unknown duplicate mode'):
+        annotate_duplicates(georgia, 'fuzzy')
+
+def test_workbook_joins_back_as_the_detected_annotations(georgia):
+    report = detect_duplicates(georgia)
+    workbook = annotations_workbook(georgia, report)
+    assert workbook.columns.tolist() == ['Unnamed: 0', 'Shelter Name', 'Shelter Name Annotation']
+
+    index = {}
+    update_shelter_index(index, georgia['Shelter Name'])
+    joined, join_report = join_annotations(georgia, workbook, index)
+    assert join_report['matched_rows'] == len(georgia)
+    pd.testing.assert_series_equal(joined['Shelter Name Annotation'], duplicate_annotations(georgia, report))
+
+def test_scales_by_blocking():
+    rng = np.random.default_rng(0)
+    rows = 100000
+    names = np.array([f'SHELTER {i}' for i in range(2000)])
+    georgia = pd.DataFrame({
+        'Shelter Name': names[np.arange(rows) % 2000],
+        'License Number': [f'L-{i % 2000 + 1}' for i in range(rows)],
+        'Report Period Start': pd.to_datetime('2000-01-01') + pd.to_timedelta(np.arange(rows) // 2000 * 31, unit='D'),
+    })
+    georgia['Report Period End'] = georgia['Report Period Start'] + pd.Timedelta(days=30)
+    # Counts unique to each report, so only the copies match
+    for column in ['Canine stray at large', 'Canine adoption', 'Feline adoption']:
+        georgia[column] = rng.permutation(rows) + 1
+    copies = georgia.sample(500, random_state=0).assign(**{'Shelter Name': lambda df: df['Shelter Name'].str.lower()})
+    report = detect_duplicates(pd.concat([georgia, copies], ignore_index=True))
+    assert sorted(report['Row']) == list(range(rows, rows + 500))
+    assert (report['Reason'] == 'name').all()
+
+def test_cli_leaves_the_ingested_sources_alone(georgia, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    georgia.to_excel('export.xlsx', index=False)
+    monkeypatch.setattr('sys.argv', ['dataset_duplicates.py', '--georgia', 'export.xlsx', '--annotations', '',
+                                     '--output', 'detected.xlsx'])
+    main()
+    assert capsys.readouterr().out.startswith('3 duplicate reports of 8 found')
+    assert pd.read_excel('detected.xlsx')['Shelter Name Annotation'].eq('R').sum() == 3
+    assert not os.path.exists(INGEST_DIR)
+
+@pytest.mark.parametrize('mode', ['auto', 'both'])
+def test_batch_refresh_and_stream_annotate_alike(mode, tmp_path):
+    sheet = synthetic_georgia(10 * REPORTS_PER_SHELTER)
+    annotations = synthetic_annotations(sheet)
+    best_friends = synthetic_best_friends(200, len(sheet))
+    georgia = coerce_georgia_types(parse_georgia_headers(sheet))
+    # Steady counts, so the refresh replaces the same outliers as a full build
+    counts = GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS
+    georgia[counts] = np.random.default_rng(1).integers(20, 25, (len(georgia), len(counts)))
+    # Duplicates of the last month: respelled names, and a shelter's counts under a new name
+    latest = georgia[georgia['Report Period Start'] == georgia['Report Period Start'].max()]
+    respelled = latest.iloc[:3].assign(**{'Shelter Name': lambda df: df['Shelter Name'].str.lower()})
+    copied = latest.iloc[[4]].assign(**{'Shelter Name': 'Second Chance Rescue'})
+    georgia = pd.concat([georgia, respelled, copied], ignore_index=True)
+    measures = [column for column in cube_measures if column in georgia.columns or column in best_friends.columns]
+
+    # Batch: the whole export, as annotate_georgia and merge_sources process it
+    index = {}
+    for frame in [georgia, annotations, best_friends]:
+        update_shelter_index(index, frame['Shelter Name'])
+    annotated, _ = join_annotations(georgia, annotations, index)
+    annotated, report = annotate_duplicates(annotated, mode)
+    assert set(range(len(georgia) - 4, len(georgia))) <= set(report['Row'])
+    combined, _ = join_best_friends(annotated, best_friends, index)
+    expected = build_cube(fix_data_entry_mistakes(clean_combined(combined), str(tmp_path / 'audit.csv')), measures)
+
+    # Refresh: the export without its last month, then with it
+    def run(georgia):
+        directory = tmp_path / 'refresh'
+        return refresh(georgia, annotations, best_friends, {}, state_dir=str(directory),
+                       cube_path=str(directory / 'cube.parquet'), audit_path=str(directory / 'audit.csv'),
+                       measures=measures, ranking_path=str(directory / 'ranking.pkl'),
+                       combined_path=str(directory / 'combined'), duplicates=mode)
+    run(georgia[georgia['Report Period Start'] < latest['Report Period Start'].max()])
+    refreshed, summary = run(georgia)
+    assert summary['mode'] == 'incremental'
+    pd.testing.assert_frame_equal(refreshed, expected)
+
+    # Stream: chunks smaller than a month of reports
+    path = str(tmp_path / 'georgia.parquet')
+    georgia.to_parquet(path)
+    model, detected = scan_stream(iter_georgia_chunks(path, 7), mode)
+    streamed, _ = stream_cube(iter_georgia_chunks(path, 7), annotations, best_friends, {}, measures=measures,
+                              model=model, detected=detected, duplicates=mode)
+    pd.testing.assert_frame_equal(streamed, expected)
@@ -0,0 +1,96 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_forecast import SPECIES, build_series, fit_series, forecast_series, month_numbers, run_forecast
+from dataset_partitions import save_combined
+
+def seasonal_reports(make_combined, shelters=3, months=36, seed=0):
+    # Monthly reports of every shelter with a yearly season in their intake
+    df = make_combined(shelters=shelters, months=months, measures=[], seed=seed)
+    rng = np.random.default_rng(seed)
+    season = 20 + 10 * np.sin(np.arange(len(df)) * 2 * np.pi / 12)
+    for columns in SPECIES.values():
+        for column in columns:
+            df[column] = rng.poisson(season / len(columns))
+    return df
+
+def test_build_series(make_combined):
+    df = seasonal_reports(make_combined, shelters=2, months=3)
+    # A duplicate annotated 'R' and a second report in the same month
+    df = pd.concat([df, df.iloc[[0]].assign(**{'Shelter Name Annotation': 'R'}), df.iloc[[1]]], ignore_index=True)
+    series = build_series(df)
+
+    assert len(series) == 2 * 3 * 2
+    canine = series[(series['Shelter Name'] == 'SHELTER 00') & (series['Species'] == 'Canine')]
+    expected = df.iloc[:3][SPECIES['Canine']].sum(axis=1).to_numpy(dtype=float)
+    expected[1] *= 2
+    np.testing.assert_allclose(canine['Intake'], expected)
+    assert canine['Month'].tolist() == list(pd.date_range('2020-01-01', periods=3, freq='MS'))
+
+def test_fit_series_models():
+    numbers = month_numbers(pd.date_range('2020-01-01', periods=36, freq='MS'))
+    values = 20 + 10 * np.sin(np.arange(36) * 2 * np.pi / 12)
+
+    for model in ['ets', 'arima']:
+        result = fit_series(numbers, values, model=model, horizon=12)
+        assert result['model'] == model
+        assert result['start'] == numbers[-1] + 1
+        np.testing.assert_allclose(result['forecast'], values[:12], atol=2)
+
+    result = fit_series(numbers, values, model='seasonal_naive', horizon=14)
+    np.testing.assert_allclose(result['forecast'], np.resize(values[-12:], 14))
+
+    # Short and flat series repeat their last value; forecasts are never negative
+    assert fit_series(numbers[:3], np.array([5.0, 3.0, 4.0]))['model'] == 'seasonal_naive'
+    assert fit_series(numbers[:3], np.array([5.0, 3.0, 4.0]))['forecast'].tolist() == [4.0] * 12
+    assert fit_series(numbers, np.zeros(36))['model'] == 'seasonal_naive'
+    assert (fit_series(numbers, np.linspace(50, 0, 36), horizon=24)['forecast'] >= 0).all()
+
+    # A month without a report is interpolated
+    gap = fit_series(np.delete(numbers, 30), np.delete(values, 30), model='seasonal_naive')
+    np.testing.assert_allclose(gap['forecast'][6], (values[29] + values[31]) / 2)
+
+def test_only_changed_series_are_refitted(make_combined):
+    series = build_series(seasonal_reports(make_combined, months=30))
+    forecasts, cache, summary = forecast_series(series, workers=1)
+    assert summary['fitted'] == 6 and summary['cached'] == 0
+    assert len(forecasts) == 6 * 12
+    assert forecasts['Month'].min() == pd.Timestamp('2022-07-01')
+
+    again, cache, summary = forecast_series(series, cache=cache, workers=1)
+    assert summary['fitted'] == 0 and summary['cached'] == 6
+    pd.testing.assert_frame_equal(again, forecasts)
+
+    # A new month for one shelter refits its two series
+    longer = build_series(seasonal_reports(make_combined, months=31))
+    longer = pd.concat([longer[(longer['Shelter Name'] == 'SHELTER 01')],
+                        series[series['Shelter Name'] != 'SHELTER 01']]).sort_values(['Shelter Name', 'Species', 'Month'])
+    updated, _, summary = forecast_series(longer, cache=cache, workers=1)
+    assert summary['fitted'] == 2 and summary['cached'] == 4
+    changed = updated['Shelter Name'] == 'SHELTER 01'
+    assert updated.loc[changed, 'Month'].min() == pd.Timestamp('2022-08-01')
+    pd.testing.assert_frame_equal(updated[~changed].reset_index(drop=True), forecasts[forecasts['Shelter Name'] != 'SHELTER 01'].reset_index(drop=True))
+
+    # A different model or horizon is a different fit
+    _, _, summary = forecast_series(series, model='seasonal_naive', cache=cache, workers=1)
+    assert summary['fitted'] == 6
+
+    with pytest.raises(ValueError, match='Unknown model'):
+        forecast_series(series, model='prophet')
+
+def test_worker_processes_match_one_process(make_combined, tmp_path):
+    source = save_combined(seasonal_reports(make_combined, shelters=4), str(tmp_path / 'combined'))
+    output, cache_path = str(tmp_path / 'forecast.csv'), str(tmp_path / 'models.pkl')
+    series = build_series(seasonal_reports(make_combined, shelters=4))
+
+    expected, _, _ = forecast_series(series, workers=1)
+    forecasts, _, summary = forecast_series(series, workers=2, batch_size=3)
+    assert summary['workers'] == 2
+    pd.testing.assert_frame_equal(forecasts, expected)
+
+    forecasts, summary = run_forecast(source=source, workers=2, output=output, cache_path=cache_path)
+    pd.testing.assert_frame_equal(forecasts, expected)
+    assert summary['fitted'] == 8
+    saved = pd.read_csv(output, parse_dates=['Month'])
+    pd.testing.assert_frame_equal(saved, expected)
+    assert run_forecast(source=source, output=output, cache_path=cache_path)[1]['cached'] == 8
@@ -0,0 +1,88 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_identity import (MISSING_ID, join_annotations, join_best_friends, load_shelter_index, normalize_name,
+                              save_shelter_index, shelter_ids, update_shelter_index)
+
+@pytest.fixture
+def georgia():
+    return pd.DataFrame({
+        'Shelter Name': ['SHELTER A', 'SHELTER B', 'SHELTER A', 'Douglas/Coffee County', 'SHELTER A'],
+        'Report Period Start': ['2021-01-01', '2021-01-01', '2021-02-01', '2021-01-01', '2021-03-01'],
+        'Canine stray at large': [1, 2, 3, 4, 5],
+    })
+
+@pytest.fixture
+def annotations():
+    return pd.DataFrame({
+        'Shelter Name': ['SHELTER A', 'SHELTER B', 'SHELTER A', 'Douglas/Coffee County', 'SHELTER A'],
+        'Shelter Name Annotation': [np.nan, np.nan, 'R', np.nan, 'R'],
+    })
+
+@pytest.fixture
+def best_friends():
+    return pd.DataFrame({
+        'Shelter Name': ['Shelter B', 'Douglas-Coffee County', 'Douglas-Coffee County', 'The Haven'],
+        'State': ['GA', 'GA', 'GA', 'AL'],
+        'Data Year': [2021, 2021, 2022, 2023],
+    })
+
+@pytest.fixture
+def index(georgia, annotations, best_friends):
+    index = {}
+    for frame in [georgia, annotations, best_friends]:
+        update_shelter_index(index, frame['Shelter Name'])
+    return index
+
+def test_normalize_name():
+    assert normalize_name('  Douglas/Coffee  County ') == 'DOUGLAS COFFEE COUNTY'
+    assert normalize_name('City Of Madison Animal Shelter') == normalize_name('City of Madison Animal Shelter')
+    assert normalize_name(np.nan) is None
+    assert normalize_name(' - ') is None
+
+def test_shelter_index_is_stable(index, tmp_path):
+    assert index == {'DOUGLAS COFFEE COUNTY': 0, 'SHELTER A': 1, 'SHELTER B': 2, 'THE HAVEN': 3}
+
+    # New shelters get new IDs; existing IDs never change
+    assert update_shelter_index(index, pd.Series(['Animal Rescue', 'shelter a'])) == 1
+    assert index['ANIMAL RESCUE'] == 4 and index['SHELTER A'] == 1
+
+    path = str(tmp_path / 'ingested' / 'shelter_index.json')
+    save_shelter_index(index, path)
+    assert load_shelter_index(path) == index
+
+    assert shelter_ids(pd.Series(['Shelter A', None]), index).tolist() == [1, MISSING_ID]
+    with pytest.raises(KeyError):
+        shelter_ids(pd.Series(['Unknown Shelter']), index)
+
+def test_join_annotations_does_not_depend_on_row_order(georgia, annotations, index):
+    annotated, report = join_annotations(georgia, annotations, index)
+    assert annotated['Shelter Name Annotation'].fillna('').tolist() == ['', '', 'R', '', 'R']
+    assert report['matched_rows'] == 5
+
+    # Reordering shelters keeps each report's annotation
+    shuffled = georgia.iloc[[3, 1, 0, 2, 4]].reset_index(drop=True)
+    reannotated, _ = join_annotations(shuffled, annotations, index)
+    pd.testing.assert_frame_equal(reannotated, annotated.iloc[[3, 1, 0, 2, 4]].reset_index(drop=True))
+
+    # Chunks carry the per-shelter row counts forward
+    offsets = {}
+    chunks = [join_annotations(georgia.iloc[i:i + 2], annotations, index, offsets=offsets)[0] for i in range(0, 5, 2)]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), annotated)
+
+def test_join_best_friends_matches_normalized_names(georgia, best_friends, index):
+    combined, report = join_best_friends(georgia, best_friends, index)
+
+    # The columns are laid out as pd.merge on 'Shelter Name' lays them out
+    expected_columns = pd.merge(georgia, best_friends, on='Shelter Name', how='outer').columns
+    assert combined.columns.tolist() == expected_columns.tolist()
+
+    assert len(combined) == 7
+    assert combined.loc[combined['Shelter Name'] == 'Douglas/Coffee County', 'Data Year'].tolist() == [2021, 2022]
+    assert combined.loc[combined['Shelter Name'] == 'The Haven', 'State'].tolist() == ['AL']
+
+    assert report['matched_shelters'] == 2
+    assert report['many_to_many_shelters'] == 0
+    assert report['output_rows'] == 7
+    assert report['unmatched_left'] == ['SHELTER A']
+    assert report['unmatched_right'] == ['The Haven']
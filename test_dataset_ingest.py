@@ -0,0 +1,116 @@
+import functools
+import http.server
+import threading
+import pytest
+import pandas as pd
+import numpy as np
+from unittest.mock import patch
+from dataset_cache import close_connections
+import pyarrow as pa
+from dataset_ingest import declare_schema, ingest_sources, read_manifest
+
+def write_georgia_workbook(path, n_rows=6):
+    # Mirrors the state export: a title block, the header on the fourth row and an empty first column
+    headers = ['Shelter Name', 'License Number', 'Report Period Start', 'Report Period End',
+               'Canine stray at large', 'Feline stray at large']
+    rows = [[None, 'Shelter Report Data Export'] + [None] * 5,
+            [None, 'Exported October 2024'] + [None] * 5,
+            [None, 'All Shelters'] + [None] * 5,
+            [None] + headers + [None]]
+    for i in range(n_rows):
+        rows.append([None, 'SHELTER %d' % (i % 2), 'L%d' % (i % 2), '2022-%02d-01' % (i + 1), '2022-%02d-28' % (i + 1), i, 2 * i, None])
+    pd.DataFrame(rows).to_excel(path, header=False, index=False)
+
+@pytest.fixture
+def sources(tmp_path):
+    georgia = tmp_path / 'georgia.xlsx'
+    write_georgia_workbook(georgia)
+
+    best_friends = tmp_path / 'best_friends.xlsx'
+    pd.DataFrame({
+        'Shelter Name': ['The Haven', 'Other'], 'EIN': ['63-1253853', '11-1111111'],
+        'Organization Type': ['Rescue', 'Shelter'], 'City': ['Fairhope', 'Austin'],
+        'State': ['AL', 'TX'], 'Zip Code': [36532, 73301], 'County': ['Baldwin County', 'Travis County'],
+        'Data Year': [2023, 'No Data from 2023, 2022, or 2021'], 'Total Intake Gross': [403.0, np.nan],
+    }).to_excel(best_friends, index=False)
+
+    return {'georgia': str(georgia), 'best_friends': str(best_friends)}
+
+def test_ingest_sources_types(sources, tmp_path):
+    frames = ingest_sources(sources, output_dir=str(tmp_path / 'ingested'))
+
+    georgia = frames['georgia']
+    assert georgia.columns.tolist() == ['Shelter Name', 'License Number', 'Report Period Start', 'Report Period End',
+                                        'Canine stray at large', 'Feline stray at large']
+    assert str(georgia['Canine stray at large'].dtype) == 'int64'
+    assert str(georgia['Report Period End'].dtype) == 'datetime64[ns]'
+
+    # Best Friends data reads back exactly as the workbook
+    pd.testing.assert_frame_equal(frames['best_friends'], pd.read_excel(sources['best_friends']))
+
+def test_georgia_columns_are_typed_by_name():
+    # A count moved before the descriptive columns, and an export without License Number
+    df = pd.DataFrame(columns=['Canine stray at large', 'Shelter Name', 'License Number', 'Report Period Start',
+                               'Report Period End', 'Feline stray at large'])
+    schema = declare_schema('georgia', df)
+    assert [str(field.type) for field in schema] == ['int64', 'string', 'string', 'timestamp[ns]', 'timestamp[ns]',
+                                                     'int64']
+    schema = declare_schema('georgia', df.drop(columns=['License Number']))
+    assert schema.field('Report Period End').type == pa.timestamp('ns')
+    assert schema.field('Feline stray at large').type == pa.int64()
+
+def test_ingest_sources_converts_once(sources, tmp_path):
+    output_dir = str(tmp_path / 'ingested')
+    ingest_sources(sources, output_dir=output_dir)
+
+    with patch('pandas.read_excel') as mock_read_excel:
+        frames = ingest_sources(sources, output_dir=output_dir)
+    mock_read_excel.assert_not_called()
+    assert len(frames['georgia']) == 6
+
+    # A changed workbook is converted again
+    write_georgia_workbook(sources['georgia'], n_rows=8)
+    previous_hash = read_manifest(output_dir)['georgia']['source_hash']
+    assert len(ingest_sources(sources, output_dir=output_dir)['georgia']) == 8
+    assert read_manifest(output_dir)['georgia']['source_hash'] != previous_hash
+
+def test_remote_source_without_validators_is_hashed(sources, tmp_path):
+    downloads = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            downloads.append(self.path)
+            super().do_GET()
+
+        def send_header(self, keyword, value):
+            # A server that sends neither ETag nor Last-Modified
+            if keyword != 'Last-Modified':
+                super().send_header(keyword, value)
+
+        def log_message(self, *args):
+            pass
+
+    georgia = sources['georgia']
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(tmp_path)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/georgia.xlsx"
+        output_dir = str(tmp_path / 'ingested')
+        assert len(ingest_sources({'georgia': url}, output_dir=output_dir)['georgia']) == 6
+        assert read_manifest(output_dir)['georgia']['source_hash'].startswith('sha256:')
+        # The bytes downloaded to hash the workbook are the ones parsed
+        assert len(downloads) == 1
+
+        # The grown export is converted again, also through the cache
+        write_georgia_workbook(georgia, n_rows=8)
+        frames = ingest_sources({'georgia': url}, output_dir=output_dir, cache_dir=str(tmp_path / 'cache'))
+        assert len(frames['georgia']) == 8
+        assert len(downloads) == 2
+
+        # Offline, the existing file is reused
+        write_georgia_workbook(georgia, n_rows=4)
+        assert len(ingest_sources({'georgia': url}, output_dir=output_dir, offline=True)['georgia']) == 8
+    finally:
+        close_connections()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,81 @@
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_aggregation import build_cube, save_cube
+from dataset_metrics import (LEVELS, component_columns, load_metrics, metrics_tables, monthly_metrics,
+                             outcome_metrics, save_metrics)
+from dataset_transformation import cube_measures
+
+def expected_metrics(df, by):
+    sums = df.groupby(by)[component_columns()].sum()
+    table = pd.DataFrame(index=sums.index)
+    for species in ['Canine', 'Feline', 'Total']:
+        def total(names):
+            columns = [column for column in sums.columns for name in names
+                       if column in [f'Canine {name}', f'Feline {name}'] and species in ['Total', column.split()[0]]]
+            return sums[columns].sum(axis=1)
+        live = total(['adoption', 'returned to owner', 'transferred to another agency', 'returned to field',
+                      'other live outcome'])
+        # The export names the cats lost in care 'Feline list in care'
+        lost = total(['lost in care', 'list in care'])
+        died, euthanasia, owner = total(['died in care']), total(['shelter euthanasia']), total(['owner intended euthanasia'])
+        outcomes = live + lost + died + euthanasia + owner
+        intake = total(['stray at large', 'relinquished by owner', 'intake owner intended euthanasia',
+                        'transferred in from agency', 'other intakes'])
+        table[f'{species} Intake'] = intake
+        table[f'{species} Outcomes'] = outcomes
+        table[f'{species} Live Release Rate'] = live / (live + died + lost + euthanasia)
+        table[f'{species} Euthanasia Rate'] = (euthanasia + owner) / outcomes
+        table[f'{species} Return To Owner Rate'] = total(['returned to owner']) / total(['stray at large'])
+        table[f'{species} Balance'] = intake - outcomes
+    return table.reset_index()
+
+def test_metrics_match_grouped_sums(make_combined):
+    df = make_combined()
+    for by in [['State'], ['State', 'Shelter Name'], ['Data Year']]:
+        result = outcome_metrics(df, by)
+        expected = expected_metrics(df, by)
+        pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+def test_zero_denominators_and_empty_groups(make_combined):
+    df = make_combined(rows=3)
+    df[component_columns()] = 0
+    df.loc[0, 'Feline list in care'] = 2
+    df.loc[1, 'Canine other intakes'] = 5
+    result = outcome_metrics(df.assign(Group=['a', 'b', 'c']), ['Group'])
+
+    # The third row has no counts at all
+    assert result['Group'].tolist() == ['a', 'b']
+    assert result.loc[0, 'Feline Live Release Rate'] == 0 and result.loc[0, 'Feline Euthanasia Rate'] == 0
+    assert result.loc[0, 'Feline Outcomes'] == 2 and result.loc[0, 'Total Balance'] == -2
+    assert np.isnan(result.loc[1, 'Total Live Release Rate'])
+    assert np.isnan(result.loc[1, 'Canine Return To Owner Rate'])
+    assert result.loc[1, 'Canine Balance'] == 5
+
+def test_cube_metrics_match_the_combined_rows(make_combined):
+    df = make_combined(seed=1)
+    tables = metrics_tables(build_cube(df, cube_measures))
+    unique = df[df['Shelter Name Annotation'] != 'R']
+    for level, by in LEVELS.items():
+        expected = outcome_metrics(unique, by)
+        pd.testing.assert_frame_equal(tables[level], expected, check_dtype=False)
+
+    monthly = monthly_metrics(df)
+    assert monthly['Month'].dt.day.eq(1).all()
+    np.testing.assert_allclose(monthly['Total Intake'].sum(), tables['state']['Total Intake'].sum())
+
+def test_saved_metrics_are_rebuilt_from_a_newer_cube(make_combined, tmp_path):
+    directory, cube_path = str(tmp_path / 'metrics'), str(tmp_path / 'cube.parquet')
+    cube = build_cube(make_combined(), cube_measures)
+    save_cube(cube, cube_path)
+    shelters = load_metrics('shelter', directory, cube_path)
+    assert sorted(os.listdir(directory)) == sorted(f'{level}.parquet' for level in LEVELS)
+    pd.testing.assert_frame_equal(shelters, metrics_tables(cube)['shelter'])
+
+    save_metrics(metrics_tables(cube.iloc[:5]), directory)
+    os.utime(cube_path, (os.path.getmtime(os.path.join(directory, 'state.parquet')) + 1,) * 2)
+    assert len(load_metrics('shelter', directory, cube_path)) == len(shelters)
+
+    with pytest.raises(KeyError, match='No metrics level'):
+        load_metrics('county', directory, cube_path)
@@ -0,0 +1,141 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_outliers import (AUDIT_COLUMNS, fit_baselines, leave_one_out_medians, load_baselines, merge_baselines,
+                              repair_outliers, save_baselines, score_outliers)
+
+COLUMNS = ['Canine stray at large', 'Feline stray at large']
+
+def monthly_reports(years=(2020, 2021, 2022, 2023)):
+    rows = []
+    for shelter, level in [('SHELTER A', 100), ('DEKALB COUNTY ANIMAL SERVICES', 40)]:
+        for year in years:
+            for month in range(1, 13):
+                # Seasonal counts with a little year to year variation
+                rows.append({'Shelter Name': shelter, 'Report Period Start': pd.Timestamp(year, month, 1),
+                             'Canine stray at large': level + 5 * month + (year - 2020) % 3,
+                             'Feline stray at large': level // 2 + (month * 7) % 11})
+    return pd.DataFrame(rows)
+
+def test_spike_is_flagged_and_replaced_by_seasonal_baseline():
+    df = monthly_reports()
+    spike = (df['Shelter Name'] == 'DEKALB COUNTY ANIMAL SERVICES') & (df['Report Period Start'] == '2022-09-01')
+    df.loc[spike, 'Canine stray at large'] = 900
+
+    model = fit_baselines(df, COLUMNS)
+    repaired, audit = repair_outliers(df.copy(), model)
+
+    assert list(audit.columns) == AUDIT_COLUMNS
+    assert len(audit) == 1
+    record = audit.iloc[0]
+    assert record['row'] == df.index[spike][0]
+    assert record['column'] == 'Canine stray at large'
+    assert record['value'] == 900
+    # Median of the other Septembers: 2020, 2021 and 2023
+    assert record['baseline'] == record['imputed'] == np.median([85, 86, 85])
+    assert record['score'] > 3.5
+    assert repaired.loc[spike, 'Canine stray at large'].tolist() == [85]
+    assert repaired['Canine stray at large'].dtype == 'float64'
+    # Nothing else changes
+    pd.testing.assert_frame_equal(repaired[~spike], df[~spike].astype({'Canine stray at large': 'float64'}))
+
+def test_spike_among_three_seasonal_reports():
+    for years, baseline in [((2020, 2021, 2022, 2023), 130), ((2020, 2021, 2022), 135.5)]:
+        df = monthly_reports(years=years)
+        spike = (df['Shelter Name'] == 'SHELTER A') & (df['Report Period Start'] == '2021-06-01')
+        df.loc[spike, 'Canine stray at large'] = 400
+        _, audit = repair_outliers(df.copy(), fit_baselines(df, COLUMNS))
+        # The baseline leaves the spike out: the median of the Junes of 2020, 2022 and 2023,
+        # or without three other Junes the overall median, so the spike never pulls the other
+        # Junes' baselines
+        assert audit['row'].tolist() == df.index[spike].tolist()
+        assert audit['baseline'].tolist() == [baseline]
+
+def test_leave_one_out_medians():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 30, 400)
+    values = pd.DataFrame(rng.integers(0, 8, (400, 2)).astype('float64'), columns=COLUMNS)
+    values.iloc[rng.random(400) < 0.1, 0] = np.nan
+    below, at, above = leave_one_out_medians(values, keys)
+    medians = values.groupby(keys).median()
+    for row in range(len(values)):
+        for column in COLUMNS:
+            value, median = values.loc[row, column], medians.loc[keys[row], column]
+            if np.isnan(value):
+                continue
+            others = values.loc[(keys == keys[row]) & (values.index != row), column]
+            table = below if value < median else above if value > median else at
+            np.testing.assert_equal(table.loc[keys[row], column], others.median())
+
+def test_flag_without_imputing():
+    df = monthly_reports()
+    df.loc[5, 'Feline stray at large'] = 0
+    df.loc[30, 'Canine stray at large'] = 1000
+
+    repaired, audit = repair_outliers(df.copy(), fit_baselines(df, COLUMNS), impute=False)
+    assert sorted(audit['row']) == [5, 30]
+    assert audit['imputed'].isna().all()
+    pd.testing.assert_frame_equal(repaired, df)
+
+def test_small_deviations_are_kept():
+    df = monthly_reports()
+    df.loc[5, 'Feline stray at large'] += 9
+    _, audit = repair_outliers(df.copy(), fit_baselines(df, COLUMNS))
+    assert audit.empty
+
+def test_overall_baseline_without_enough_seasonal_reports():
+    df = monthly_reports(years=(2022, 2023))
+    model = fit_baselines(df, COLUMNS)
+    _, baseline, _, _ = score_outliers(df, model)
+    overall = df.groupby('Shelter Name')[COLUMNS].median()
+    expected = overall.loc[df['Shelter Name']].to_numpy()
+    np.testing.assert_array_equal(baseline, expected)
+
+def test_repeated_reports_are_counted_once():
+    df = monthly_reports()
+    model = fit_baselines(df, COLUMNS)
+    repeated = fit_baselines(pd.concat([df, df.iloc[:10]], ignore_index=True), COLUMNS)
+    for key in ['seasonal_median', 'seasonal_below', 'seasonal_at', 'seasonal_above', 'seasonal_count',
+                'overall_median', 'scale']:
+        pd.testing.assert_frame_equal(model[key], repeated[key])
+
+def test_unscored_rows():
+    df = monthly_reports()
+    model = fit_baselines(df.iloc[:-40], COLUMNS, min_reports=12)
+    extra = pd.DataFrame({'Shelter Name': ['NEW SHELTER', 'SHELTER A'], 'Report Period Start': [pd.Timestamp(2022, 1, 1), pd.NaT],
+                          'Canine stray at large': [5000, 5000], 'Feline stray at large': [0, 0]})
+    _, _, _, score = score_outliers(extra, model)
+    assert np.isnan(score).all()
+
+    # DeKalb has 12 reports in the first 60 rows and 10 in the first 58
+    for rows, scored in [(60, True), (58, False)]:
+        model = fit_baselines(df.iloc[:rows], COLUMNS, min_reports=12)
+        scale = model['scale'].set_axis(model['shelters'])
+        assert scale.loc['SHELTER A'].notna().all()
+        assert scale.loc['DEKALB COUNTY ANIMAL SERVICES'].notna().all() == scored
+
+def test_constant_counts_use_mean_absolute_deviation():
+    df = monthly_reports()
+    df['Feline stray at large'] = 20
+    df.loc[3, 'Feline stray at large'] = 60
+    model = fit_baselines(df, COLUMNS)
+    _, audit = repair_outliers(df.copy(), model)
+    assert audit['row'].tolist() == [3]
+    assert audit['scale'].iloc[0] == pytest.approx(1.253314 * 40 / 48)
+
+def test_merged_baselines_score_as_one_fit(tmp_path):
+    df = monthly_reports()
+    df.loc[100, 'Canine stray at large'] = 900
+    extra = monthly_reports().assign(**{'Shelter Name': 'SHELTER C'})
+    dekalb = df['Shelter Name'] == 'DEKALB COUNTY ANIMAL SERVICES'
+    both = pd.concat([df, extra], ignore_index=True)
+
+    # Refit DeKalb and add a shelter to a model of the first two shelters
+    model = merge_baselines(fit_baselines(df, COLUMNS), fit_baselines(pd.concat([df[dekalb], extra]), COLUMNS))
+    save_baselines(model, str(tmp_path / 'baselines.pkl'))
+    model = load_baselines(str(tmp_path / 'baselines.pkl'))
+
+    expected = score_outliers(both, fit_baselines(both, COLUMNS))
+    for merged, single in zip(score_outliers(both, model), expected):
+        np.testing.assert_array_equal(merged, single)
+    assert load_baselines(str(tmp_path / 'missing.pkl')) is None
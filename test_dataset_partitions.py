@@ -0,0 +1,57 @@
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_aggregation import build_cube
+from dataset_partitions import read_combined, save_combined
+
+@pytest.fixture
+def combined_df():
+    return pd.DataFrame({
+        'Shelter Name': pd.Categorical(['A', 'A', 'A', 'B', 'B', 'C', 'C']),
+        'EIN': ['12-3', 0, 0, '45-6', '45-6', np.nan, 0],
+        'State': pd.Categorical(['GA', 'GA', 'GA', 'TX', 'TX', 'TX', 'TX']),
+        'Data Year': [2021, 2021, 2022, 2023, 'No Data from 2023, 2022, or 2021', 2020, 2022],
+        'Shelter Name Annotation': pd.Categorical([0, 0, 'R', 0, 0, 0, 0]),
+        'Canine stray at large': pd.array([1, 2, 3, 4, 5, 6, 7], dtype='Int16'),
+        'Feline stray at large': [10.0, np.nan, 30.0, 40.0, 50.0, 60.0, 70.0],
+    })
+
+def test_partition_layout(combined_df, tmp_path):
+    path = save_combined(combined_df, str(tmp_path / 'combined'))
+    assert sorted(os.listdir(path)) == ['State=GA', 'State=TX']
+    assert sorted(os.listdir(os.path.join(path, 'State=TX'))) == [
+        'Data Year=2020', 'Data Year=2022', 'Data Year=2023', 'Data Year=__HIVE_DEFAULT_PARTITION__']
+
+    # Rewriting replaces the earlier dataset
+    save_combined(combined_df[combined_df['State'] == 'GA'], path)
+    assert os.listdir(path) == ['State=GA']
+
+def test_round_trip(combined_df, tmp_path):
+    path = save_combined(combined_df, str(tmp_path / 'combined'))
+    df = read_combined(path, include_duplicates=True)
+    assert list(df.columns) == list(combined_df.columns)
+    assert len(df) == len(combined_df)
+    assert df['Canine stray at large'].dtype == 'Int16'
+    assert set(df['EIN'].dropna()) == {'12-3', '0', '45-6'}
+    assert df['Data Year'].isna().sum() == 1
+
+    # The stored rows build the same cube
+    measures = ['Canine stray at large', 'Feline stray at large']
+    expected = build_cube(combined_df, measures)
+    cube = build_cube(df, measures)
+    pd.testing.assert_frame_equal(cube.sort_values(['State', 'Shelter Name', 'Data Year']).reset_index(drop=True),
+                                  expected.sort_values(['State', 'Shelter Name', 'Data Year']).reset_index(drop=True),
+                                  check_dtype=False)
+
+def test_report_slices(combined_df, tmp_path):
+    path = save_combined(combined_df, str(tmp_path / 'combined'))
+
+    # The filters of the reports: 2021-2023 without duplicates
+    df = read_combined(path, years=(2021, 2023), columns=['State', 'Canine stray at large'])
+    assert list(df.columns) == ['State', 'Canine stray at large']
+    assert df.groupby('State')['Canine stray at large'].sum().to_dict() == {'GA': 3, 'TX': 11}
+
+    df = read_combined(path, years=(2022, 2022), states=['TX'], include_duplicates=True)
+    assert df['Shelter Name'].tolist() == ['C']
+    assert read_combined(path, states=['FL']).empty
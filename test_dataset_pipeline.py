@@ -0,0 +1,116 @@
+import importlib
+import os
+import subprocess
+import sys
+import pytest
+import pandas as pd
+import dataset_pipeline
+from dataset_pipeline import code_fingerprint, run_pipeline
+
+SCALE = [2]
+
+def toy_load():
+    return {'georgia': pd.DataFrame({'Count': [1, 2, 3]})}
+
+def toy_scale(frames):
+    return frames['georgia'] * SCALE[0]
+
+def toy_total(df):
+    return int(df['Count'].sum())
+
+def toy_publish(total, df):
+    with open('total.txt', 'w') as f:
+        f.write(f'{total} from {len(df)} rows')
+
+@pytest.fixture
+def toy_stages(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dataset_pipeline, 'STAGES', {
+        'load': (toy_load, []),
+        'scale': (toy_scale, ['load']),
+        'total': (toy_total, ['scale']),
+    })
+    monkeypatch.setattr(dataset_pipeline, 'PUBLISHERS', {'total': (toy_publish, ['scale'], ['total.txt'])})
+    return str(tmp_path / 'cache')
+
+def toy_report(total):
+    return f'Total: {total}'
+
+def test_run_pipeline_reuses_cached_stages(toy_stages):
+    first = run_pipeline(stage='total', cache_dir=toy_stages)
+    assert first.outputs['total'] == 12
+    assert first.computed == ['load', 'scale', 'total']
+
+    # Only the sources are read again
+    second = run_pipeline(stage='total', cache_dir=toy_stages)
+    assert second.outputs['total'] == 12
+    assert second.computed == ['load']
+
+def test_run_pipeline_recomputes_changed_code_inputs(toy_stages, monkeypatch):
+    run_pipeline(stage='total', cache_dir=toy_stages)
+
+    # Module-level settings are part of a stage's code fingerprint
+    monkeypatch.setitem(globals(), 'SCALE', [3])
+    rerun = run_pipeline(stage='total', cache_dir=toy_stages)
+    assert rerun.outputs['total'] == 18
+    assert rerun.computed == ['load', 'scale', 'total']
+
+def test_run_pipeline_force(toy_stages):
+    run_pipeline(stage='scale', cache_dir=toy_stages)
+    assert run_pipeline(stage='scale', cache_dir=toy_stages, force=True).computed == ['load', 'scale']
+
+def test_published_files_are_rewritten_from_the_cache(toy_stages, tmp_path, monkeypatch):
+    monkeypatch.setitem(dataset_pipeline.STAGES, 'report', (toy_report, ['total']))
+    run_pipeline(stage='report', cache_dir=toy_stages)
+    assert (tmp_path / 'total.txt').read_text() == '12 from 3 rows'
+
+    # A deleted file is published again from the cached stages, also when only a later stage is run
+    for stage in ['total', 'report']:
+        (tmp_path / 'total.txt').unlink()
+        rerun = run_pipeline(stage=stage, cache_dir=toy_stages)
+        assert rerun.computed == ['load']
+        assert (tmp_path / 'total.txt').read_text() == '12 from 3 rows'
+
+    # Nothing is written while the files exist and the stage is cached
+    (tmp_path / 'total.txt').write_text('kept')
+    run_pipeline(stage='total', cache_dir=toy_stages)
+    assert (tmp_path / 'total.txt').read_text() == 'kept'
+
+HELPERS = """
+class Scaler:
+    def scale(self, df):
+        return df * {factor}
+
+SCALERS = {{'default': Scaler}}
+
+def unrelated():
+    return {unrelated}
+"""
+
+def toy_lazy_scale(frames):
+    from dataset_toy_helpers import SCALERS
+    return SCALERS['default']().scale(frames['georgia'])
+
+def test_code_fingerprint_follows_imports_and_classes(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    def fingerprint(factor, unrelated):
+        (tmp_path / 'dataset_toy_helpers.py').write_text(HELPERS.format(factor=factor, unrelated=unrelated))
+        sys.modules.pop('dataset_toy_helpers', None)
+        importlib.invalidate_caches()
+        return code_fingerprint(toy_lazy_scale)
+
+    first = fingerprint(2, 0)
+    # The method of a class held in a registry that the stage imports when it runs
+    assert fingerprint(3, 0) != first
+    # Code of the module the stage does not use
+    assert fingerprint(2, 1) == first
+    sys.modules.pop('dataset_toy_helpers', None)
+
+def test_code_fingerprint_is_the_same_in_every_run():
+    # Settings holding functions, such as the figure registry, are described without their addresses
+    script = 'import dataset_pipeline as p; print(p.code_fingerprint(p.transformation.render_figure))'
+    directory = os.path.dirname(os.path.abspath(dataset_pipeline.__file__))
+    runs = [subprocess.run([sys.executable, '-c', script], cwd=directory, capture_output=True, text=True,
+                           check=True).stdout for _ in range(2)]
+    assert runs[0] == runs[1] != ''
@@ -0,0 +1,41 @@
+import datetime
+import json
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_profile import profile_dtypes, profile_to_frame, profile_to_json, python_type_counts
+
+@pytest.fixture
+def mixed_df():
+    return pd.DataFrame({
+        'float': [1.0, np.nan, 3.0, 4.0],
+        'int': [1, 2, 3, 4],
+        'date': pd.to_datetime(['2022-01-01', None, '2022-03-01', '2022-04-01']),
+        'nullable': pd.array([1, None, 3, 4], dtype='Int16'),
+        'text': ['a', np.nan, None, 'd'],
+        'category': pd.Series([0, 'R', 0, None]).astype('category'),
+        'mixed': [1, 'a', 2.5, datetime.datetime(2022, 1, 1)],
+    })
+
+def test_python_type_counts_match_per_value_types(mixed_df):
+    for column in mixed_df.columns:
+        expected = mixed_df[column].apply(type).value_counts().to_dict()
+        assert python_type_counts(mixed_df[column]) == expected, column
+
+def test_python_type_counts_sampled():
+    values = pd.Series([1, 'a'] * 500)
+    counts = python_type_counts(values, sample=100)
+    assert set(counts) == {int, str}
+    assert sum(counts.values()) == 1000
+
+def test_profile_dtypes_parallel_report(mixed_df):
+    profiles = profile_dtypes(mixed_df, workers=4)
+    assert list(profiles) == list(mixed_df.columns)
+    assert profiles == profile_dtypes(mixed_df, workers=1)
+
+    frame = profile_to_frame(profiles)
+    assert frame.loc['text', 'python_types'] == 'str: 2, NoneType: 1, float: 1'
+    assert frame.loc['nullable', 'nan_count'] == 1
+
+    report = json.loads(profile_to_json(profiles))
+    assert report['date']['python_types'] == {'Timestamp': 3, 'NaTType': 1}
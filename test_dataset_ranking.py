@@ -0,0 +1,77 @@
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_aggregation import build_cube, save_cube, slice_cube, totals_by
+from dataset_ranking import (build_ranking, drop_shelters, load_ranking, merge_rankings, save_ranking, top_k,
+                             yearly_totals)
+
+MEASURES = ['Canine adoption', 'Feline adoption', 'Total Intake Gross']
+
+def ranked_reports(make_combined, rows=400, seed=0):
+    # Few distinct values, so there are ties to break, some reports without a shelter name or a numeric year
+    df = make_combined(rows=rows, shelters=40, years=[2019, 2020, 2021, 2022, 2023, 'No Data from 2023, 2022, or 2021'],
+                       measures=MEASURES, high=4, seed=seed)
+    df.loc[::41, 'Shelter Name'] = np.nan
+    return df
+
+def expected_top(cube, k, columns, years=None, states=None, include_duplicates=False):
+    totals = totals_by(slice_cube(cube, years=years, states=states, include_duplicates=include_duplicates),
+                       'Shelter Name', columns)
+    # Ties in name order, which nlargest only keeps while k is below the number of shelters
+    return totals.reset_index().sort_values([0, 'Shelter Name'], ascending=[False, True]).set_index('Shelter Name')[0][:k]
+
+@pytest.fixture
+def cube(make_combined):
+    return build_cube(ranked_reports(make_combined), MEASURES)
+
+def test_top_k_matches_regrouping(cube):
+    index = build_ranking(cube, {'Adoptions': MEASURES[:2], **{column: [column] for column in MEASURES}})
+    for measure, columns in [('Adoptions', MEASURES[:2]), ('Total Intake Gross', ['Total Intake Gross'])]:
+        for k in [1, 10, 100]:
+            for years, states, include_duplicates in [(None, None, False), ((2021, 2023), None, False),
+                                                      ((2020, 2020), ['GA', 'AL'], False), (None, ['TX'], True),
+                                                      ((2024, 2030), None, False)]:
+                result = top_k(index, k, measure, years=years, states=states, include_duplicates=include_duplicates)
+                expected = expected_top(cube, k, columns, years, states, include_duplicates)
+                assert result.index.tolist() == expected.index.tolist()
+                np.testing.assert_allclose(result.to_numpy(), expected.to_numpy())
+
+    with pytest.raises(KeyError, match='not ranked'):
+        top_k(index, 10, 'Canine lost in care')
+
+def test_yearly_totals(cube):
+    index = build_ranking(cube, {'Adoptions': MEASURES[:2]})
+    grouped = totals_by(slice_cube(cube, years=(2021, 2023)), ['Shelter Name', 'Data Year'], MEASURES[:2]).unstack()
+    top = top_k(index, 10, 'Adoptions', years=(2021, 2023)).index
+
+    pd.testing.assert_frame_equal(yearly_totals(index, top, 'Adoptions', years=(2021, 2023)), grouped.loc[top])
+
+def test_incremental_updates_match_a_rebuild(make_combined):
+    first, second = ranked_reports(make_combined, seed=1), ranked_reports(make_combined, rows=100, seed=2)
+    measures = {column: [column] for column in MEASURES}
+    index = build_ranking(build_cube(first, MEASURES), measures)
+
+    merged = merge_rankings(index, build_ranking(build_cube(second, MEASURES), measures))
+    rebuilt = build_ranking(build_cube(pd.concat([first, second]), MEASURES), measures)
+    for measure in MEASURES:
+        for years in [None, (2020, 2022)]:
+            pd.testing.assert_series_equal(top_k(merged, 40, measure, years=years),
+                                           top_k(rebuilt, 40, measure, years=years))
+
+    dropped = drop_shelters(index, ['SHELTER 00', 'SHELTER 01'])
+    assert {'SHELTER 00', 'SHELTER 01'}.isdisjoint(dropped['shelters'])
+    assert len(dropped['shelters']) == len(index['shelters']) - 2
+
+def test_saved_index_is_rebuilt_from_a_newer_cube(cube, tmp_path):
+    path, cube_path = str(tmp_path / 'ranking.pkl'), str(tmp_path / 'cube.parquet')
+    save_cube(cube, cube_path)
+    index = load_ranking(path, cube_path)
+    assert os.path.exists(path)
+    assert sorted(index['measures']) == sorted(MEASURES)
+    pd.testing.assert_series_equal(top_k(index, 5, 'Total Intake Gross'),
+                                   top_k(build_ranking(cube), 5, 'Total Intake Gross'))
+
+    save_ranking(build_ranking(cube.iloc[:5]), path)
+    os.utime(cube_path, (os.path.getmtime(path) + 1,) * 2)
+    assert len(load_ranking(path, cube_path)['shelters']) == len(index['shelters'])
@@ -0,0 +1,109 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_benchmark import REPORTS_PER_SHELTER, synthetic_annotations, synthetic_best_friends, synthetic_georgia
+from dataset_partitions import read_combined
+from dataset_ranking import load_ranking, top_k
+from dataset_refresh import refresh
+from dataset_schema import GEORGIA_INTAKE_COLUMNS, GEORGIA_OUTCOME_COLUMNS
+from dataset_transformation import coerce_georgia_types, cube_measures, parse_georgia_headers
+
+ROWS = 20 * REPORTS_PER_SHELTER
+
+@pytest.fixture
+def sources():
+    sheet = synthetic_georgia(ROWS)
+    annotations = synthetic_annotations(sheet)
+    best_friends = synthetic_best_friends(400, ROWS)
+    georgia = coerce_georgia_types(parse_georgia_headers(sheet))
+    # Steady counts, so only the planted spikes are outliers
+    counts = GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS
+    georgia[counts] = np.random.default_rng(1).integers(20, 25, (len(georgia), len(counts)))
+    measures = [column for column in cube_measures if column in georgia.columns or column in best_friends.columns]
+    return georgia, annotations, best_friends, measures
+
+def run(tmp_path, name, georgia, annotations, best_friends, measures, full=False):
+    directory = tmp_path / name
+    return refresh(georgia, annotations, best_friends, {}, state_dir=str(directory),
+                   cube_path=str(directory / 'cube.parquet'), audit_path=str(directory / 'audit.csv'),
+                   measures=measures, full=full, ranking_path=str(directory / 'ranking.pkl'),
+                   combined_path=str(directory / 'combined'))
+
+def full_build(tmp_path, georgia, annotations, best_friends, measures):
+    cube, summary = run(tmp_path, 'full', georgia, annotations, best_friends, measures)
+    assert summary['mode'] == 'full'
+    return cube
+
+def assert_same_ranking(tmp_path):
+    # The ranking index updated from the new cube parts ranks as one built from scratch
+    updated, rebuilt = (load_ranking(str(tmp_path / name / 'ranking.pkl'), str(tmp_path / name / 'cube.parquet'))
+                        for name in ['state', 'full'])
+    assert updated['measures'] == rebuilt['measures']
+    for measure in updated['measures']:
+        for years in [None, (2021, 2022)]:
+            pd.testing.assert_series_equal(top_k(updated, 50, measure, years=years),
+                                           top_k(rebuilt, 50, measure, years=years))
+
+def assert_same_combined(tmp_path):
+    # The combined dataset keeps the other shelters' rows and holds the same reports as one built from scratch
+    updated, rebuilt = (read_combined(str(tmp_path / name / 'combined'), include_duplicates=True)
+                        for name in ['state', 'full'])
+    key = ['Shelter Name', 'Report Period Start', 'Report Period End', 'EIN']
+    updated, rebuilt = (df.sort_values(key, kind='stable').reset_index(drop=True) for df in [updated, rebuilt])
+    pd.testing.assert_frame_equal(updated, rebuilt, check_dtype=False, check_categorical=False)
+
+def test_new_months_are_appended(sources, tmp_path):
+    georgia, annotations, best_friends, measures = sources
+    latest = georgia.groupby('Shelter Name').cumcount() == REPORTS_PER_SHELTER - 1
+    georgia.loc[latest.to_numpy().nonzero()[0][3], 'Canine stray at large'] = 5000
+
+    cube, summary = run(tmp_path, 'state', georgia[~latest], annotations, best_friends, measures)
+    assert summary['mode'] == 'full'
+    cube, summary = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    assert summary['mode'] == 'incremental'
+    assert (summary['added'], summary['changed'], summary['removed']) == (20, 0, 0)
+    assert (summary['rebuilt_shelters'], summary['appended_shelters']) == (0, 20)
+
+    pd.testing.assert_frame_equal(cube, full_build(tmp_path, georgia, annotations, best_friends, measures))
+    assert_same_ranking(tmp_path)
+    assert_same_combined(tmp_path)
+    audit = pd.read_csv(tmp_path / 'state' / 'audit.csv')
+    assert audit['value'].tolist() == [5000]
+
+def test_unchanged_export(sources, tmp_path):
+    georgia, annotations, best_friends, measures = sources
+    first, _ = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    cube, summary = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    assert summary['mode'] == 'incremental'
+    assert (summary['added'], summary['changed'], summary['removed']) == (0, 0, 0)
+    assert (summary['rebuilt_shelters'], summary['appended_shelters']) == (0, 0)
+    pd.testing.assert_frame_equal(cube, first)
+
+def test_changed_report_rebuilds_its_shelter(sources, tmp_path):
+    georgia, annotations, best_friends, measures = sources
+    run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    georgia.loc[5, 'Canine stray at large'] = 5000
+    cube, summary = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    assert (summary['added'], summary['changed'], summary['removed']) == (0, 1, 0)
+    assert (summary['rebuilt_shelters'], summary['appended_shelters']) == (1, 0)
+    pd.testing.assert_frame_equal(cube, full_build(tmp_path, georgia, annotations, best_friends, measures))
+    assert_same_combined(tmp_path)
+
+def test_removed_reports_and_new_shelters(sources, tmp_path):
+    georgia, annotations, best_friends, measures = sources
+    new_shelter = georgia['Shelter Name'] == georgia['Shelter Name'].iloc[-1]
+    run(tmp_path, 'state', georgia[~new_shelter], annotations, best_friends, measures)
+    georgia = georgia.drop(index=[50, 51])
+    cube, summary = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    assert (summary['added'], summary['changed'], summary['removed']) == (REPORTS_PER_SHELTER, 0, 2)
+    assert (summary['rebuilt_shelters'], summary['appended_shelters']) == (2, 0)
+    pd.testing.assert_frame_equal(cube, full_build(tmp_path, georgia, annotations, best_friends, measures))
+    assert_same_ranking(tmp_path)
+
+def test_new_annotations_rebuild_everything(sources, tmp_path):
+    georgia, annotations, best_friends, measures = sources
+    run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    annotations.loc[0, 'Shelter Name Annotation'] = 'R'
+    cube, summary = run(tmp_path, 'state', georgia, annotations, best_friends, measures)
+    assert summary['mode'] == 'full'
+    pd.testing.assert_frame_equal(cube, full_build(tmp_path, georgia, annotations, best_friends, measures))
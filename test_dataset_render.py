@@ -0,0 +1,55 @@
+import os
+import pytest
+import pandas as pd
+import matplotlib
+import matplotlib.pyplot as plt
+from dataset_render import render_figures
+from dataset_transformation import render_figure
+
+@pytest.fixture
+def reports():
+    outcomes = pd.DataFrame({'outcome_type': ['Canine adoption', 'Canine returned to owner'], 'count': [10, 4]})
+    return {
+        'state_totals': pd.Series([30.0, 20.0], index=['GA', 'TX']),
+        'canine_outcomes': outcomes,
+        'feline_outcomes': outcomes.assign(outcome_type=['Feline adoption', 'Feline returned to owner']),
+    }
+
+def test_render_figures_in_worker_processes(reports, tmp_path):
+    report = render_figures(reports, ['Total_Intake_Gross', 'Canine_Outcomes', 'Feline_Outcomes'],
+                            output_dir=str(tmp_path), workers=2)
+
+    assert [result['figure'] for result in report['figures']] == ['Total_Intake_Gross', 'Canine_Outcomes', 'Feline_Outcomes']
+    assert all((tmp_path / (result['figure'] + '.png')).exists() for result in report['figures'])
+    assert report['workers'] == 2
+    assert report['total_seconds'] > 0
+    assert report['peak_rss_mb'] > 0
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_render_figures_closes_figures(reports, tmp_path, workers):
+    render_figures(reports, ['Canine_Outcomes', 'Feline_Outcomes'], output_dir=str(tmp_path), workers=workers)
+
+    assert (tmp_path / 'Canine_Outcomes.png').exists()
+    assert plt.get_fignums() == []
+
+def test_render_figure_closes_its_figure(reports, tmp_path):
+    # What each worker process runs per figure
+    render_figure('Canine_Outcomes', reports, str(tmp_path))
+
+    assert (tmp_path / 'Canine_Outcomes.png').exists()
+    assert plt.get_fignums() == []
+
+def test_render_figures_leaves_the_callers_backend(reports, tmp_path):
+    backend = matplotlib.get_backend()
+    matplotlib.use('pdf')
+    try:
+        figure = plt.figure()
+        report = render_figures(reports, ['Canine_Outcomes'], output_dir=str(tmp_path), workers=1)
+        assert matplotlib.get_backend() == 'pdf'
+        assert plt.get_fignums() == [figure.number]
+    finally:
+        plt.close('all')
+        matplotlib.use(backend)
+
+    assert (tmp_path / 'Canine_Outcomes.png').exists()
+    assert report['figures'][0]['pid'] != os.getpid()
@@ -0,0 +1,48 @@
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_schema import compact_frame, smallest_integer_dtype
+from dataset_transformation import get_detailed_dtypes
+
+@pytest.fixture
+def combined_df():
+    return pd.DataFrame({
+        'Shelter Name': ['A', 'A', 'B', 'C'],
+        'State': ['GA', 'GA', 'TX', 'TX'],
+        'Shelter Name Annotation': [0, 'R', 0, 0],
+        'Canine stray at large': [1.0, 2.0, 3.0, 4.5],
+        'Feline adoption': [0.0, 120.0, 3.0, 7.0],
+        'Canine Total Intake Gross': [0.0, 40000.0, np.nan, 1.0],
+        'EIN': ['1', '2', '3', '4'],
+    })
+
+def test_smallest_integer_dtype():
+    assert smallest_integer_dtype(pd.Series([0.0, 127.0])) == 'Int8'
+    assert smallest_integer_dtype(pd.Series([0, 128])) == 'Int16'
+    assert smallest_integer_dtype(pd.Series([-1.0, np.nan, 70000.0])) == 'Int32'
+    assert smallest_integer_dtype(pd.Series([1.0, 2.5])) is None
+
+def test_compact_frame(combined_df):
+    compact = compact_frame(combined_df)
+
+    assert str(compact['Feline adoption'].dtype) == 'Int8'
+    assert str(compact['Canine Total Intake Gross'].dtype) == 'Int32'
+    assert compact['Canine Total Intake Gross'].isna().tolist() == [False, False, True, False]
+    for column in ['Shelter Name', 'State', 'Shelter Name Annotation']:
+        assert str(compact[column].dtype) == 'category'
+
+    # Non-integer counts and undeclared columns are left alone
+    assert str(compact['Canine stray at large'].dtype) == 'float64'
+    assert str(compact['EIN'].dtype) == 'object'
+
+    # Values are unchanged
+    pd.testing.assert_frame_equal(compact.astype(object).fillna(np.nan), combined_df.astype(object).fillna(np.nan),
+                                  check_dtype=False)
+
+def test_get_detailed_dtypes_memory(combined_df):
+    compact = compact_frame(combined_df)
+    result = get_detailed_dtypes(combined_df, compact)
+
+    assert result['Feline adoption']['compact_dtype'] == 'Int8'
+    assert result['Feline adoption']['compact_memory_bytes'] < result['Feline adoption']['memory_bytes']
+    assert result['EIN']['compact_memory_bytes'] == result['EIN']['memory_bytes']
@@ -0,0 +1,93 @@
+import json
+import threading
+import time
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_cache import close_connections, http_request
+from dataset_server import LRUCache, ReportData, VIEWS, load_test, make_server, parse_filters
+from dataset_transformation import aggregate_reports, cube_measures
+
+@pytest.fixture
+def combined_df(make_combined):
+    return make_combined(rows=120, shelters=15, states=('GA', 'TX'), years=range(2020, 2024), high=50)
+
+@pytest.fixture
+def server(combined_df):
+    data = ReportData(combined_df)
+    server = make_server(data, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield data, f'http://127.0.0.1:{server.server_address[1]}'
+    close_connections()
+    server.shutdown()
+    server.server_close()
+
+def test_lru_cache_evicts_and_computes_once():
+    cache = LRUCache(maxsize=2)
+    calls = []
+
+    def compute(key):
+        def slow():
+            calls.append(key)
+            time.sleep(0.1)
+            return key * 2
+        return slow
+
+    threads = [threading.Thread(target=cache.get, args=(1, compute(1))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert cache.stats()['hits'] == 7
+
+    assert cache.get(2, compute(2)) == 4
+    cache.get(1, compute(1))
+    # 2 is now the least recently used
+    cache.get(3, compute(3))
+    assert list(cache.entries) == [1, 3]
+
+def test_parse_filters():
+    assert parse_filters('') == ((2021, 2023), None, 'all')
+    assert parse_filters('years=2020-2021&state=TX&state=GA&species=canine') == ((2020, 2021), ('GA', 'TX'), 'canine')
+    assert parse_filters('years=2022&state=GA,TX') == ((2022, 2022), ('GA', 'TX'), 'all')
+    assert parse_filters('years=all&state=') == (None, None, 'all')
+    for query in ['species=bird', 'years=recent', 'years=2023-2021']:
+        with pytest.raises(ValueError):
+            parse_filters(query)
+
+def test_views_and_tables(server, combined_df):
+    data, url = server
+    for view in VIEWS:
+        _, body = http_request(f'{url}/view/{view}?years=2020-2022&state=GA&species=feline')
+        assert b'plotly-graph-div' in body and b'/plotly.min.js' in body
+
+    _, body = http_request(f'{url}/api/state_totals?years=2020-2021')
+    expected = aggregate_reports(data.cube, years=(2020, 2021))['state_totals']
+    table = json.loads(body)
+    assert table['index'] == expected.index.tolist()
+    assert table['data'] == expected.tolist()
+
+    _, body = http_request(f'{url}/api/top_10_data?state=TX')
+    expected = aggregate_reports(data.cube, states=['TX'])['top_10_data']
+    assert json.loads(body)['index'] == expected.index.tolist()
+
+    for path, status in [('/view/missing', '404'), ('/api/missing', '404'), ('/view/outcomes?species=bird', '400'),
+                         ('/api/top_10_data?years=2023-2021', '400')]:
+        with pytest.raises(OSError, match=status):
+            http_request(url + path)
+
+def test_load_test_reuses_cached_aggregates(server):
+    data, url = server
+    filters = ['', '?years=2020-2021', '?state=GA', '?species=canine']
+    paths = [f'/view/{view}{query}' for view in VIEWS for query in filters] + ['/api/state_totals']
+    result = load_test(url, requests=200, concurrency=8, paths=paths)
+
+    assert result['requests'] == 200 and result['errors'] == 0
+    # Three distinct year and state selections; the species only changes the view
+    assert data.computed == 3
+    _, body = http_request(url + '/stats')
+    stats = json.loads(body)
+    assert stats['misses'] == len(paths) + 3
+    assert stats['hits'] >= 200 - len(paths)
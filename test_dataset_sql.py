@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_aggregation import build_cube
+from dataset_partitions import save_combined
+from dataset_sql import VIEWS, build_database, is_stale, query, sql_column_names
+from dataset_transformation import aggregate_reports, cube_measures
+
+@pytest.fixture
+def combined_df(make_combined):
+    df = make_combined(rows=60, shelters=12, states=('GA', 'TX'), years=range(2020, 2025), high=50)
+    # The dtypes of the cleaned Best Friends merge, a year that is not a number and a column
+    # whose name differs from a Georgia column only in case
+    for column in ['Shelter Name', 'State', 'Shelter Name Annotation']:
+        df[column] = df[column].fillna(0).astype('category')
+    df['Data Year'] = df['Data Year'].astype(object)
+    df.loc[len(df) - 1, 'Data Year'] = 'No Data from 2023, 2022, or 2021'
+    df[cube_measures] = df[cube_measures].astype('Int16')
+    df['Canine Intake Owner Intended Euthanasia'] = 1.0
+    return df
+
+def test_case_insensitive_column_names():
+    assert sql_column_names(['Canine intake owner intended euthanasia', 'Canine Intake Owner Intended Euthanasia',
+                             'a', 'A', 'A']) == [
+        'Canine intake owner intended euthanasia', 'Canine Intake Owner Intended Euthanasia (Best Friends)',
+        'a', 'A (2)', 'A (3)']
+
+def test_views_match_report_tables(combined_df, tmp_path):
+    path = build_database(combined_df, str(tmp_path / 'shelters.sqlite'))
+    reports = aggregate_reports(build_cube(combined_df, cube_measures))
+    source = str(tmp_path / 'missing')
+
+    for name in ['state_totals', 'dog_gross_totals', 'cat_gross_totals', 'dog_net_totals', 'cat_net_totals',
+                 'undesignated_totals']:
+        view = query(f'SELECT * FROM {name}', path=path, source=source)
+        expected = reports[name]
+        assert view['State'].tolist() == expected.index.tolist()
+        np.testing.assert_allclose(view['total'], expected.to_numpy())
+
+    view = query('SELECT * FROM top_10_shelters', path=path, source=source)
+    assert view['Shelter Name'].tolist() == reports['top_10_data'].index.tolist()
+    view = query('SELECT * FROM top_10_by_year', path=path, source=source)
+    assert len(view) == reports['top_10_by_year']['Total Animals'].notna().sum()
+
+    for name in ['canine_outcomes', 'feline_outcomes']:
+        view = query(f'SELECT * FROM {name}', path=path, source=source)
+        pd.testing.assert_frame_equal(view, reports[name].astype({'count': 'float64'}))
+
+def test_indexes_and_parameters(combined_df, tmp_path):
+    path = build_database(combined_df, str(tmp_path / 'shelters.sqlite'))
+    connection = sqlite3.connect(path)
+    indexes = {row[1] for row in connection.execute("SELECT * FROM sqlite_master WHERE type = 'index'")}
+    plan = connection.execute('EXPLAIN QUERY PLAN SELECT * FROM combined WHERE "Shelter Name" = ?',
+                              ('SHELTER 1',)).fetchall()
+    connection.close()
+    assert indexes == {'idx_state', 'idx_shelter_name', 'idx_data_year'}
+    assert 'idx_shelter_name' in plan[0][3]
+
+    result = query('SELECT COUNT(*) AS reports FROM report_rows WHERE State = ?', ('TX',), path=path,
+                   source=str(tmp_path / 'missing'))
+    expected = combined_df[(combined_df['State'] == 'TX') & (combined_df['Shelter Name Annotation'] != 'R')
+                           & pd.to_numeric(combined_df['Data Year'], errors='coerce').between(2021, 2023)]
+    assert result['reports'].iloc[0] == len(expected)
+
+def test_rebuilt_from_newer_combined_dataset(combined_df, tmp_path):
+    source = save_combined(combined_df, str(tmp_path / 'combined'))
+    path = str(tmp_path / 'shelters.sqlite')
+    assert is_stale(path, source)
+    assert query('SELECT COUNT(*) AS n FROM combined', path=path, source=source)['n'].iloc[0] == len(combined_df)
+    assert not is_stale(path, source)
+
+    save_combined(combined_df.iloc[:10], source)
+    os.utime(source, (os.path.getmtime(path) + 1,) * 2)
+    assert is_stale(path, source)
+    assert query('SELECT COUNT(*) AS n FROM combined', path=path, source=source)['n'].iloc[0] == 10
+    assert set(VIEWS) <= set(query("SELECT name FROM sqlite_master WHERE type = 'view'", path=path,
+                                   source=source)['name'])
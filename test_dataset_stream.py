@@ -0,0 +1,156 @@
+import datetime
+import functools
+import http.server
+import os
+import threading
+import pytest
+import pandas as pd
+import numpy as np
+from unittest.mock import patch
+from openpyxl import Workbook
+from dataset_aggregation import build_cube
+from dataset_identity import join_annotations, join_best_friends, update_shelter_index
+from dataset_partitions import CombinedWriter, read_combined
+from dataset_schema import GEORGIA_INTAKE_COLUMNS, GEORGIA_OUTCOME_COLUMNS
+from dataset_cache import close_connections
+from dataset_benchmark import synthetic_annotations, synthetic_best_friends, synthetic_georgia
+from dataset_stream import download_workbook, fit_stream_baselines, iter_georgia_chunks, stream_cube
+from dataset_transformation import (clean_combined, coerce_georgia_types, fix_data_entry_mistakes,
+                                    parse_georgia_headers, cube_measures)
+
+# Georgia layout: four descriptive columns followed by 29 count columns
+COUNTS = GEORGIA_INTAKE_COLUMNS + GEORGIA_OUTCOME_COLUMNS + ['Other count']
+
+# The report measures present in the test sources
+MEASURES = [column for column in cube_measures
+            if column in COUNTS + ['Total Intake Gross', 'Canine Total Intake Gross']]
+
+def georgia_rows():
+    rows = []
+    for i, (name, month) in enumerate([('SHELTER A', 8), ('DEKALB COUNTY ANIMAL SERVICES', 9), ('Shared Shelter', 9),
+                                       ('SHELTER A', 9), ('DEKALB COUNTY ANIMAL SERVICES', 9)]):
+        year = 2022 if i in (1, 2) else 2021
+        start = datetime.datetime(year, month, 1)
+        rows.append([None, name, 'L%d' % i, start, start + datetime.timedelta(days=29)] + [i + j for j in range(29)])
+    return rows
+
+@pytest.fixture
+def georgia_workbook(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    for title in ['Shelter Report Data Export', 'October 2024', 'All']:
+        sheet.append([None, title])
+    sheet.append([None, 'Shelter Name', 'License Number', 'Report Period Start', 'Report Period End'] + COUNTS)
+    for row in georgia_rows():
+        sheet.append(row)
+    path = str(tmp_path / 'georgia.xlsx')
+    workbook.save(path)
+    return path
+
+@pytest.fixture
+def sources():
+    annotations = pd.DataFrame({
+        'Shelter Name': ['SHELTER A', 'DEKALB COUNTY ANIMAL SERVICES', 'Shared Shelter', 'SHELTER A',
+                         'DEKALB COUNTY ANIMAL SERVICES', 'SHELTER C'],
+        'Shelter Name Annotation': [np.nan, np.nan, 'R', np.nan, np.nan, 'R'],
+    })
+    best_friends = pd.DataFrame({
+        'Shelter Name': ['SHARED SHELTER', 'The Haven', 'The Haven'],
+        'EIN': ['nan', '63-1253853', '63-1253853'],
+        'Organization Type': ['Shelter', 'Rescue', 'Rescue'],
+        'City': ['Atlanta', 'Fairhope', 'Fairhope'],
+        'State': [np.nan, 'AL', 'AL'],
+        'Zip Code': [30301, 36532, 36532],
+        'County': ['Fulton County', 'Baldwin County', 'Baldwin County'],
+        'Data Year': [2022, 2023, 'No Data from 2023, 2022, or 2021'],
+        'Total Intake Gross': [12.0, 403.0, np.nan],
+        'Canine Total Intake Gross': [5.0, np.nan, 160.0],
+    })
+    return annotations, best_friends
+
+def batch_cube(georgia_path, annotations, best_friends, audit_path):
+    return batch_cube_from_frame(coerce_georgia_types(parse_georgia_headers(pd.read_excel(georgia_path))),
+                                 annotations, best_friends, audit_path)
+
+def batch_cube_from_frame(georgia, annotations, best_friends, audit_path, measures=MEASURES):
+    index = {}
+    for frame in [georgia, annotations, best_friends]:
+        update_shelter_index(index, frame['Shelter Name'])
+    georgia, _ = join_annotations(georgia, annotations, index)
+    combined, _ = join_best_friends(georgia, best_friends, index)
+    combined = clean_combined(combined)
+    return build_cube(fix_data_entry_mistakes(combined, audit_path), measures)
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 100])
+def test_stream_cube_matches_batch_pipeline(georgia_workbook, sources, chunk_size, tmp_path):
+    annotations, best_friends = sources
+    expected = batch_cube(georgia_workbook, annotations, best_friends, str(tmp_path / 'audit.csv'))
+
+    model = fit_stream_baselines(iter_georgia_chunks(georgia_workbook, chunk_size))
+    writer = CombinedWriter(str(tmp_path / 'combined'))
+    cube, summary = stream_cube(iter_georgia_chunks(georgia_workbook, chunk_size), annotations, best_friends, {},
+                                measures=MEASURES, model=model, writer=writer)
+    assert (summary['rows'], summary['chunks']) == (5, -(-5 // chunk_size))
+    assert summary['audit'].empty
+    pd.testing.assert_frame_equal(cube, expected)
+
+    # The combined dataset written chunk by chunk holds the rows of the cube
+    combined = read_combined(writer.close(), include_duplicates=True)
+    pd.testing.assert_frame_equal(build_cube(combined, MEASURES), expected)
+
+def test_stream_repairs_outliers_as_batch_pipeline(tmp_path):
+    georgia_sheet = synthetic_georgia(2000)
+    annotations = synthetic_annotations(georgia_sheet)
+    best_friends = synthetic_best_friends(1000, 2000)
+    georgia = coerce_georgia_types(parse_georgia_headers(georgia_sheet))
+    georgia.loc[10, 'Canine stray at large'] = 5000
+    path = str(tmp_path / 'georgia.parquet')
+    georgia.to_parquet(path)
+
+    measures = [column for column in cube_measures if column in georgia.columns or column in best_friends.columns]
+    expected = batch_cube_from_frame(georgia.copy(), annotations, best_friends, str(tmp_path / 'audit.csv'), measures)
+
+    model = fit_stream_baselines(iter_georgia_chunks(path, 300))
+    cube, summary = stream_cube(iter_georgia_chunks(path, 300), annotations, best_friends, {}, measures=measures,
+                                model=model)
+    pd.testing.assert_frame_equal(cube, expected)
+    assert 5000 in summary['audit']['value'].tolist()
+
+def test_stream_parquet_row_groups(georgia_workbook, sources, tmp_path):
+    annotations, best_friends = sources
+    path = str(tmp_path / 'georgia.parquet')
+    coerce_georgia_types(parse_georgia_headers(pd.read_excel(georgia_workbook))).to_parquet(path, row_group_size=2)
+
+    chunks = list(iter_georgia_chunks(path, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+
+    expected = batch_cube(georgia_workbook, annotations, best_friends, str(tmp_path / 'audit.csv'))
+    cube, _ = stream_cube(chunks, annotations, best_friends, {}, measures=MEASURES)
+    pd.testing.assert_frame_equal(cube, expected)
+
+def test_download_workbook_through_the_cache(georgia_workbook, tmp_path):
+    georgia_workbook = tmp_path / 'georgia.xlsx'
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(tmp_path))
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/{georgia_workbook.name}"
+        cache_dir = str(tmp_path / 'cache')
+        path = download_workbook(url, cache_dir=cache_dir)
+        assert path.endswith('.xlsx') and open(path, 'rb').read() == georgia_workbook.read_bytes()
+
+        # An unchanged source is not downloaded again
+        with patch('dataset_cache.download_file', side_effect=AssertionError('downloaded')):
+            assert download_workbook(url, cache_dir=cache_dir) == path
+
+        # A changed source replaces the earlier copy
+        georgia_workbook.write_bytes(georgia_workbook.read_bytes() + b'\0')
+        os.utime(georgia_workbook, (os.path.getmtime(georgia_workbook) + 10,) * 2)
+        changed = download_workbook(url, cache_dir=cache_dir)
+        assert changed != path and not os.path.exists(path)
+        assert download_workbook(url, cache_dir=cache_dir, offline=True) == changed
+    finally:
+        close_connections()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,87 @@
+import json
+import time
+import pytest
+import pandas as pd
+import numpy as np
+import dataset_pipeline
+import dataset_trace
+from dataset_pipeline import run_pipeline
+from dataset_trace import count_rows, disable_tracing, enable_tracing, span
+
+@pytest.fixture(autouse=True)
+def no_tracing():
+    yield
+    disable_tracing()
+
+def toy_load():
+    return {'georgia': pd.DataFrame({'Count': [1, 2, 3]})}
+
+def toy_double(frames):
+    return pd.concat([frames['georgia']] * 2, ignore_index=True)
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_span_is_a_no_op_when_tracing_is_off():
+    assert dataset_trace.get_tracer() is None
+    with span('merge') as record:
+        pass
+    assert record is None
+
+def test_pipeline_stages_are_traced_as_json_lines(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dataset_pipeline, 'STAGES', {'load': (toy_load, []), 'double': (toy_double, ['load'])})
+    enable_tracing(str(tmp_path / 'trace.jsonl'))
+
+    run_pipeline(stage='double', cache_dir=str(tmp_path / 'cache'))
+    run_pipeline(stage='double', cache_dir=str(tmp_path / 'cache'))
+
+    records = read_jsonl(tmp_path / 'trace.jsonl')
+    assert [(record['name'], record.get('cached')) for record in records] == [
+        ('load', False), ('double', False), ('pipeline', None),
+        ('load', False), ('double', True), ('pipeline', None),
+    ]
+    assert records[0]['rows'] == {'georgia': 3}
+    assert records[1]['rows'] == 6
+    assert all(record['wall_seconds'] >= 0 and record['cpu_seconds'] >= 0 for record in records)
+    assert records[-1]['peak_rss_mb'] > 0
+    assert records[-1]['process_peak_rss_mb'] > 0
+
+def test_peak_memory_of_each_span(tmp_path):
+    if dataset_trace.current_rss_mb() is None:
+        pytest.skip('the resident set size is not available')
+    enable_tracing(str(tmp_path / 'trace.jsonl'))
+    with span('allocate'):
+        block = np.ones(200 * 1024 * 1024 // 8)
+        time.sleep(0.2)
+        del block
+    with span('idle'):
+        time.sleep(0.2)
+
+    allocate, idle = read_jsonl(tmp_path / 'trace.jsonl')
+    # The 200 MB block was freed before the span ended; only the samples saw it
+    assert allocate['peak_rss_mb'] - max(allocate['rss_before_mb'], allocate['rss_mb']) > 150
+    # The next span does not inherit the process peak
+    assert idle['peak_rss_mb'] < allocate['peak_rss_mb'] - 150
+    assert idle['process_peak_rss_mb'] - idle['peak_rss_mb'] > 150
+
+def test_chrome_trace_format(tmp_path):
+    path = tmp_path / 'trace.json'
+    enable_tracing(str(path))
+    with span('outliers', rows=10):
+        pass
+    dataset_trace.emit({'name': 'render.Canine_Outcomes', 'category': 'render', 'start': 100.0, 'wall_seconds': 0.5,
+                        'pid': 42, 'tid': 0})
+
+    # The closing bracket of the JSON Array Format is optional
+    events = json.loads(path.read_text().rstrip().rstrip(',') + ']')
+    assert [event['name'] for event in events] == ['outliers', 'render.Canine_Outcomes']
+    assert events[0]['ph'] == 'X' and events[0]['args']['rows'] == 10
+    assert events[1]['ts'] == 100.0 * 1e6 and events[1]['dur'] == 0.5 * 1e6 and events[1]['pid'] == 42
+
+def test_count_rows():
+    df = pd.DataFrame({'a': [1, 2]})
+    assert count_rows(df) == 2
+    assert count_rows({'x': df, 'index': {'A': 1}}) == {'x': 2}
+    assert count_rows('figure.png') is None
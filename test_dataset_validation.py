@@ -0,0 +1,88 @@
+import time
+import pytest
+import pandas as pd
+import numpy as np
+from dataset_adapters import GeorgiaExportAdapter
+from dataset_validation import SchemaError, validate_source
+
+COUNTS = ['Canine stray at large', 'Feline stray at large']
+
+def georgia_df(rows=4):
+    df = pd.DataFrame({
+        'Shelter Name': ['SHELTER %d' % (i % 2) for i in range(rows)],
+        'License Number': ['L%d' % (i % 2) for i in range(rows)],
+        'Report Period Start': ['2022-%02d-01' % (i % 12 + 1) for i in range(rows)],
+        'Report Period End': ['2022-%02d-28' % (i % 12 + 1) for i in range(rows)],
+    })
+    for column in COUNTS:
+        df[column] = np.arange(rows)
+    return df
+
+def problems(df, kind='georgia'):
+    with pytest.raises(SchemaError) as error:
+        validate_source(kind, df)
+    return error.value.problems
+
+def test_valid_sources_pass_unchanged():
+    df = georgia_df()
+    assert validate_source('georgia', df) is df
+
+    best_friends = pd.DataFrame({'Shelter Name': ['The Haven'], 'EIN': ['63-1253853'], 'Organization Type': ['Rescue'],
+                                 'City': ['Fairhope'], 'State': ['AL'], 'Zip Code': [36532],
+                                 'County': ['Baldwin County'], 'Data Year': [2023],
+                                 'Total Intake Gross': pd.Series(['NaN'], dtype=object),
+                                 'Canine Total Intake Gross': [np.nan]})
+    # The pipeline zero-fills missing Best Friends counts
+    assert validate_source('best_friends', best_friends) is best_friends
+
+def test_missing_and_repeated_columns():
+    assert problems(georgia_df().drop(columns='License Number')) == ['missing columns: License Number']
+
+    # A shifted layout reads a count into a descriptive column's name twice
+    df = georgia_df()
+    df.columns = COUNTS[:1] + df.columns[1:].tolist()
+    assert problems(df) == ['missing columns: Shelter Name', 'repeated columns: Canine stray at large']
+
+def test_count_values():
+    df = georgia_df().astype({'Canine stray at large': object, 'Feline stray at large': float})
+    df.loc[1, 'Canine stray at large'] = 'n/a'
+    df.loc[2, 'Canine stray at large'] = -1
+    df.loc[3, 'Feline stray at large'] = 2.5
+    df.loc[0, 'Feline stray at large'] = np.nan
+    assert problems(df) == [
+        "Canine stray at large: 1 non-numeric values (row 1: 'n/a')",
+        "Canine stray at large: 1 negative values (row 2: -1)",
+        "Feline stray at large: 1 missing values (row 0: nan)",
+        "Feline stray at large: 1 fractional values (row 3: 2.5)",
+    ]
+
+    with pytest.raises(SchemaError, match='values above 2'):
+        validate_source('georgia', georgia_df(), max_count=2)
+
+def test_report_periods():
+    df = georgia_df()
+    df.loc[0, 'Report Period Start'] = 'last month'
+    df.loc[1, 'Report Period End'] = '2021-12-31'
+    assert problems(df) == [
+        "Report Period Start: 1 values that are not dates (row 0: 'last month')",
+        "Report Period End: 1 periods ending before they start (row 1: '2021-12-31')",
+    ]
+
+def test_adapter_fails_before_typing(tmp_path, monkeypatch):
+    df = georgia_df()
+    df.loc[2, 'Feline stray at large'] = 'twelve'
+    path = tmp_path / 'georgia.xlsx'
+    df.to_excel(path, index=False)
+
+    converted = []
+    monkeypatch.setattr(GeorgiaExportAdapter, 'convert', lambda self, df: converted.append(df))
+    with pytest.raises(SchemaError, match="Feline stray at large: 1 non-numeric values") as error:
+        GeorgiaExportAdapter('georgia', str(path)).load()
+    assert error.value.source == 'georgia'
+    assert converted == []
+
+def test_validation_is_fast():
+    df = georgia_df(200000)
+    start = time.perf_counter()
+    validate_source('georgia', df)
+    assert time.perf_counter() - start < 2
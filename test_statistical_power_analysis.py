@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+import statsmodels.stats.power as smp
+import statistical_power_analysis
+from statistical_power_analysis import (clear_cache, power_curves, power_values, sample_size_grid, solve_nobs1,
+                                        statsmodels_nobs1)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_cache()
+    yield
+    clear_cache()
+
+def test_single_design_matches_statsmodels():
+    grid = sample_size_grid([0.2], [0.01], [0.8])
+    expected = smp.TTestIndPower().solve_power(effect_size=0.2, alpha=0.01, power=0.8, alternative='two-sided')
+    assert grid['nobs1'].iloc[0] == pytest.approx(expected, rel=1e-6)
+    assert grid['total_nobs'].iloc[0] == 2 * np.ceil(expected)
+    assert grid['solver'].iloc[0] == 'vectorized'
+
+@pytest.mark.parametrize('test', ['ttest_ind', 'ttest', 'ztest_ind', 'ztest'])
+@pytest.mark.parametrize('alternative', ['two-sided', 'larger'])
+def test_grid_matches_statsmodels(test, alternative):
+    grid = sample_size_grid([0.3, 0.5, 0.8], [0.05, 0.01], [0.8, 0.9], [test], ratios=[1.0, 2.0],
+                            alternatives=[alternative])
+    for row in grid.itertuples():
+        expected = statsmodels_nobs1((test, alternative, row.effect_size, row.corrected_alpha, row.power, row.ratio))
+        assert row.nobs1 == pytest.approx(expected, rel=1e-5)
+    # The power at the solved sample sizes is the target power
+    for ratio, rows in grid.groupby('ratio'):
+        achieved = power_values(test, rows['effect_size'], rows['nobs1'], rows['corrected_alpha'], ratio, alternative)
+        np.testing.assert_allclose(achieved, rows['power'], atol=1e-8)
+
+def test_smaller_alternative_with_negative_effect():
+    nobs1 = solve_nobs1('ttest_ind', np.array([-0.4]), np.array([0.05]), np.array([0.8]), np.array([1.0]), 'smaller')
+    expected = smp.TTestIndPower().solve_power(effect_size=-0.4, alpha=0.05, power=0.8, alternative='smaller')
+    assert nobs1[0] == pytest.approx(expected, rel=1e-6)
+
+def test_bonferroni_correction():
+    grid = sample_size_grid([0.5], [0.05], [0.8], comparisons=[1, 5])
+    assert grid['corrected_alpha'].tolist() == [0.05, 0.01]
+    single = sample_size_grid([0.5], [0.01], [0.8])
+    assert grid['nobs1'].iloc[1] == single['nobs1'].iloc[0]
+    assert grid['nobs1'].iloc[1] > grid['nobs1'].iloc[0]
+
+def test_one_sample_tests_ignore_ratio():
+    grid = sample_size_grid([0.5], tests=['ttest'], ratios=[1.0, 2.0])
+    assert len(grid) == 1
+    assert grid['ratio'].iloc[0] == 0 and grid['nobs2'].iloc[0] == 0
+
+def test_solved_scenarios_are_memoized(monkeypatch):
+    first = sample_size_grid([0.2, 0.5], [0.05], [0.8])
+
+    def fail(*args, **kwargs):
+        raise AssertionError('solved again')
+
+    monkeypatch.setattr(statistical_power_analysis, 'solve_nobs1', fail)
+    second = sample_size_grid([0.5, 0.2], [0.05], [0.8])
+    assert second['nobs1'].tolist() == first['nobs1'].tolist()[::-1]
+
+def test_unsolved_scenarios_fall_back_to_statsmodels(monkeypatch):
+    monkeypatch.setattr(statistical_power_analysis, 'solve_nobs1', lambda test, d, *args: np.full(len(d), np.nan))
+    grid = sample_size_grid([0.2, 0.5], [0.05], [0.8], workers=1)
+    assert grid['solver'].tolist() == ['statsmodels', 'statsmodels']
+    expected = [smp.TTestIndPower().solve_power(effect_size=d, alpha=0.05, power=0.8) for d in [0.2, 0.5]]
+    np.testing.assert_allclose(grid['nobs1'], expected)
+
+def test_power_in_the_far_tails():
+    # statsmodels returns NaN here; the power is 1 to double precision
+    power = power_values('ttest_ind', 0.5, np.array([50.0, 5000.0]), 0.0002)
+    assert power[1] == 1.0
+    assert 0 < power[0] < 1
+
+def test_power_curves():
+    curves = power_curves([0.2, 0.5], np.arange(5, 200, 5), alpha=0.05)
+    assert curves.shape == (39, 2)
+    assert (curves.diff().dropna() > 0).all().all()
+    assert (curves[0.5] > curves[0.2]).all()